@@ -0,0 +1,202 @@
+"""本地 Ollama 替身服务，用于压测时排除真实模型的耗时波动
+
+支持 /api/generate、/api/chat（流式与非流式）、/api/embed、/api/tags，以及与 Ollama 相同的
+OpenAI 兼容接口 /v1/chat/completions 和 /v1/models，首 token 延迟、
+token 间隔、回复长度和每个提示词 token 的预填充耗时均可配置。/api/generate 返回的 context
+为请求的 context 加上本次提示词和回复，带 context 的请求只按新的提示词计算预填充耗时。向量由词的哈希确定，包含相同词的文本相似度更高。
+
+    python benchmarks/fake_ollama.py --port 11434 --first-token-delay 0.2 --token-delay 0.02 --tokens 64
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+import argparse
+import hashlib
+import json
+import threading
+import time
+
+
+EMBEDDING_DIM = 64
+
+
+def fake_embedding(text: str) -> List[float]:
+    """按词哈希累加的确定性向量"""
+    vector = [0.0] * EMBEDDING_DIM
+    for word in text.lower().split():
+        digest = hashlib.md5(word.encode("utf-8")).digest()
+        vector[digest[0] % EMBEDDING_DIM] += 1.0 if digest[1] & 1 else -1.0
+    return vector
+
+
+class FakeOllamaServer:
+    """在后台线程中运行的 Ollama 兼容 HTTP 服务"""
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 11434,
+        first_token_delay: float = 0.2,
+        token_delay: float = 0.02,
+        tokens: int = 64,
+        prompt_token_delay: float = 0
+    ):
+        self.first_token_delay = first_token_delay
+        self.prompt_token_delay = prompt_token_delay
+        self.token_delay = token_delay
+        self.tokens = tokens
+        self.requests = 0
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeOllamaServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-ollama", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+            def _send_json(self, payload: Dict[str, Any]) -> None:
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _write_chunk(self, payload: Dict[str, Any]) -> None:
+                data = (json.dumps(payload) + "\n").encode("utf-8")
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+
+            def do_GET(self) -> None:
+                if self.path.startswith("/api/tags"):
+                    self._send_json({"models": []})
+                elif self.path.startswith("/v1/models"):
+                    self._send_json({"object": "list", "data": []})
+                else:
+                    self.send_error(404)
+
+            def do_POST(self) -> None:
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                if self.path == "/api/embed":
+                    inputs = request.get("input") or []
+                    if isinstance(inputs, str):
+                        inputs = [inputs]
+                    self._send_json({"model": request.get("model"), "embeddings": [fake_embedding(text) for text in inputs]})
+                    return
+                if self.path not in ("/api/generate", "/api/chat", "/v1/chat/completions"):
+                    self.send_error(404)
+                    return
+                server.requests += 1
+                if self.path == "/v1/chat/completions":
+                    self._openai_chat(request)
+                    return
+                chat = self.path == "/api/chat"
+                prompt = request.get("prompt") or json.dumps(request.get("messages", []))
+                num_predict = (request.get("options") or {}).get("num_predict") or server.tokens
+                count = max(1, min(server.tokens, int(num_predict)))
+                words = [f" tok{i}" for i in range(count)]
+                prompt_tokens = max(1, len(prompt) // 4)
+                context = list(request.get("context") or []) + [7] * prompt_tokens + list(range(count))
+
+                def chunk(text: str, done: bool) -> Dict[str, Any]:
+                    payload: Dict[str, Any] = {"model": request.get("model"), "done": done}
+                    if chat:
+                        payload["message"] = {"role": "assistant", "content": text}
+                    else:
+                        payload["response"] = text
+                    if done:
+                        payload.update({
+                            "done_reason": "stop",
+                            "prompt_eval_count": prompt_tokens,
+                            "eval_count": count,
+                            "context": context,
+                        })
+                    return payload
+
+                time.sleep(server.first_token_delay + server.prompt_token_delay * prompt_tokens)
+                if request.get("stream", True) is False:
+                    time.sleep(server.token_delay * (count - 1))
+                    self._send_json(chunk("".join(words), True))
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for i, word in enumerate(words):
+                    if i:
+                        time.sleep(server.token_delay)
+                    self._write_chunk(chunk(word, False))
+                self._write_chunk(chunk("", True))
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+
+            def _openai_chat(self, request: Dict[str, Any]) -> None:
+                count = max(1, min(server.tokens, int(request.get("max_tokens") or server.tokens)))
+                words = [f" tok{i}" for i in range(count)]
+                time.sleep(server.first_token_delay)
+                if not request.get("stream"):
+                    time.sleep(server.token_delay * (count - 1))
+                    self._send_json({
+                        "object": "chat.completion",
+                        "model": request.get("model"),
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(words)}, "finish_reason": "stop"}],
+                        "usage": {"completion_tokens": count},
+                    })
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for i, word in enumerate(words):
+                    if i:
+                        time.sleep(server.token_delay)
+                    chunk = {"object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"content": word}}]}
+                    data = f"data: {json.dumps(chunk)}\n\n".encode("utf-8")
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                    self.wfile.flush()
+                data = b"data: [DONE]\n\n"
+                self.wfile.write(b"%x\r\n%s\r\n0\r\n\r\n" % (len(data), data))
+                self.wfile.flush()
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Ollama server for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--first-token-delay", type=float, default=0.2, help="首 token 延迟（秒）")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="token 间隔（秒）")
+    parser.add_argument("--tokens", type=int, default=64, help="每次回复的 token 数")
+    parser.add_argument("--prompt-token-delay", type=float, default=0, help="每个提示词 token 的预填充耗时（秒）")
+    args = parser.parse_args()
+
+    fake = FakeOllamaServer(
+        args.host, args.port, args.first_token_delay, args.token_delay, args.tokens, args.prompt_token_delay
+    )
+    print(f"Fake Ollama listening on {fake.url}")
+    try:
+        fake._server.serve_forever()
+    except KeyboardInterrupt:
+        fake.stop()
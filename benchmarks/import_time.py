@@ -0,0 +1,136 @@
+"""应用导入耗时基准
+
+在全新的子进程中多次执行 `python -X importtime -c "import main"`，输出导入总耗时的
+中位数、耗时最多的顶层模块，并检查启动时不应导入的重量级依赖（langchain、numpy 等）。
+超过 --max-ms 或导入了禁止的模块时以非零状态退出，可放在 CI 中防止启动变慢。
+
+    python benchmarks/import_time.py --runs 5 --output import.json
+    python benchmarks/import_time.py --runs 5 --compare import.json --max-ms 1500
+"""
+from typing import Any, Dict, List, Tuple
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 只应在第一次使用时加载的模块
+DEFERRED_MODULES = ("langchain", "langchain_core", "langchain_ollama", "ollama", "httpx", "numpy", "pymilvus")
+
+# 在子进程中导入 main，记录真正执行过的模块；utils.lazy 创建的延迟模块单独列出
+_PROBE = """
+import importlib.util, json, sys, time
+started = time.perf_counter()
+import main
+elapsed = time.perf_counter() - started
+lazy = sorted(name for name, module in sys.modules.items() if isinstance(module, importlib.util._LazyModule))
+loaded = sorted({name.split(".")[0] for name in sys.modules if name not in lazy})
+print(json.dumps({"elapsed": elapsed, "loaded": loaded, "lazy": lazy}))
+"""
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int]]:
+    """解析 -X importtime 输出，返回 (模块, 自身耗时us, 累计耗时us)"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((name.rstrip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def run_once(env: Dict[str, str]) -> Dict[str, Any]:
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _PROBE],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    probe = json.loads(process.stdout.strip().splitlines()[-1])
+    rows = parse_importtime(process.stderr)
+    # main 直接导入的模块（-X importtime 每层缩进两个空格）
+    top_level = [
+        (name.strip(), cumulative) for name, _, cumulative in rows
+        if len(name) - len(name.lstrip()) == 3
+    ]
+    return {"elapsed_ms": probe["elapsed"] * 1000, "loaded": probe["loaded"], "lazy": probe["lazy"], "top": top_level}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure the import time of main.py")
+    parser.add_argument("--runs", type=int, default=5, help="子进程运行次数，取中位数")
+    parser.add_argument("--top", type=int, default=15, help="输出耗时最多的模块数")
+    parser.add_argument("--max-ms", type=float, default=0, help="导入耗时中位数上限（毫秒），0 表示不检查")
+    parser.add_argument("--output", help="结果 JSON 文件路径（默认输出到标准输出）")
+    parser.add_argument("--compare", help="用于比较的基线结果 JSON")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    # 导入 main 时不连接任何外部服务，这里只需要一个可解析的数据库地址
+    env.setdefault("ASYNC_DATABASE_URL", "sqlite+aiosqlite:///./import_time.db")
+    runs = [run_once(env) for _ in range(args.runs)]
+
+    elapsed = sorted(run["elapsed_ms"] for run in runs)
+    modules: Dict[str, List[int]] = {}
+    for run in runs:
+        for name, cumulative in run["top"]:
+            modules.setdefault(name, []).append(cumulative)
+    top = sorted(
+        ((name, statistics.median(values) / 1000) for name, values in modules.items()),
+        key=lambda item: item[1], reverse=True
+    )[:args.top]
+    eager = sorted(set(runs[-1]["loaded"]) & set(DEFERRED_MODULES))
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "commit": subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True
+            ).stdout.strip() or None,
+            "runs": args.runs,
+        },
+        "import_ms": {
+            "median": round(statistics.median(elapsed), 2),
+            "min": round(elapsed[0], 2),
+            "max": round(elapsed[-1], 2),
+        },
+        "top_modules_ms": {name: round(ms, 2) for name, ms in top},
+        "eager_heavy_modules": eager,
+        "lazy_modules": runs[-1]["lazy"],
+    }
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        before, now = baseline["import_ms"]["median"], report["import_ms"]["median"]
+        change = (now - before) / before * 100 if before else 0.0
+        print(
+            f"\nCompared with {args.compare} (commit {baseline['meta'].get('commit')}): "
+            f"import {before:.2f} -> {now:.2f} ms ({change:+.1f}%)",
+            file=sys.stderr
+        )
+
+    failed = False
+    if eager:
+        print(f"Heavy modules imported at startup: {', '.join(eager)}", file=sys.stderr)
+        failed = True
+    if args.max_ms and report["import_ms"]["median"] > args.max_ms:
+        print(f"Import time {report['import_ms']['median']:.2f} ms exceeds {args.max_ms:.2f} ms", file=sys.stderr)
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,510 @@
+"""可复现的接口压测
+
+在进程内启动 FastAPI 应用（默认 SQLite，可指定本地 MySQL）和本地 Ollama 替身，
+按权重混合驱动登录、创建对话、发送消息（普通/流式）和读取历史，输出每个接口的
+p50/p95/p99 延迟、RPS、首 token 时间和每次请求的 SQL 语句数（JSON），
+便于在不同提交之间比较。
+
+    python benchmarks/run_benchmark.py --duration 30 --concurrency 16 --output bench.json
+    python benchmarks/run_benchmark.py --database-url mysql+aiomysql://root:pw@localhost/bench --compare bench.json
+
+应用需要 Redis（REDIS_HOST 等环境变量）；没有 Redis 时可加 --fake-redis 使用
+fakeredis，此时结果不包含 Redis 的网络开销。
+"""
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.fake_ollama import FakeOllamaServer  # noqa: E402
+
+DEFAULT_MIX = "login=1,create_conversation=1,post_message=3,stream_message=3,read_history=12"
+QUESTIONS = [
+    "什么是向量数据库？",
+    "帮我写一段 Python 代码读取 CSV 文件",
+    "Explain the difference between TCP and UDP",
+    "总结一下上面的对话",
+    "How do I paginate a SQL query efficiently?",
+]
+
+# 当前请求的 SQL 计数器，由中间件设置、SQLAlchemy 事件累加
+_query_counter: ContextVar[Optional[List[int]]] = ContextVar("bench_query_counter", default=None)
+
+
+class QueryCountMiddleware:
+    """按 X-Bench-Endpoint 请求头统计每次请求执行的 SQL 语句数"""
+
+    def __init__(self, app: Any, stats: Dict[str, List[int]]):
+        self.app = app
+        self.stats = stats
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        endpoint = headers.get(b"x-bench-endpoint", b"other").decode("latin-1")
+        counter = [0]
+        token = _query_counter.set(counter)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _query_counter.reset(token)
+            self.stats.setdefault(endpoint, []).append(counter[0])
+
+
+def percentile(values: List[float], p: float) -> float:
+    """线性插值百分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * p / 100
+    low, high = math.floor(rank), math.ceil(rank)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    return {
+        "p50": round(percentile(values, 50), 2),
+        "p95": round(percentile(values, 95), 2),
+        "p99": round(percentile(values, 99), 2),
+        "mean": round(sum(values) / len(values), 2) if values else 0.0,
+        "max": round(max(values), 2) if values else 0.0,
+    }
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        weights[name.strip()] = float(weight or 1)
+    unknown = set(weights) - set(Workload.OPERATIONS)
+    if unknown:
+        raise SystemExit(f"Unknown operations in --mix: {', '.join(sorted(unknown))}")
+    return weights
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+class AppServer:
+    """在后台线程中运行 uvicorn，并挂载 SQL 计数"""
+
+    def __init__(self, port: int, fake_redis: bool):
+        import uvicorn
+        from sqlalchemy import event
+        from main import app
+        from models.base import async_engine
+
+        self.query_stats: Dict[str, List[int]] = {}
+        self.unattributed_queries = 0
+
+        @event.listens_for(async_engine.sync_engine, "before_cursor_execute")
+        def count_query(*args: Any) -> None:
+            counter = _query_counter.get()
+            if counter is None:
+                self.unattributed_queries += 1
+            else:
+                counter[0] += 1
+
+        app.add_middleware(QueryCountMiddleware, stats=self.query_stats)
+        self.fake_redis = fake_redis
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        self.url = f"http://127.0.0.1:{port}"
+        self._thread = threading.Thread(target=self._run, name="bench-app", daemon=True)
+
+    def _run(self) -> None:
+        if self.fake_redis:
+            import fakeredis
+            import core.redis
+            core.redis._redis = fakeredis.FakeAsyncRedis()
+        self.server.run()
+
+    def start(self) -> None:
+        self._thread.start()
+        deadline = time.monotonic() + 30
+        while not self.server.started:
+            if not self._thread.is_alive() or time.monotonic() > deadline:
+                raise SystemExit("Application server failed to start")
+            time.sleep(0.05)
+
+    def stop(self) -> None:
+        self.server.should_exit = True
+        self._thread.join(timeout=30)
+
+
+class Workload:
+    """单个虚拟用户的请求序列"""
+
+    OPERATIONS = ("login", "create_conversation", "post_message", "stream_message", "read_history")
+
+    def __init__(self, client: Any, email: str, password: str, model_id: int, rng: random.Random, results: Dict[str, Dict[str, List]]):
+        self.client = client
+        self.email = email
+        self.password = password
+        self.model_id = model_id
+        self.rng = rng
+        self.results = results
+        self.headers: Dict[str, str] = {}
+        self.conversations: List[str] = []
+
+    def _record(self, op: str, started: float, ok: bool, ttft: Optional[float] = None) -> None:
+        entry = self.results.setdefault(op, {"latency": [], "ttft": [], "errors": 0, "count": 0})
+        entry["count"] += 1
+        if not ok:
+            entry["errors"] += 1
+            return
+        entry["latency"].append((time.perf_counter() - started) * 1000)
+        if ttft is not None:
+            entry["ttft"].append(ttft * 1000)
+
+    def _bench_headers(self, op: str) -> Dict[str, str]:
+        return dict(self.headers, **{"X-Bench-Endpoint": op})
+
+    async def setup(self) -> None:
+        await self.login(record=False)
+        await self.create_conversation(record=False)
+
+    async def run(self, op: str) -> None:
+        await getattr(self, op)()
+
+    async def login(self, record: bool = True) -> None:
+        started = time.perf_counter()
+        response = await self.client.post(
+            "/api/v1/token",
+            data={"username": self.email, "password": self.password},
+            headers={"X-Bench-Endpoint": "login" if record else "setup"}
+        )
+        ok = response.status_code == 200
+        if ok:
+            self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        elif not record:
+            raise SystemExit(f"Login failed during setup: {response.status_code} {response.text}")
+        if record:
+            self._record("login", started, ok)
+
+    async def create_conversation(self, record: bool = True) -> None:
+        started = time.perf_counter()
+        response = await self.client.post(
+            "/api/v1/chat/conversations",
+            json={"title": f"bench-{self.rng.randrange(10 ** 6)}", "model_id": self.model_id},
+            headers=self._bench_headers("create_conversation" if record else "setup")
+        )
+        ok = response.status_code == 200
+        if ok:
+            self.conversations.append(response.json()["conversation_id"])
+        elif not record:
+            raise SystemExit(f"Creating conversation failed during setup: {response.status_code} {response.text}")
+        if record:
+            self._record("create_conversation", started, ok)
+
+    def _question(self) -> str:
+        return f"{self.rng.choice(QUESTIONS)} #{self.rng.randrange(10 ** 6)}"
+
+    async def post_message(self) -> None:
+        started = time.perf_counter()
+        response = await self.client.post(
+            f"/api/v1/chat/conversations/{self.rng.choice(self.conversations)}/messages",
+            json={"content": self._question()},
+            headers=self._bench_headers("post_message")
+        )
+        self._record("post_message", started, response.status_code == 200)
+
+    async def stream_message(self) -> None:
+        started = time.perf_counter()
+        ttft = None
+        ok = False
+        async with self.client.stream(
+            "POST",
+            f"/api/v1/chat/conversations/{self.rng.choice(self.conversations)}/messages/stream",
+            json={"content": self._question()},
+            headers=self._bench_headers("stream_message")
+        ) as response:
+            if response.status_code == 200:
+                async for line in response.aiter_lines():
+                    if line == "event: token" and ttft is None:
+                        ttft = time.perf_counter() - started
+                    elif line == "event: done":
+                        ok = True
+                    elif line == "event: error":
+                        break
+            else:
+                await response.aread()
+        self._record("stream_message", started, ok, ttft)
+
+    async def read_history(self) -> None:
+        started = time.perf_counter()
+        response = await self.client.get(
+            f"/api/v1/chat/conversations/{self.rng.choice(self.conversations)}/messages",
+            params={"limit": 20},
+            headers=self._bench_headers("read_history")
+        )
+        self._record("read_history", started, response.status_code == 200)
+
+
+def configure_sqlite(busy_timeout_ms: int) -> None:
+    """SQLite 压测库使用 WAL 并设置 busy_timeout
+
+    默认的回滚日志模式下写事务会阻塞所有读，并发写入遇到锁时立即报 database is locked；
+    WAL 下读写互不阻塞，写入之间按 busy_timeout 等待。SQLite 仍只允许一个写事务，
+    写入密集时的结果不能代表 MySQL。
+    """
+    from sqlalchemy import event
+    from models.base import async_engine
+
+    @event.listens_for(async_engine.sync_engine, "connect")
+    def set_pragmas(dbapi_connection: Any, connection_record: Any) -> None:
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA busy_timeout={busy_timeout_ms}")
+        cursor.close()
+
+
+async def seed_model(args: argparse.Namespace) -> int:
+    """建表并写入压测使用的模型配置"""
+    from sqlalchemy import func, select
+    from init_db import init_async_db
+    from models.base import AsyncSessionLocal, async_engine
+    from models.ai_models import AiLLMConfiguration
+
+    await init_async_db()
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(AiLLMConfiguration).where(AiLLMConfiguration.llm_en_name == args.model_name))
+        model = result.scalars().first()
+        if model is None:
+            # SQLite 不会为 BIGINT 主键自增，显式分配
+            next_id = (await db.execute(select(func.coalesce(func.max(AiLLMConfiguration.llm_id), 0) + 1))).scalar()
+            model = AiLLMConfiguration(llm_id=next_id, llm_zh_name="压测模型", llm_en_name=args.model_name)
+            db.add(model)
+        model.is_local_llm = True
+        model.status = 1
+        model.max_tokens = args.tokens
+        # 默认启用采样，避免响应缓存让流量绕过模型
+        model.do_sample = not args.deterministic
+        model.temperature = 0 if args.deterministic else 0.7
+        await db.commit()
+        model_id = model.llm_id
+    # 压测在另一个线程的事件循环中进行，释放当前循环上的连接
+    await async_engine.dispose()
+    return model_id
+
+
+async def drive(args: argparse.Namespace, base_url: str, model_id: int) -> Dict[str, Any]:
+    import httpx
+
+    weights = parse_mix(args.mix)
+    operations, op_weights = list(weights), list(weights.values())
+    results: Dict[str, Dict[str, List]] = {}
+    password = "bench-password"
+    limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        # 注册用户（不计入结果）
+        emails = [f"bench-{args.seed}-{i}@example.com" for i in range(args.users)]
+        for email in emails:
+            response = await client.post(
+                "/api/v1/register",
+                json={"email": email, "password": password},
+                headers={"X-Bench-Endpoint": "setup"}
+            )
+            if response.status_code not in (200, 400):
+                raise SystemExit(f"Registering {email} failed: {response.status_code} {response.text}")
+
+        workers = [
+            Workload(client, emails[i % len(emails)], password, model_id, random.Random(args.seed + i), results)
+            for i in range(args.concurrency)
+        ]
+        await asyncio.gather(*(w.setup() for w in workers))
+
+        remaining = [args.requests] if args.requests else None
+        deadline = time.monotonic() + args.duration
+
+        async def loop(worker: Workload) -> None:
+            while True:
+                if remaining is not None:
+                    if remaining[0] <= 0:
+                        return
+                    remaining[0] -= 1
+                elif time.monotonic() >= deadline:
+                    return
+                op = worker.rng.choices(operations, op_weights)[0]
+                try:
+                    await worker.run(op)
+                except httpx.HTTPError:
+                    worker._record(op, time.perf_counter(), False)
+
+        started = time.monotonic()
+        await asyncio.gather(*(loop(w) for w in workers))
+        elapsed = time.monotonic() - started
+
+    return {"elapsed": elapsed, "results": results}
+
+
+def build_report(args: argparse.Namespace, run: Dict[str, Any], server: AppServer, fake: FakeOllamaServer) -> Dict[str, Any]:
+    elapsed = run["elapsed"]
+    endpoints = {}
+    total = errors = 0
+    for op, entry in sorted(run["results"].items()):
+        queries = server.query_stats.get(op, [])
+        endpoints[op] = {
+            "count": entry["count"],
+            "errors": entry["errors"],
+            "rps": round((entry["count"] - entry["errors"]) / elapsed, 2),
+            "latency_ms": summarize(entry["latency"]),
+            "db_queries_per_request": round(sum(queries) / len(queries), 2) if queries else 0.0,
+        }
+        if entry["ttft"]:
+            endpoints[op]["ttft_ms"] = summarize(entry["ttft"])
+        total += entry["count"]
+        errors += entry["errors"]
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "database": args.database_url.split("://", 1)[0],
+            "sqlite_busy_timeout_ms": args.sqlite_busy_timeout if args.database_url.startswith("sqlite") else None,
+            "fake_redis": args.fake_redis,
+            "config": {
+                "duration": args.duration,
+                "requests": args.requests,
+                "concurrency": args.concurrency,
+                "users": args.users,
+                "mix": args.mix,
+                "seed": args.seed,
+                "first_token_delay": args.first_token_delay,
+                "token_delay": args.token_delay,
+                "tokens": args.tokens,
+            },
+        },
+        "summary": {
+            "elapsed_s": round(elapsed, 2),
+            "requests": total,
+            "errors": errors,
+            "rps": round((total - errors) / elapsed, 2) if elapsed else 0.0,
+            "llm_requests": fake.requests,
+            "unattributed_db_queries": server.unattributed_queries,
+        },
+        "endpoints": endpoints,
+    }
+
+
+def compare(report: Dict[str, Any], baseline_path: str) -> None:
+    """与基线结果比较，输出 p95 延迟和 RPS 的变化"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\nCompared with {baseline_path} (commit {baseline['meta'].get('commit')}):", file=sys.stderr)
+    for op, current in report["endpoints"].items():
+        before = baseline["endpoints"].get(op)
+        if not before:
+            continue
+        p95_before, p95_now = before["latency_ms"]["p95"], current["latency_ms"]["p95"]
+        change = (p95_now - p95_before) / p95_before * 100 if p95_before else 0.0
+        print(
+            f"  {op:<20} p95 {p95_before:>9.2f} -> {p95_now:>9.2f} ms ({change:+.1f}%)  "
+            f"rps {before['rps']:>8.2f} -> {current['rps']:>8.2f}  "
+            f"queries {before['db_queries_per_request']} -> {current['db_queries_per_request']}",
+            file=sys.stderr
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the chat API against a fake Ollama server")
+    parser.add_argument("--database-url", default="sqlite+aiosqlite:///./benchmark.db",
+                        help="异步数据库连接，SQLite 文件会在开始前删除")
+    parser.add_argument("--duration", type=float, default=30, help="压测时长（秒）")
+    parser.add_argument("--requests", type=int, default=0, help="总请求数，设置后忽略 --duration")
+    parser.add_argument("--concurrency", type=int, default=8, help="并发虚拟用户数")
+    parser.add_argument("--users", type=int, default=8, help="注册的用户数")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="操作权重，如 login=1,read_history=10")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--timeout", type=float, default=120, help="单个请求超时（秒）")
+    parser.add_argument("--first-token-delay", type=float, default=0.2, help="模型首 token 延迟（秒）")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="模型 token 间隔（秒）")
+    parser.add_argument("--tokens", type=int, default=64, help="每次回复的 token 数")
+    parser.add_argument("--model-name", default="bench-model")
+    parser.add_argument("--deterministic", action="store_true", help="使用不采样的模型配置（会命中响应缓存）")
+    parser.add_argument("--bcrypt-rounds", type=int, help="覆盖 BCRYPT_ROUNDS")
+    parser.add_argument("--fake-redis", action="store_true", help="使用进程内 fakeredis 代替 Redis")
+    parser.add_argument("--sqlite-busy-timeout", type=int, default=5000, help="SQLite 等待写锁的时间（毫秒）")
+    parser.add_argument("--output", help="结果 JSON 文件路径（默认输出到标准输出）")
+    parser.add_argument("--compare", help="用于比较的基线结果 JSON")
+    parser.add_argument("--max-error-rate", type=float, default=0.01, help="失败请求比例超过该值时以非零状态退出")
+    args = parser.parse_args()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    if args.database_url.startswith("sqlite") and ":///" in args.database_url:
+        path = args.database_url.split(":///", 1)[1]
+        # 同时删除上次运行留下的 WAL 文件
+        for leftover in (path, f"{path}-wal", f"{path}-shm"):
+            if path and path != ":memory:" and os.path.exists(leftover):
+                os.remove(leftover)
+
+    fake = FakeOllamaServer(port=free_port(), first_token_delay=args.first_token_delay,
+                            token_delay=args.token_delay, tokens=args.tokens).start()
+
+    # 必须在导入应用模块之前设置
+    os.environ["ASYNC_DATABASE_URL"] = args.database_url
+    os.environ["OLLAMA_HOST"] = fake.url
+    if args.bcrypt_rounds:
+        os.environ["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+
+    if args.database_url.startswith("sqlite"):
+        configure_sqlite(args.sqlite_busy_timeout)
+    model_id = asyncio.run(seed_model(args))
+    server = AppServer(free_port(), args.fake_redis)
+    server.start()
+    try:
+        run = asyncio.run(drive(args, server.url, model_id))
+    finally:
+        server.stop()
+        fake.stop()
+
+    report = build_report(args, run, server, fake)
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    if args.compare:
+        compare(report, args.compare)
+
+    summary = report["summary"]
+    if summary["requests"] and summary["errors"] / summary["requests"] > args.max_error_rate:
+        # 大量失败时延迟和 RPS 没有参考价值
+        print(
+            f"\n{summary['errors']}/{summary['requests']} requests failed, "
+            f"above --max-error-rate {args.max_error_rate}; do not use these numbers",
+            file=sys.stderr
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from typing import List
+from typing import Dict, List
 from pydantic_settings import BaseSettings
 from pydantic import AnyHttpUrl
 import os
@@ -15,7 +15,12 @@ class Settings(BaseSettings):
     # Security
     SECRET_KEY: str = os.getenv("SECRET_KEY", "your-secret-key-here")
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 7  # 7 days
+    BCRYPT_ROUNDS: int = int(os.getenv("BCRYPT_ROUNDS", "12"))  # bcrypt 成本，修改后旧哈希在登录时自动重算
+    PASSWORD_HASH_WORKERS: int = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))  # 密码哈希线程数
+    PASSWORD_HASH_MAX_QUEUE: int = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "32"))  # 等待密码哈希的最大请求数
     
+    ADMIN_TOKEN: str = os.getenv("ADMIN_TOKEN", "")  # 请求头 X-Admin-Token 携带此值时才能访问运维接口（清除缓存、各类统计），为空则禁止访问
+
     # CORS
     ALLOWED_ORIGINS: List[AnyHttpUrl] = ["http://localhost:3000"]
     
@@ -26,15 +31,149 @@ class Settings(BaseSettings):
     MYSQL_PASSWORD: str = "Abcd1234"
     MYSQL_DB: str = "sadb"
     DATABASE_URL: str = f"mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DB}"
+    # 异步驱动：生产用 mysql+aiomysql / mysql+asyncmy，测试可用 sqlite+aiosqlite:///./test.db
+    ASYNC_DATABASE_URL: str = os.getenv(
+        "ASYNC_DATABASE_URL",
+        f"mysql+aiomysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DB}"
+    )
+    
+    # Database pool
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "5"))  # 连接池大小
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "10"))  # 超过pool_size后最多可以创建的连接数
+    DB_POOL_TIMEOUT: int = int(os.getenv("DB_POOL_TIMEOUT", "30"))  # 等待可用连接的超时时间（秒）
+    DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # 连接回收时间（秒）
+    DB_ECHO: bool = os.getenv("DB_ECHO", "false").lower() == "true"  # 输出SQL语句，用于调试
     
     # Milvus
     MILVUS_HOST: str = os.getenv("MILVUS_HOST", "localhost")
     MILVUS_PORT: int = int(os.getenv("MILVUS_PORT", "19530"))
+    MILVUS_COLLECTION: str = os.getenv("MILVUS_COLLECTION", "ai_message_embeddings")  # 消息向量集合名
     
     # Redis
     REDIS_HOST: str = os.getenv("REDIS_HOST", "localhost")
     REDIS_PORT: int = int(os.getenv("REDIS_PORT", "6379"))
     REDIS_DB: int = int(os.getenv("REDIS_DB", "0"))
+    REDIS_MAX_CONNECTIONS: int = int(os.getenv("REDIS_MAX_CONNECTIONS", "64"))  # 共享连接池的最大连接数，包括发布订阅和阻塞读取（任务事件流等）占用的连接
+    REDIS_POOL_TIMEOUT: float = float(os.getenv("REDIS_POOL_TIMEOUT", "5"))  # 连接池用尽时等待空闲连接的时间（秒）
+    REDIS_SOCKET_CONNECT_TIMEOUT: float = float(os.getenv("REDIS_SOCKET_CONNECT_TIMEOUT", "5"))  # 建立连接的超时（秒）
+    REDIS_SOCKET_TIMEOUT: float = float(os.getenv("REDIS_SOCKET_TIMEOUT", "0"))  # 命令读写超时（秒），0 表示不限制；设置时须大于最长的阻塞读取（JOB_SSE_HEARTBEAT）
+    REDIS_HEALTH_CHECK_INTERVAL: int = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "30"))  # 连接空闲超过该时间（秒）后使用前先 PING
+    CHAT_HISTORY_TTL: int = int(os.getenv("CHAT_HISTORY_TTL", "3600"))  # 对话历史缓存的滑动过期时间（秒）
+    CHAT_HISTORY_MAX_TURNS: int = int(os.getenv("CHAT_HISTORY_MAX_TURNS", "20"))  # 未配置 max_chat_limit 时保留的轮数
+    
+    # LLM admission control
+    LLM_MAX_CONCURRENCY: int = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))  # 每个模型同时进行的生成数
+    LLM_CONCURRENCY_OVERRIDES: Dict[int, int] = {}  # 按 llm_id 覆盖并发数，环境变量为 JSON，如 {"1": 2}
+    LLM_MAX_QUEUE: int = int(os.getenv("LLM_MAX_QUEUE", "64"))  # 每个模型的最大排队数
+    LLM_MAX_QUEUE_PER_USER: int = int(os.getenv("LLM_MAX_QUEUE_PER_USER", "8"))  # 单个用户在同一模型上的最大排队数
+    LLM_QUEUE_TIMEOUT: float = float(os.getenv("LLM_QUEUE_TIMEOUT", "60"))  # 排队等待超时（秒）
+    
+    # Config cache
+    CONFIG_CACHE_TTL: float = float(os.getenv("CONFIG_CACHE_TTL", "300"))  # 模型/助手配置缓存时间（秒）
+    CONFIG_CACHE_MAXSIZE: int = int(os.getenv("CONFIG_CACHE_MAXSIZE", "256"))
+    CONFIG_CACHE_CHANNEL: str = os.getenv("CONFIG_CACHE_CHANNEL", "config-cache:invalidate")  # Redis 失效广播频道
+    
+    # Auth cache
+    AUTH_CACHE_MAXSIZE: int = int(os.getenv("AUTH_CACHE_MAXSIZE", "10000"))  # 已验证令牌/用户记录缓存的容量
+    AUTH_USER_CACHE_TTL: float = float(os.getenv("AUTH_USER_CACHE_TTL", "60"))  # 用户记录缓存时间（秒）
+    AUTH_CACHE_CHANNEL: str = os.getenv("AUTH_CACHE_CHANNEL", "auth-cache:revoke")  # Redis 吊销广播频道
+    
+    # Startup warm-up
+    WARMUP_ENABLED: bool = os.getenv("WARMUP_ENABLED", "true").lower() == "true"  # 启动时预热连接池、配置缓存和模型
+    WARMUP_BLOCKING: bool = os.getenv("WARMUP_BLOCKING", "false").lower() == "true"  # 预热完成后才开始接收请求
+    WARMUP_DB_CONNECTIONS: int = int(os.getenv("WARMUP_DB_CONNECTIONS", "0"))  # 预先建立的数据库连接数，0 表示 DB_POOL_SIZE
+    WARMUP_MODELS: bool = os.getenv("WARMUP_MODELS", "true").lower() == "true"  # 是否让 Ollama 预先加载启用的本地模型
+    WARMUP_TIMEOUT: float = float(os.getenv("WARMUP_TIMEOUT", "60"))  # 预热最长时间（秒）
+    
+    # Metrics
+    METRICS_ENABLED: bool = os.getenv("METRICS_ENABLED", "true").lower() == "true"  # 是否记录请求指标并提供 /metrics
+    
+    # Profiling
+    PROFILING_ADMIN_TOKEN: str = os.getenv("PROFILING_ADMIN_TOKEN", "")  # 请求头 X-Profile 携带此值时分析该请求，为空则只按抽样率分析
+    PROFILING_SAMPLE_RATE: float = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))  # 抽样分析的请求比例（0-1）
+    PROFILING_CPU_INTERVAL: float = float(os.getenv("PROFILING_CPU_INTERVAL", "0.005"))  # CPU 采样间隔（秒）
+    PROFILING_MAX_REPORTS: int = int(os.getenv("PROFILING_MAX_REPORTS", "200"))  # 保留的分析报告数
+    PROFILING_REPORT_TTL: float = float(os.getenv("PROFILING_REPORT_TTL", "3600"))  # 分析报告保留时间（秒）
+    
+    # LLM
+    LLM_CLIENT_IDLE_TTL: float = float(os.getenv("LLM_CLIENT_IDLE_TTL", "600"))  # 共享大模型客户端的空闲回收时间（秒）
+    LLM_CONTEXT_WINDOW: int = int(os.getenv("LLM_CONTEXT_WINDOW", "4096"))  # 模型上下文长度（num_ctx）
+    CONTEXT_TOKEN_BUDGET: int = int(os.getenv("CONTEXT_TOKEN_BUDGET", "0"))  # 历史消息的 token 上限，0 表示按上下文长度推算
+    OLLAMA_HOST: str = os.getenv("OLLAMA_HOST", "http://127.0.0.1:11434")  # 本地模型未配置 api_url 时使用的 Ollama 地址
+    LLM_HEALTH_CHECK_INTERVAL: float = float(os.getenv("LLM_HEALTH_CHECK_INTERVAL", "10"))  # 模型端点健康检查间隔（秒），0 表示不检查
+    LLM_HEALTH_CHECK_TIMEOUT: float = float(os.getenv("LLM_HEALTH_CHECK_TIMEOUT", "2"))
+    LLM_CIRCUIT_FAILURES: int = int(os.getenv("LLM_CIRCUIT_FAILURES", "3"))  # 端点连续失败多少次后熔断
+    LLM_CIRCUIT_COOLDOWN: float = float(os.getenv("LLM_CIRCUIT_COOLDOWN", "30"))  # 熔断时间（秒）
+    LLM_HTTP_MAX_CONNECTIONS: int = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "32"))  # 每个端点的 HTTP 连接池大小（OpenAI 兼容接口和携带 context 的 Ollama 请求）
+    LLM_HTTP_TIMEOUT: float = float(os.getenv("LLM_HTTP_TIMEOUT", "300"))  # 模型端点 HTTP 请求的读超时（秒）
+    LLM_KEEP_ALIVE: str = os.getenv("LLM_KEEP_ALIVE", "")  # Ollama 模型驻留时间，如 30m，-1 表示一直驻留，为空使用 Ollama 默认值
+    KV_CONTEXT_ENABLED: bool = os.getenv("KV_CONTEXT_ENABLED", "true").lower() == "true"  # 本地模型多轮对话复用 Ollama 返回的 context，只编码新的问题
+    CONTEXT_SUMMARY_ENABLED: bool = os.getenv("CONTEXT_SUMMARY_ENABLED", "false").lower() == "true"  # 是否把旧对话折叠为滚动摘要
+    
+    # Response cache
+    RESPONSE_CACHE_ENABLED: bool = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"  # 缓存不采样模型的生成结果
+    RESPONSE_CACHE_TTL: int = int(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+    RESPONSE_CACHE_MAXSIZE: int = int(os.getenv("RESPONSE_CACHE_MAXSIZE", "1024"))  # 进程内缓存条数上限
+    
+    # Write-behind message persistence
+    WRITE_BEHIND_ENABLED: bool = os.getenv("WRITE_BEHIND_ENABLED", "false").lower() == "true"  # 消息异步批量写入数据库
+    WRITE_BEHIND_BATCH_SIZE: int = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "100"))  # 达到条数立即写入
+    WRITE_BEHIND_FLUSH_INTERVAL: float = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "0.5"))  # 最长攒批时间（秒）
+    WRITE_BEHIND_DURABILITY: str = os.getenv("WRITE_BEHIND_DURABILITY", "memory")  # memory：进程内队列；redis：Redis Stream，崩溃后可重放
+    WRITE_BEHIND_STREAM: str = os.getenv("WRITE_BEHIND_STREAM", "message-writer:stream")
+    WRITE_BEHIND_CLAIM_IDLE: float = float(os.getenv("WRITE_BEHIND_CLAIM_IDLE", "30"))  # 认领其他 worker 未确认条目的空闲时间（秒）
+    WRITE_BEHIND_MAX_ATTEMPTS: int = int(os.getenv("WRITE_BEHIND_MAX_ATTEMPTS", "5"))  # 单条写操作最多尝试次数，之后转入死信
+    WRITE_BEHIND_STOP_TIMEOUT: float = float(os.getenv("WRITE_BEHIND_STOP_TIMEOUT", "10"))  # 停止时等待写完剩余条目的最长时间（秒）
+    WRITE_BEHIND_DEAD_LETTER_STREAM: str = os.getenv("WRITE_BEHIND_DEAD_LETTER_STREAM", "message-writer:dead")  # redis 模式下保存放弃的写操作
+    
+    # Pagination
+    MESSAGE_PAGE_SIZE: int = int(os.getenv("MESSAGE_PAGE_SIZE", "50"))  # 消息历史默认每页条数
+    MESSAGE_PAGE_MAX_SIZE: int = int(os.getenv("MESSAGE_PAGE_MAX_SIZE", "200"))
+    MESSAGE_SUMMARY_LENGTH: int = int(os.getenv("MESSAGE_SUMMARY_LENGTH", "200"))  # summary 投影中回答截取的字符数
+    
+    # Export
+    EXPORT_BATCH_SIZE: int = int(os.getenv("EXPORT_BATCH_SIZE", "500"))  # 服务端游标每批拉取的行数
+    EXPORT_CHUNK_SIZE: int = int(os.getenv("EXPORT_CHUNK_SIZE", "65536"))  # 导出响应每次写出的字节数
+    
+    # Streaming
+    STREAM_CHECKPOINT_INTERVAL: float = float(os.getenv("STREAM_CHECKPOINT_INTERVAL", "0"))  # 流式回答中间保存间隔（秒），0 表示仅在结束时保存
+    DISCONNECT_POLL_INTERVAL: float = float(os.getenv("DISCONNECT_POLL_INTERVAL", "0.5"))  # 非流式对话检查客户端是否断开的间隔（秒），0 表示不检查
+    
+    # Batch
+    BATCH_MAX_ITEMS: int = int(os.getenv("BATCH_MAX_ITEMS", "10000"))  # 单个批次的最大条目数
+    BATCH_MAX_CONCURRENCY: int = int(os.getenv("BATCH_MAX_CONCURRENCY", "4"))  # 批次内每个模型的最大并发数
+    BATCH_MAX_RETRIES: int = int(os.getenv("BATCH_MAX_RETRIES", "3"))  # 模型排队已满时的重试次数
+    BATCH_RESULT_TTL: int = int(os.getenv("BATCH_RESULT_TTL", "86400"))  # 批次内容和结果的保留时间（秒）
+    BATCH_LOCK_TTL: int = int(os.getenv("BATCH_LOCK_TTL", "120"))  # 批次执行锁的过期时间（秒），执行期间每 1/3 有效期续期一次
+    
+    # Jobs
+    JOB_TTL: int = int(os.getenv("JOB_TTL", "86400"))  # 任务状态和进度事件的保留时间（秒）
+    JOB_CLAIM_IDLE: float = float(os.getenv("JOB_CLAIM_IDLE", "60"))  # worker 多久未续期后由其他 worker 认领其任务（秒）
+    JOB_WORKER_CONCURRENCY: int = int(os.getenv("JOB_WORKER_CONCURRENCY", "4"))  # 每个 worker 进程同时执行的任务数
+    JOB_PROGRESS_INTERVAL: float = float(os.getenv("JOB_PROGRESS_INTERVAL", "0.25"))  # 发布进度的间隔（秒）
+    JOB_WORKER_IN_API: bool = os.getenv("JOB_WORKER_IN_API", "false").lower() == "true"  # 在 API 进程内执行任务（单机部署），否则运行 job_worker.py
+    JOB_SSE_HEARTBEAT: float = float(os.getenv("JOB_SSE_HEARTBEAT", "15"))  # 任务事件流无新事件时的心跳间隔（秒）
+    JOB_SHUTDOWN_TIMEOUT: float = float(os.getenv("JOB_SHUTDOWN_TIMEOUT", "30"))  # 停止 worker 时等待执行中任务的时间（秒）
+    
+    # Rate limiting
+    RATE_LIMIT_ENABLED: bool = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"  # 是否按用户限制对话请求频率和每日生成的 token 数
+    RATE_LIMIT_BACKEND: str = os.getenv("RATE_LIMIT_BACKEND", "redis")  # redis：所有 worker 共享的令牌桶；memory：进程内令牌桶，用于测试和单进程部署
+    RATE_LIMIT_REQUESTS_PER_MINUTE: int = int(os.getenv("RATE_LIMIT_REQUESTS_PER_MINUTE", "60"))  # 每个用户每分钟的对话请求数，0 表示不限制
+    RATE_LIMIT_TOKENS_PER_DAY: int = int(os.getenv("RATE_LIMIT_TOKENS_PER_DAY", "200000"))  # 每个用户每天生成的 token 数，0 表示不限制
+    RATE_LIMIT_MODEL_REQUESTS_PER_MINUTE: int = int(os.getenv("RATE_LIMIT_MODEL_REQUESTS_PER_MINUTE", "0"))  # 每个用户在单个模型上每分钟的请求数，0 表示不限制
+    RATE_LIMIT_MODEL_TOKENS_PER_DAY: int = int(os.getenv("RATE_LIMIT_MODEL_TOKENS_PER_DAY", "0"))  # 每个用户在单个模型上每天生成的 token 数，0 表示不限制
+    RATE_LIMIT_MODEL_OVERRIDES: Dict[int, Dict[str, int]] = {}  # 按 llm_id 覆盖单个模型的限额，环境变量为 JSON，如 {"1": {"requests_per_minute": 10, "tokens_per_day": 50000}}
+    
+    # Semantic search
+    SEMANTIC_SEARCH_ENABLED: bool = os.getenv("SEMANTIC_SEARCH_ENABLED", "false").lower() == "true"  # 是否在后台增量索引消息
+    SEMANTIC_INDEX_INTERVAL: float = float(os.getenv("SEMANTIC_INDEX_INTERVAL", "60"))  # 后台索引间隔（秒）
+    VECTOR_STORE_BACKEND: str = os.getenv("VECTOR_STORE_BACKEND", "numpy")  # numpy：进程内索引；milvus：使用 Milvus 集合
+    VECTOR_STORE_PATH: str = os.getenv("VECTOR_STORE_PATH", "")  # numpy 索引的保存文件（.npz），为空则不持久化
+    VECTOR_IVF_MIN_SIZE: int = int(os.getenv("VECTOR_IVF_MIN_SIZE", "20000"))  # 达到该数量后由暴力检索切换为 IVF 索引
+    VECTOR_IVF_NPROBE: int = int(os.getenv("VECTOR_IVF_NPROBE", "8"))  # IVF 检索的聚类数
+    EMBEDDING_MODEL: str = os.getenv("EMBEDDING_MODEL", "nomic-embed-text")  # Ollama 向量模型
+    EMBEDDING_BATCH_SIZE: int = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))  # 每次向量计算的文本数
+    EMBEDDING_CACHE_TTL: int = int(os.getenv("EMBEDDING_CACHE_TTL", "2592000"))  # 向量缓存时间（秒）
     
     class Config:
         case_sensitive = True
@@ -0,0 +1,201 @@
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client.core import GaugeMetricFamily
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from typing import Any, Dict, Iterable, List, Tuple
+import time
+
+# 独立的注册表，/metrics 只输出本服务的指标
+registry = CollectorRegistry()
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+_FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "HTTP request latency (until the response body is sent)",
+    ["method", "route", "status"], buckets=_LATENCY_BUCKETS, registry=registry
+)
+HTTP_REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "HTTP requests currently being served",
+    ["method"], registry=registry
+)
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a connection from the SQLAlchemy pool",
+    ["engine"], buckets=_FAST_BUCKETS, registry=registry
+)
+LLM_REQUESTS = Counter(
+    "llm_requests_total", "LLM generation requests",
+    ["llm_id", "mode", "status"], registry=registry
+)
+LLM_TIME_TO_FIRST_TOKEN = Histogram(
+    "llm_time_to_first_token_seconds", "Time from request to the first streamed token",
+    ["llm_id"], buckets=_LATENCY_BUCKETS, registry=registry
+)
+LLM_GENERATION_DURATION = Histogram(
+    "llm_generation_duration_seconds", "Total LLM generation time",
+    ["llm_id", "mode"], buckets=_LATENCY_BUCKETS, registry=registry
+)
+LLM_TOKENS_PER_SECOND = Histogram(
+    "llm_tokens_per_second", "Output tokens per second of a generation",
+    ["llm_id", "mode"], buckets=(1, 5, 10, 20, 30, 50, 75, 100, 150, 250, 500), registry=registry
+)
+LLM_OUTPUT_TOKENS = Counter(
+    "llm_output_tokens_total", "Output tokens generated",
+    ["llm_id", "mode"], registry=registry
+)
+LLM_BACKEND_REQUESTS = Counter(
+    "llm_backend_requests_total", "LLM requests per backend endpoint",
+    ["backend", "status"], registry=registry
+)
+LLM_BACKEND_FAILOVERS = Counter(
+    "llm_backend_failovers_total", "Requests retried on another backend before the first token",
+    ["llm_id"], registry=registry
+)
+LLM_BACKEND_UP = Gauge(
+    "llm_backend_up", "Whether the backend passed its last health check",
+    ["backend"], registry=registry
+)
+LLM_KV_CONTEXT = Counter(
+    "llm_kv_context_total", "Multi-turn requests that continued the stored Ollama context or replayed the history",
+    ["llm_id", "result"], registry=registry
+)
+LLM_RECLAIMED_TOKENS = Counter(
+    "llm_reclaimed_tokens_total", "Output tokens not generated because the client disconnected (max_tokens minus tokens generated)",
+    ["llm_id", "mode"], registry=registry
+)
+JOB_QUEUE_WAIT = Histogram(
+    "job_queue_wait_seconds", "Time a generation job waited in the queue before a worker started it",
+    ["kind"], buckets=_LATENCY_BUCKETS, registry=registry
+)
+JOBS_FINISHED = Counter(
+    "jobs_finished_total", "Generation jobs finished by a worker",
+    ["kind", "status"], registry=registry
+)
+JOBS_RUNNING = Gauge(
+    "jobs_running", "Generation jobs currently executing in this process",
+    ["kind"], registry=registry
+)
+WRITE_BEHIND_DEAD_LETTERS = Counter(
+    "write_behind_dead_letters_total", "Queued message writes given up after WRITE_BEHIND_MAX_ATTEMPTS failed attempts",
+    ["durability"], registry=registry
+)
+RATE_LIMIT_REJECTIONS = Counter(
+    "rate_limit_rejections_total", "Requests rejected by the per-user rate limiter",
+    ["scope"], registry=registry
+)
+REDIS_COMMAND_DURATION = Histogram(
+    "redis_command_duration_seconds", "Redis round-trip latency per command (PIPELINE for pipelines)",
+    ["command"], buckets=_FAST_BUCKETS, registry=registry
+)
+
+
+class _PoolCollector:
+    """抓取时读取连接池当前状态，请求链路上没有额外开销"""
+
+    def __init__(self):
+        self.engines: Dict[str, Engine] = {}
+
+    def collect(self) -> Iterable[GaugeMetricFamily]:
+        families: List[Tuple[str, str, str]] = [
+            ("db_pool_size", "Configured pool size", "size"),
+            ("db_pool_checked_out", "Connections currently in use", "checkedout"),
+            ("db_pool_checked_in", "Idle connections in the pool", "checkedin"),
+            ("db_pool_overflow", "Connections opened beyond pool_size", "overflow"),
+        ]
+        for name, documentation, method in families:
+            family = GaugeMetricFamily(name, documentation, labels=["engine"])
+            for label, engine in self.engines.items():
+                reader = getattr(engine.pool, method, None)
+                if reader is not None:
+                    # QueuePool.overflow() 在未满时为负数（pool_size 的余量）
+                    value = reader()
+                    family.add_metric([label], max(value, 0) if method == "overflow" else value)
+            yield family
+
+
+_pool_collector = _PoolCollector()
+registry.register(_pool_collector)
+
+
+def _time_pool_checkout(pool: Any, label: str) -> None:
+    do_get = pool._do_get
+
+    def timed_do_get():
+        started = time.perf_counter()
+        try:
+            return do_get()
+        finally:
+            DB_POOL_CHECKOUT_WAIT.labels(label).observe(time.perf_counter() - started)
+
+    pool._do_get = timed_do_get
+
+
+def instrument_engine(engine: Engine, label: str) -> None:
+    """登记引擎的连接池指标；异步引擎传入 async_engine.sync_engine"""
+    _pool_collector.engines[label] = engine
+    _time_pool_checkout(engine.pool, label)
+
+    # dispose() 会重建连接池，重新挂载计时
+    @event.listens_for(engine, "engine_disposed")
+    def reinstrument(target: Engine) -> None:
+        _time_pool_checkout(target.pool, label)
+
+
+def observe_redis(command: str, started: float) -> None:
+    REDIS_COMMAND_DURATION.labels(command).observe(time.perf_counter() - started)
+
+
+def observe_llm_generation(llm_id: Any, mode: str, duration: float, tokens: int) -> None:
+    llm_id = str(llm_id)
+    LLM_REQUESTS.labels(llm_id, mode, "success").inc()
+    LLM_GENERATION_DURATION.labels(llm_id, mode).observe(duration)
+    LLM_OUTPUT_TOKENS.labels(llm_id, mode).inc(tokens)
+    if duration > 0 and tokens:
+        LLM_TOKENS_PER_SECOND.labels(llm_id, mode).observe(tokens / duration)
+
+
+def observe_llm_cancellation(llm_id: Any, mode: str, tokens: int, max_tokens: Any) -> None:
+    """客户端断开后取消的生成：记录次数和省下的 token 数"""
+    llm_id = str(llm_id)
+    LLM_REQUESTS.labels(llm_id, mode, "cancelled").inc()
+    if max_tokens:
+        LLM_RECLAIMED_TOKENS.labels(llm_id, mode).inc(max(max_tokens - tokens, 0))
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+class MetricsMiddleware:
+    """记录每个路由的请求延迟
+
+    按路由模板（如 /api/v1/chat/conversations/{conversation_id}/messages）而不是
+    实际路径打标签，避免标签基数随 ID 增长。
+    """
+
+    def __init__(self, app: Any):
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = [500]
+
+        async def send_wrapper(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        in_progress = HTTP_REQUESTS_IN_PROGRESS.labels(method)
+        in_progress.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_progress.dec()
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUEST_DURATION.labels(method, path, str(status[0])).observe(time.perf_counter() - started)
@@ -0,0 +1,236 @@
+from collections import Counter as TallyCounter
+from contextvars import ContextVar
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from core.config import settings
+from utils.cache import TTLCache
+from typing import Any, Dict, List, Optional, Tuple
+import hmac
+import random
+import sys
+import threading
+import time
+import uuid
+
+# 当前请求的性能记录，未开启分析时为 None
+_current_profile: ContextVar[Optional["RequestProfile"]] = ContextVar("request_profile", default=None)
+
+PROFILE_HEADER = "x-profile"
+PROFILE_CPU_HEADER = "x-profile-cpu"
+
+# 已完成的分析报告，可通过 /api/v1/profiles/{profile_id} 获取
+profile_store = TTLCache(maxsize=settings.PROFILING_MAX_REPORTS, ttl=settings.PROFILING_REPORT_TTL)
+
+
+class StackSampler:
+    """定时采样事件循环线程调用栈的 CPU 分析器
+
+    采样的是整个事件循环线程，同一时间段内其他请求的 CPU 也会计入；
+    事件循环空闲（等待 IO）的样本不计入。
+    """
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = 0
+        self.self_counts: TallyCounter = TallyCounter()
+        self.total_counts: TallyCounter = TallyCounter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None or frame.f_code.co_filename.endswith("selectors.py"):
+                continue
+            self.samples += 1
+            seen = set()
+            leaf = True
+            while frame is not None:
+                code = frame.f_code
+                key = f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+                if leaf:
+                    self.self_counts[key] += 1
+                    leaf = False
+                if key not in seen:
+                    self.total_counts[key] += 1
+                    seen.add(key)
+                frame = frame.f_back
+
+    def summary(self, limit: int = 20) -> Dict[str, Any]:
+        def top(counts: TallyCounter) -> List[Dict[str, Any]]:
+            return [
+                {"function": key, "samples": count, "percent": round(count / self.samples * 100, 1)}
+                for key, count in counts.most_common(limit)
+            ]
+        return {
+            "interval_ms": self.interval * 1000,
+            "samples": self.samples,
+            "self": top(self.self_counts) if self.samples else [],
+            "cumulative": top(self.total_counts) if self.samples else [],
+        }
+
+
+class RequestProfile:
+    """单个请求的 SQL 明细以及 DB/LLM/Redis 等待时间"""
+
+    def __init__(self, method: str, path: str):
+        self.id = uuid.uuid4().hex
+        self.method = method
+        self.path = path
+        self.started = time.perf_counter()
+        self.cpu_started = time.process_time()
+        self.queries: List[Tuple[str, Any, float]] = []
+        self.spans: Dict[str, List[float]] = {"db": [0.0, 0], "llm": [0.0, 0], "redis": [0.0, 0]}
+        self.sampler: Optional[StackSampler] = None
+        self.report: Optional[Dict[str, Any]] = None
+
+    def add_query(self, statement: str, parameters: Any, elapsed: float) -> None:
+        self.queries.append((statement, parameters, elapsed))
+        self.add_span("db", elapsed)
+
+    def add_span(self, category: str, elapsed: float) -> None:
+        span = self.spans.setdefault(category, [0.0, 0])
+        span[0] += elapsed
+        span[1] += 1
+
+    def server_timing(self) -> str:
+        """Server-Timing 响应头，浏览器开发者工具可直接展示"""
+        parts = [
+            f'{name};dur={total * 1000:.2f};desc="{count} calls"'
+            for name, (total, count) in self.spans.items() if count
+        ]
+        parts.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.2f}")
+        return ", ".join(parts)
+
+    def finish(self, status: int) -> Dict[str, Any]:
+        if self.sampler is not None:
+            self.sampler.stop()
+        total = time.perf_counter() - self.started
+
+        statements = TallyCounter(statement for statement, _, _ in self.queries)
+        identical = TallyCounter((statement, repr(parameters)) for statement, parameters, _ in self.queries)
+        slowest = sorted(self.queries, key=lambda q: q[2], reverse=True)[:10]
+        waited = sum(total for total, _ in self.spans.values())
+
+        self.report = {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status": status,
+            "total_ms": round(total * 1000, 2),
+            # 进程级 CPU 时间，包含同时处理的其他请求
+            "process_cpu_ms": round((time.process_time() - self.cpu_started) * 1000, 2),
+            "spans": {
+                name: {"total_ms": round(span_total * 1000, 2), "calls": count}
+                for name, (span_total, count) in self.spans.items()
+            },
+            # 未花在 DB/LLM/Redis 等待上的时间，近似为 Python 自身耗时
+            "other_ms": round(max(total - waited, 0) * 1000, 2),
+            "sql": {
+                "count": len(self.queries),
+                "total_ms": round(self.spans["db"][0] * 1000, 2),
+                # 同一语句执行多次通常意味着 N+1 查询
+                "repeated_statements": [
+                    {"statement": statement, "count": count}
+                    for statement, count in statements.most_common() if count > 1
+                ],
+                "identical_queries": sum(count - 1 for count in identical.values()),
+                "slowest": [
+                    {"statement": statement, "ms": round(elapsed * 1000, 2)}
+                    for statement, _, elapsed in slowest
+                ],
+            },
+        }
+        if self.sampler is not None:
+            self.report["cpu_profile"] = self.sampler.summary()
+        profile_store.set(self.id, self.report)
+        return self.report
+
+
+def current_profile() -> Optional[RequestProfile]:
+    return _current_profile.get()
+
+
+def record_span(category: str, elapsed: float) -> None:
+    """把一次 LLM/Redis 等待计入当前请求的分析记录"""
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.add_span(category, elapsed)
+
+
+def is_admin_token(value: Optional[str]) -> bool:
+    token = settings.PROFILING_ADMIN_TOKEN
+    return bool(token) and value is not None and hmac.compare_digest(value, token)
+
+
+def instrument_engine(engine: Engine) -> None:
+    """记录开启分析的请求中执行的 SQL；异步引擎传入 async_engine.sync_engine"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if _current_profile.get() is not None:
+            conn.info.setdefault("profile_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        profile = _current_profile.get()
+        starts = conn.info.get("profile_query_start")
+        if profile is not None and starts:
+            profile.add_query(statement, parameters, time.perf_counter() - starts.pop())
+
+
+class ProfilingMiddleware:
+    """按请求开启性能分析
+
+    携带 X-Profile: <PROFILING_ADMIN_TOKEN> 的请求总会被分析，并在响应头中返回
+    Server-Timing 和 X-Profile-Id，同时带 X-Profile-CPU: 1 时附加采样 CPU 分析；
+    其余请求按 PROFILING_SAMPLE_RATE 抽样，报告只保存在服务端。
+    """
+
+    def __init__(self, app: Any):
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        admin_header = headers.get(PROFILE_HEADER.encode())
+        admin = is_admin_token(admin_header.decode("latin-1") if admin_header else None)
+        if not admin and not (settings.PROFILING_SAMPLE_RATE and random.random() < settings.PROFILING_SAMPLE_RATE):
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope["method"], scope["path"])
+        if admin and headers.get(PROFILE_CPU_HEADER.encode()) == b"1":
+            profile.sampler = StackSampler(threading.get_ident(), settings.PROFILING_CPU_INTERVAL)
+            profile.sampler.start()
+        status = [500]
+
+        async def send_wrapper(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                if admin:
+                    # 流式响应的响应头先于生成发送，完整数据需通过报告获取
+                    message.setdefault("headers", [])
+                    message["headers"] = list(message["headers"]) + [
+                        (b"server-timing", profile.server_timing().encode("latin-1")),
+                        (b"x-profile-id", profile.id.encode("latin-1")),
+                    ]
+            await send(message)
+
+        token = _current_profile.set(profile)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_profile.reset(token)
+            profile.finish(status[0])
@@ -0,0 +1,75 @@
+import redis.asyncio as aioredis
+from redis.asyncio.client import Pipeline
+from typing import Any, Optional
+from core.config import settings
+from core.metrics import observe_redis
+from core.profiling import record_span
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class InstrumentedPipeline(Pipeline):
+    """记录整个管道一次往返的耗时"""
+
+    async def execute(self, raise_on_error: bool = True) -> Any:
+        started = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        finally:
+            observe_redis("PIPELINE", started)
+            record_span("redis", time.perf_counter() - started)
+
+
+class InstrumentedRedis(aioredis.Redis):
+    """按命令记录 Redis 往返延迟"""
+
+    async def execute_command(self, *args: Any, **options: Any) -> Any:
+        started = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            observe_redis(str(args[0]).upper(), started)
+            record_span("redis", time.perf_counter() - started)
+
+    def pipeline(self, transaction: bool = True, shard_hint: Any = None) -> InstrumentedPipeline:
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+_redis: Optional[aioredis.Redis] = None
+
+def create_redis_pool() -> aioredis.BlockingConnectionPool:
+    """创建有上限的连接池，连接用尽时等待 REDIS_POOL_TIMEOUT 秒而不是新建连接"""
+    return aioredis.BlockingConnectionPool(
+        host=settings.REDIS_HOST,
+        port=settings.REDIS_PORT,
+        db=settings.REDIS_DB,
+        max_connections=settings.REDIS_MAX_CONNECTIONS,
+        timeout=settings.REDIS_POOL_TIMEOUT,
+        socket_connect_timeout=settings.REDIS_SOCKET_CONNECT_TIMEOUT or None,
+        socket_timeout=settings.REDIS_SOCKET_TIMEOUT or None,
+        health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL
+    )
+
+def get_redis() -> aioredis.Redis:
+    """获取进程内共享的异步 Redis 客户端，所有 Redis 访问共用同一个连接池"""
+    global _redis
+    if _redis is None:
+        _redis = InstrumentedRedis(connection_pool=create_redis_pool())
+    return _redis
+
+async def init_redis() -> None:
+    """应用启动时创建共享连接池并建立第一个连接；Redis 不可用时只记录警告，使用时再重连"""
+    try:
+        await get_redis().ping()
+    except Exception as e:
+        logger.warning(f"Redis is not reachable at startup: {str(e)}")
+
+async def close_redis() -> None:
+    """关闭共享的 Redis 客户端及其连接池"""
+    global _redis
+    if _redis is not None:
+        await _redis.aclose()
+        await _redis.connection_pool.disconnect()
+        _redis = None
@@ -1,21 +1,31 @@
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, Header, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from datetime import datetime, timedelta
-from sqlalchemy.orm import Session
-from models.base import get_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from models.base import get_async_db
 from models.user import User
 from core.config import settings
+from core.profiling import is_admin_token
+from services.auth_cache import auth_cache, token_digest
+from services.password_hasher import password_hasher
+from typing import Optional, Tuple
+import hmac
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = password_hasher.context
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+# bcrypt 计算在线程池中执行，不阻塞事件循环
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await password_hasher.verify(plain_password, hashed_password)
 
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    return await password_hasher.verify_and_update(plain_password, hashed_password)
+
+async def get_password_hash(password: str) -> str:
+    return await password_hasher.hash(password)
 
 def create_access_token(data: dict) -> str:
     to_encode = data.copy()
@@ -26,7 +36,7 @@ def create_access_token(data: dict) -> str:
 
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ) -> User:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -34,16 +44,56 @@ async def get_current_user(
         headers={"WWW-Authenticate": "Bearer"},
     )
     
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-        user_id: int = payload.get("sub")
-        if user_id is None:
+    digest = token_digest(token)
+    verified = auth_cache.get_token(digest)
+    if verified is None:
+        try:
+            payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
+            user_id: int = int(payload.get("sub"))
+            exp = float(payload["exp"])
+            version = int(payload.get("ver", 0))
+        except (JWTError, KeyError, TypeError, ValueError):
+            raise credentials_exception
+        # 已吊销（注销/全部注销）的令牌直接拒绝
+        if not await auth_cache.check_and_store_token(digest, user_id, exp, version):
             raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-        
-    user = db.query(User).filter(User.id == user_id).first()
+    else:
+        user_id = verified.user_id
+
+    user = auth_cache.get_user(user_id)
     if user is None:
-        raise credentials_exception
-        
-    return user 
\ No newline at end of file
+        result = await db.execute(select(User).where(User.id == user_id))
+        user = result.scalars().first()
+        if user is None:
+            raise credentials_exception
+        # 与会话分离后再缓存，供后续请求复用
+        db.expunge(user)
+        auth_cache.store_user(user)
+
+    return user
+
+async def get_optional_user(
+    token: Optional[str] = Depends(optional_oauth2_scheme),
+    db: AsyncSession = Depends(get_async_db)
+) -> Optional[User]:
+    """携带令牌时校验并返回用户，未携带时返回 None"""
+    if not token:
+        return None
+    return await get_current_user(token, db)
+
+async def verify_profiling_admin(x_profile: Optional[str] = Header(None)) -> None:
+    """性能分析报告仅对携带 PROFILING_ADMIN_TOKEN 的请求开放"""
+    if not is_admin_token(x_profile):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Profiling access denied"
+        )
+
+async def verify_admin(x_admin_token: Optional[str] = Header(None)) -> None:
+    """运维接口（清除缓存、端点和队列统计）仅对携带 ADMIN_TOKEN 的请求开放"""
+    token = settings.ADMIN_TOKEN
+    if not (token and x_admin_token is not None and hmac.compare_digest(x_admin_token, token)):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access denied"
+        )
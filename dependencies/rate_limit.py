@@ -0,0 +1,24 @@
+from fastapi import Depends, Request, Response
+from models.user import User
+from dependencies.auth import get_current_user
+from services.rate_limiter import RateLimitStatus, rate_limiter
+
+def client_key(request: Request) -> str:
+    """匿名接口按客户端地址限流"""
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+# 在访问数据库和调用大模型之前检查用户的总限额；超出时抛出 RateLimited（429 + Retry-After）。
+# 直接返回 Response 的接口（流式响应、202 任务）需要自行调用 status.apply 加上限流响应头。
+async def check_user_rate_limit(
+    response: Response,
+    current_user: User = Depends(get_current_user)
+) -> RateLimitStatus:
+    # 与准入控制、批量任务使用同一个用户键，所有入口共用一份限额
+    status = await rate_limiter.acquire(str(current_user.id))
+    status.apply(response.headers)
+    return status
+
+async def check_client_rate_limit(request: Request, response: Response) -> RateLimitStatus:
+    status = await rate_limiter.acquire(client_key(request))
+    status.apply(response.headers)
+    return status
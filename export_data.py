@@ -0,0 +1,102 @@
+"""导出对话和消息为 NDJSON（.ndjson/.jsonl）或 gzip 压缩的 JSONL（.gz）
+
+    python export_data.py --output export.jsonl.gz --user-id 42 --since 2024-01-01
+    python export_data.py --output export.jsonl.gz --resume   # 从中断处继续
+
+不指定 --user-id 时导出全部用户。中断后使用相同参数加 --resume 重新运行，
+会从文件中最后一条完整记录的 cursor 继续。
+"""
+from datetime import datetime
+from typing import IO, Iterator, Optional
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import os
+import sys
+import zlib
+from models.base import AsyncSessionLocal
+from services.export_service import ExportService
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def _read_complete_lines(path: str) -> Iterator[bytes]:
+    """读取文件中完整的行，忽略中断时写了一半的末尾"""
+    if path.endswith(".gz"):
+        stream: IO[bytes] = gzip.open(path, "rb")
+    else:
+        stream = open(path, "rb")
+    with stream:
+        try:
+            for line in stream:
+                if line.endswith(b"\n"):
+                    yield line
+        except (EOFError, zlib.error, gzip.BadGzipFile):
+            pass
+
+
+def _last_record(line: bytes) -> Optional[dict]:
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+
+async def export(args: argparse.Namespace) -> int:
+    resume = args.resume and os.path.exists(args.output)
+    after = None
+    if resume:
+        last = None
+        for last in _read_complete_lines(args.output):
+            pass
+        record = _last_record(last) if last else None
+        if record and record.get("type") == "end":
+            logger.info(f"{args.output} is already complete")
+            return 0
+        after = record.get("cursor") if record else None
+        logger.info(f"Resuming export after cursor {after}")
+
+    # 继续导出时写入临时文件，原文件在完成前保持不变，再次中断仍可继续
+    path = f"{args.output}.tmp" if resume else args.output
+    out: IO[bytes] = gzip.open(path, "wb") if args.output.endswith(".gz") else open(path, "wb")
+    count = 0
+    copied = False
+    try:
+        with out:
+            if resume:
+                # 复制已导出的完整记录，截掉中断时不完整的部分
+                for line in _read_complete_lines(args.output):
+                    out.write(line)
+                copied = True
+            async with AsyncSessionLocal() as db:
+                service = ExportService(db, batch_size=args.batch_size)
+                async for line in service.iter_lines(
+                    user_id=args.user_id, since=args.since, until=args.until, after=after
+                ):
+                    out.write(line)
+                    count += 1
+                    if count % 10000 == 0:
+                        logger.info(f"Exported {count} records")
+    finally:
+        # 复制完成后临时文件包含原文件的全部记录，中途失败也可以替换
+        if resume and copied:
+            os.replace(path, args.output)
+        elif resume:
+            os.remove(path)
+
+    logger.info(f"Exported {count - 1} records to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export conversations and messages")
+    parser.add_argument("--output", required=True, help="输出文件，以 .gz 结尾时 gzip 压缩")
+    parser.add_argument("--user-id", default=None, help="只导出该用户")
+    parser.add_argument("--since", type=datetime.fromisoformat, default=None, help="只导出该时间之后创建的消息")
+    parser.add_argument("--until", type=datetime.fromisoformat, default=None, help="只导出该时间之前创建的消息")
+    parser.add_argument("--batch-size", type=int, default=None, help="服务端游标每批拉取的行数")
+    parser.add_argument("--resume", action="store_true", help="从输出文件中最后一条完整记录继续")
+    sys.exit(asyncio.run(export(parser.parse_args())))
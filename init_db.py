@@ -1,11 +1,28 @@
-from models.base import Base, engine
+import asyncio
+import sys
+from models.base import Base, engine, async_engine
+from models.ai_models import AiLLMConfiguration, AiShortcutConfiguration
 from models.chat import Conversation, Message
 from models.user import User
 
 def init_db():
     # Create all tables
     Base.metadata.create_all(bind=engine)
+    # create_all 不会给已存在的表补建索引，这里单独检查
+    for index in Message.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
+    print("Database tables created successfully!")
+
+async def init_async_db():
+    # 使用异步引擎建表（如测试用的 sqlite+aiosqlite）
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        for index in Message.__table__.indexes:
+            await conn.run_sync(index.create, checkfirst=True)
     print("Database tables created successfully!")
 
 if __name__ == "__main__":
-    init_db() 
\ No newline at end of file
+    if "--async" in sys.argv:
+        asyncio.run(init_async_db())
+    else:
+        init_db()
\ No newline at end of file
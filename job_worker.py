@@ -0,0 +1,104 @@
+"""运行后台任务 worker，执行 /jobs 队列中的长时间生成任务
+
+    python job_worker.py --processes 4 --concurrency 8 --metrics-port 9100
+
+每个进程是一个独立的 JobWorker，通过 Redis 消费者组分摊任务，可以在多台机器上同时运行。
+收到 SIGTERM/SIGINT 后停止领取新任务，等待执行中的任务完成（最多 JOB_SHUTDOWN_TIMEOUT 秒），
+超时的任务标记为失败。进程异常退出时，其未完成的任务在 JOB_CLAIM_IDLE 秒后由其他 worker 重新执行。
+"""
+from typing import List, Optional
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import signal
+import sys
+from core.config import settings
+from core.metrics import registry
+from core.redis import close_redis, init_redis
+from services.config_cache import config_cache
+from services.jobs import JobWorker, job_queue
+from services.llm_router import llm_router
+from services.message_writer import message_writer
+from services.warmup import run_warmup
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(processName)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger(__name__)
+
+
+async def serve(concurrency: int) -> None:
+    worker = JobWorker(job_queue, concurrency, settings.JOB_PROGRESS_INTERVAL)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    await init_redis()
+    background_tasks = [asyncio.create_task(config_cache.listen())]
+    if settings.LLM_HEALTH_CHECK_INTERVAL > 0:
+        background_tasks.append(asyncio.create_task(llm_router.run_health_checks(settings.LLM_HEALTH_CHECK_INTERVAL)))
+    if settings.WRITE_BEHIND_ENABLED:
+        await message_writer.start()
+    if settings.WARMUP_ENABLED:
+        await run_warmup(settings.WARMUP_TIMEOUT)
+
+    runner = asyncio.create_task(worker.run())
+    logger.info(f"Job worker {worker.consumer} started with concurrency {worker.concurrency}")
+    stopped = asyncio.create_task(stop.wait())
+    await asyncio.wait({runner, stopped}, return_when=asyncio.FIRST_COMPLETED)
+
+    logger.info(f"Job worker {worker.consumer} stopping")
+    await worker.stop(settings.JOB_SHUTDOWN_TIMEOUT)
+    for task in [runner, stopped, *background_tasks]:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    await message_writer.stop()
+    await llm_router.close()
+    await close_redis()
+    logger.info(f"Job worker {worker.consumer} stopped after {worker.completed} jobs")
+
+
+def run_process(concurrency: int, metrics_port: Optional[int]) -> None:
+    if metrics_port:
+        from prometheus_client import start_http_server
+        start_http_server(metrics_port, registry=registry)
+    asyncio.run(serve(concurrency))
+
+
+def main(args: argparse.Namespace) -> int:
+    if args.processes <= 1:
+        run_process(args.concurrency, args.metrics_port)
+        return 0
+
+    processes: List[multiprocessing.Process] = []
+    for index in range(args.processes):
+        # 每个进程使用独立的指标端口
+        port = args.metrics_port + index if args.metrics_port else None
+        process = multiprocessing.Process(
+            target=run_process, args=(args.concurrency, port), name=f"job-worker-{index}"
+        )
+        process.start()
+        processes.append(process)
+
+    def forward(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    # 主进程只负责把停止信号转发给子进程，子进程各自优雅退出
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for process in processes:
+        process.join()
+    return max((process.exitcode or 0) for process in processes)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run background job workers")
+    parser.add_argument("--processes", type=int, default=1, help="worker 进程数")
+    parser.add_argument("--concurrency", type=int, default=settings.JOB_WORKER_CONCURRENCY, help="每个进程同时执行的任务数")
+    parser.add_argument("--metrics-port", type=int, default=None, help="暴露 Prometheus 指标的端口，多进程时依次加 1")
+    sys.exit(main(parser.parse_args()))
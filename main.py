@@ -1,12 +1,74 @@
-from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
 from core.config import settings
+from core.metrics import MetricsMiddleware, render_metrics
+from core.profiling import ProfilingMiddleware
+from core.redis import close_redis, init_redis
+from services.auth_cache import auth_cache
+from services.config_cache import config_cache
+from services.jobs import JobWorker, job_queue
+from services.llm_router import llm_router
+from services.llm_scheduler import AdmissionRejected
+from services.message_writer import message_writer
+from services.password_hasher import password_hasher
+from services.rate_limiter import RateLimited
+from services.semantic_search import semantic_indexer
+from services.warmup import run_warmup
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 创建所有 Redis 访问共用的连接池
+    await init_redis()
+    # 订阅配置缓存失效广播
+    cache_listener = asyncio.create_task(config_cache.listen())
+    # 订阅令牌吊销广播
+    auth_listener = asyncio.create_task(auth_cache.listen())
+    if settings.WRITE_BEHIND_ENABLED:
+        await message_writer.start()
+    background_tasks = [cache_listener, auth_listener]
+    if settings.LLM_HEALTH_CHECK_INTERVAL > 0:
+        # 探测模型端点，剔除不健康的端点
+        background_tasks.append(asyncio.create_task(llm_router.run_health_checks(settings.LLM_HEALTH_CHECK_INTERVAL)))
+    if settings.SEMANTIC_SEARCH_ENABLED:
+        # 增量索引新消息
+        background_tasks.append(asyncio.create_task(semantic_indexer.run_forever(settings.SEMANTIC_INDEX_INTERVAL)))
+    if settings.WARMUP_ENABLED:
+        warmup = asyncio.create_task(run_warmup(settings.WARMUP_TIMEOUT))
+        if settings.WARMUP_BLOCKING:
+            await warmup
+        else:
+            # 后台预热，不推迟接收请求
+            background_tasks.append(warmup)
+    job_worker = None
+    if settings.JOB_WORKER_IN_API:
+        # 单进程部署时在 API 进程内执行后台任务，生产环境使用 job_worker.py
+        job_worker = JobWorker(job_queue, settings.JOB_WORKER_CONCURRENCY, settings.JOB_PROGRESS_INTERVAL)
+        background_tasks.append(asyncio.create_task(job_worker.run()))
+    yield
+    if job_worker:
+        # 等待执行中的任务完成，超时的任务标记为失败
+        await job_worker.stop(settings.JOB_SHUTDOWN_TIMEOUT)
+    # 先写完排队中的消息再关闭连接
+    await message_writer.stop()
+    for task in background_tasks:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    password_hasher.shutdown()
+    await llm_router.close()
+    await close_redis()
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
     version=settings.PROJECT_VERSION,
     description=settings.PROJECT_DESCRIPTION,
-    openapi_url=f"{settings.API_V1_STR}/openapi.json"
+    openapi_url=f"{settings.API_V1_STR}/openapi.json",
+    lifespan=lifespan
 )
 
 # Configure CORS
@@ -18,12 +80,42 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 按管理员请求头或抽样率开启单个请求的性能分析
+app.add_middleware(ProfilingMiddleware)
+
+if settings.METRICS_ENABLED:
+    # 按路由记录请求延迟
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        """Prometheus 文本格式的指标"""
+        body, content_type = render_metrics()
+        return Response(content=body, media_type=content_type)
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request: Request, exc: AdmissionRejected):
+    # 模型排队已满或等待超时，提示客户端稍后重试
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+@app.exception_handler(RateLimited)
+async def rate_limited_handler(request: Request, exc: RateLimited):
+    # 超出用户限额，响应头给出各限额的余量和重置时间
+    return JSONResponse(status_code=exc.status_code, content={"detail": str(exc)}, headers=exc.status.headers())
+
 # Import and include routers
-from routers import chat, auth, ai
+from routers import chat, auth, ai, profiling, search, jobs
 
 app.include_router(auth.router, prefix=settings.API_V1_STR)
 app.include_router(chat.router, prefix=settings.API_V1_STR)
 app.include_router(ai.router, prefix=settings.API_V1_STR)
+app.include_router(profiling.router, prefix=settings.API_V1_STR)
+app.include_router(search.router, prefix=settings.API_V1_STR)
+app.include_router(jobs.router, prefix=settings.API_V1_STR)
 
 if __name__ == "__main__":
     import uvicorn
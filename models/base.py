@@ -2,27 +2,67 @@ from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import QueuePool
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from core.config import settings
+from core.metrics import instrument_engine
+from core import profiling
 import logging
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# 创建数据库引擎，配置连接池
+# 创建数据库引擎，配置连接池（同步引擎，供 init_db 等脚本使用）
 engine = create_engine(
     settings.DATABASE_URL,
     poolclass=QueuePool,
-    pool_size=5,  # 连接池大小
-    max_overflow=10,  # 超过pool_size后最多可以创建的连接数
-    pool_timeout=30,  # 连接池中没有可用连接的等待时间
-    pool_recycle=1800,  # 连接在连接池中重复使用的时间间隔（秒）
-    echo=False  # 设置为True可以输出SQL语句，用于调试
+    pool_size=settings.DB_POOL_SIZE,  # 连接池大小
+    max_overflow=settings.DB_MAX_OVERFLOW,  # 超过pool_size后最多可以创建的连接数
+    pool_timeout=settings.DB_POOL_TIMEOUT,  # 连接池中没有可用连接的等待时间
+    pool_recycle=settings.DB_POOL_RECYCLE,  # 连接在连接池中重复使用的时间间隔（秒）
+    echo=settings.DB_ECHO  # 设置为True可以输出SQL语句，用于调试
 )
 
 # 创建会话工厂
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+
+def _async_pool_kwargs(url: str) -> dict:
+    """异步引擎的连接池参数。SQLite（aiosqlite，测试用）不支持连接池大小配置"""
+    if url.startswith("sqlite"):
+        return {}
+    return {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+
+# 创建异步数据库引擎，请求处理链路上统一使用，避免阻塞事件循环
+async_engine = create_async_engine(
+    settings.ASYNC_DATABASE_URL,
+    echo=settings.DB_ECHO,
+    **_async_pool_kwargs(settings.ASYNC_DATABASE_URL)
+)
+
+# 创建异步会话工厂。提交后不过期对象，便于在响应序列化时继续访问属性
+AsyncSessionLocal = async_sessionmaker(
+    async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False
+)
+
+# 连接池指标（/metrics）
+instrument_engine(engine, "sync")
+instrument_engine(async_engine.sync_engine, "async")
+
+# 性能分析模式下的 SQL 明细
+profiling.instrument_engine(engine)
+profiling.instrument_engine(async_engine.sync_engine)
+
 # 声明基类
 Base = declarative_base()
 
@@ -37,4 +77,16 @@ def get_db():
         raise
     finally:
         db.close()
-        logger.debug("Database session closed") 
\ No newline at end of file
+        logger.debug("Database session closed")
+
+async def get_async_db():
+    """获取异步数据库会话的依赖函数"""
+    async with AsyncSessionLocal() as db:
+        try:
+            yield db
+        except Exception as e:
+            logger.error(f"Database error: {str(e)}")
+            await db.rollback()
+            raise
+        finally:
+            logger.debug("Async database session closed")
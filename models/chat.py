@@ -1,6 +1,16 @@
-from sqlalchemy import Column, String, Text, DateTime, BigInteger, func
+from sqlalchemy import Column, String, Text, DateTime, BigInteger, Integer, Index, func
+from sqlalchemy.dialects import sqlite
 from .base import Base
 
+# SQLite（测试用）下与 CURRENT_TIMESTAMP 的存储格式保持一致，保证分页游标按时间比较正确
+_SQLITE_DATETIME = sqlite.DATETIME(
+    storage_format="%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d"
+)
+
+# 回答状态
+MESSAGE_STATUS_COMPLETE = 0
+MESSAGE_STATUS_TRUNCATED = 1  # 客户端断开后取消了生成，只保存了已生成的部分
+
 class Conversation(Base):
     """AI 对话信息表"""
     __tablename__ = "ai_conversation"
@@ -18,14 +28,23 @@ class Conversation(Base):
 class Message(Base):
     """AI 聊天信息表。一次对话支持多轮问答信息"""
     __tablename__ = "ai_message"
+    __table_args__ = (
+        # 覆盖按对话分页查询：WHERE conversation_id = ? ORDER BY create_time, message_id
+        Index("ix_ai_message_conversation_time", "conversation_id", "create_time", "message_id"),
+        # 覆盖语义索引的增量扫描：WHERE update_time >= ? ORDER BY update_time, message_id
+        Index("ix_ai_message_update_time", "update_time", "message_id"),
+    )
     
     message_id = Column(String(64), primary_key=True, comment='消息唯一ID')
-    conversation_id = Column(String(64), nullable=False, index=True, comment='对话ID')
+    conversation_id = Column(String(64), nullable=False, comment='对话ID')
     llm_id = Column(BigInteger, nullable=False, comment='大模型ID')
     question = Column(Text, nullable=False, comment='用户问题')
     answer = Column(Text, comment='AI回答')
+    question_tokens = Column(Integer, comment='问题的token数')
+    answer_tokens = Column(Integer, comment='回答的token数')
+    status = Column(Integer, nullable=False, server_default="0", comment='回答状态：0-完整，1-客户端断开被截断')
     create_by = Column(String(100), comment='创建人')
-    create_time = Column(DateTime, server_default=func.current_timestamp(), comment='创建时间')
+    create_time = Column(DateTime().with_variant(_SQLITE_DATETIME, "sqlite"), server_default=func.current_timestamp(), comment='创建时间')
     update_by = Column(String(100), comment='更新人')
-    update_time = Column(DateTime, server_default=func.current_timestamp(), 
+    update_time = Column(DateTime().with_variant(_SQLITE_DATETIME, "sqlite"), server_default=func.current_timestamp(), 
                         onupdate=func.current_timestamp(), comment='更新时间') 
\ No newline at end of file
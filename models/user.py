@@ -1,6 +1,5 @@
 from sqlalchemy import Column, Integer, String, DateTime
 from sqlalchemy.sql import func
-from sqlalchemy.orm import relationship
 from .base import Base
 
 class User(Base):
@@ -9,6 +8,4 @@ class User(Base):
     id = Column(Integer, primary_key=True, index=True)
     email = Column(String(255), unique=True, index=True)
     hashed_password = Column(String(255))
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-    
-    conversations = relationship("Conversation", back_populates="user") 
\ No newline at end of file
+    created_at = Column(DateTime(timezone=True), server_default=func.now()) 
\ No newline at end of file
@@ -1,70 +1,232 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List, Optional
-from models.base import get_db
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Any, AsyncIterator, Dict, List, Optional
+import json
+from models.base import get_async_db
+from models.user import User
+from core.config import settings
+from dependencies.auth import get_current_user, verify_admin
 from services.ai_service import AiService
+from services.batch_service import BatchInProgress, BatchRunner, apply_shortcut
+from services.jobs import JOB_CHAT, job_queue
+from services.llm_router import llm_router
+from services.llm_scheduler import AdmissionRejected, llm_scheduler
+from services.auth_cache import auth_cache
+from services.config_cache import config_cache
+from services.response_cache import response_cache
+from utils.disconnect import ClientDisconnected, cancel_on_disconnect
+from dependencies.rate_limit import check_client_rate_limit, check_user_rate_limit, client_key
+from services.rate_limiter import RateLimitStatus
+from routers.jobs import job_submitted
 from schemas.ai_models import (
     LLMConfigurationResponse,
     ShortcutConfigurationResponse,
     ChatRequest,
-    ChatResponse
+    ChatResponse,
+    BatchChatRequest
 )
+from schemas.jobs import JobSubmitted
 
 router = APIRouter(prefix="/ai", tags=["ai"])
 
 @router.get("/llm/list", response_model=List[LLMConfigurationResponse])
 async def get_llm_list(
     status: Optional[int] = None,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取大模型列表
-    
+
     Args:
         status: 可选，模型状态（0-禁用，1-启用）
         db: 数据库会话
     """
     service = AiService(db)
-    return service.get_llm_configurations(status)
+    return await service.get_llm_configurations(status)
 
 @router.get("/shortcut/list", response_model=List[ShortcutConfigurationResponse])
 async def get_shortcut_list(
     status: Optional[int] = None,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取快捷助手列表
-    
+
     Args:
         status: 可选，助手状态（0-禁用，1-启用）
         db: 数据库会话
     """
     service = AiService(db)
-    return service.get_shortcut_configurations(status)
+    return await service.get_shortcut_configurations(status)
 
-@router.post("/chat", response_model=ChatResponse)
+@router.post("/chat", response_model=ChatResponse, responses={202: {"model": JobSubmitted}})
 async def chat_with_llm(
     request: ChatRequest,
-    db: Session = Depends(get_db)
+    http_request: Request,
+    job: bool = Query(False, description="以后台任务执行，立即返回任务ID"),
+    db: AsyncSession = Depends(get_async_db),
+    rate_limit: RateLimitStatus = Depends(check_client_rate_limit)
 ):
-    """与大模型对话
-    
+    """与大模型对话，客户端断开时取消生成；未登录，按客户端地址限流
+
     Args:
         request: 包含prompt和model_id的请求体
+        job: 为 true 时放入任务队列，返回 202 和任务ID
         db: 数据库会话
     """
+    user_key = client_key(http_request)
+    if job:
+        submitted = await job_queue.submit(
+            JOB_CHAT, {"model_id": request.model_id, "prompt": request.prompt, "user_key": user_key}
+        )
+        return JSONResponse(
+            status_code=202, content=job_submitted(submitted).model_dump(), headers=rate_limit.headers()
+        )
     try:
         service = AiService(db)
-        content = await service.chat_with_llm(request.model_id, request.prompt)
-        
+        content = await cancel_on_disconnect(
+            http_request,
+            service.chat_with_llm(request.model_id, request.prompt, user_key=user_key),
+            settings.DISCONNECT_POLL_INTERVAL
+        )
+
         # 获取模型名称
-        model = db.query(AiLLMConfiguration).filter(
-            AiLLMConfiguration.id == request.model_id
-        ).first()
-        
+        model = await service.get_llm_configuration(request.model_id)
+
         return ChatResponse(
             content=content,
-            model_name=model.name if model else "Unknown"
+            model_name=model.llm_en_name if model else "Unknown"
         )
+    except AdmissionRejected:
+        raise
+    except ClientDisconnected:
+        raise HTTPException(status_code=499, detail="Client closed request")
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/cache/stats")
+async def get_cache_stats() -> Dict[str, Any]:
+    """获取配置缓存、响应缓存和认证缓存的命中统计"""
+    return {"config": config_cache.stats(), "response": response_cache.stats(), "auth": auth_cache.stats()}
+
+@router.post("/cache/invalidate", dependencies=[Depends(verify_admin)])
+async def invalidate_config_cache(
+    namespace: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """清除配置缓存并通知所有 worker，需要请求头 X-Admin-Token 携带 ADMIN_TOKEN
+
+    Args:
+        namespace: 可选，llm 或 shortcut；为空时清除全部
+    """
+    if namespace not in (None, "llm", "shortcut"):
+        raise HTTPException(status_code=400, detail="namespace must be 'llm' or 'shortcut'")
+    await config_cache.invalidate(namespace)
+    return {"invalidated": namespace or "*"}
+
+
+@router.get("/llm/backends", dependencies=[Depends(verify_admin)])
+async def get_llm_backends() -> Dict[str, Any]:
+    """模型端点的健康状态、熔断状态和当前负载"""
+    return llm_router.stats()
+
+@router.get("/scheduler/stats", dependencies=[Depends(verify_admin)])
+async def get_scheduler_stats() -> Dict[str, Any]:
+    """获取各模型的并发、排队深度和等待时间统计"""
+    return llm_scheduler.stats()
+
+async def _stream_batch(
+    runner: BatchRunner,
+    batch_id: str,
+    items: List[Dict[str, Any]],
+    completed: Dict[int, Dict[str, Any]],
+    replay: bool,
+    rate_limit: RateLimitStatus
+):
+    """校验模型并加锁后以 NDJSON 返回批次结果"""
+    try:
+        model_configs = await runner.resolve_models(items)
+        await runner.acquire(batch_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except BatchInProgress as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    async def lines() -> AsyncIterator[str]:
+        async for result in runner.run(batch_id, items, model_configs, completed, replay=replay):
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={"X-Batch-Id": batch_id, "X-Accel-Buffering": "no", **rate_limit.headers()}
+    )
+
+@router.post("/batch")
+async def create_batch(
+    request: BatchChatRequest,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user),
+    rate_limit: RateLimitStatus = Depends(check_user_rate_limit)
+):
+    """批量执行提示词，结果按完成顺序以 NDJSON 流式返回
+
+    请求体传入 items（model_id + prompt 列表），或 shortcut_id + inputs。
+    第一行包含 batch_id，连接中断后可调用 /ai/batch/{batch_id}/resume 继续执行。
+    """
+    service = AiService(db)
+    if request.shortcut_id is not None:
+        shortcut = await service.get_shortcut_configuration(request.shortcut_id)
+        if not shortcut:
+            raise HTTPException(status_code=404, detail=f"Shortcut with ID {request.shortcut_id} not found or not active")
+        items = [{"model_id": shortcut.model_id, "prompt": apply_shortcut(shortcut, text)} for text in request.inputs]
+    else:
+        items = [item.model_dump() for item in request.items]
+
+    if not items:
+        raise HTTPException(status_code=400, detail="Batch contains no items")
+    if len(items) > settings.BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Batch exceeds {settings.BATCH_MAX_ITEMS} items")
+
+    runner = BatchRunner(service, str(current_user.id), request.concurrency)
+    try:
+        batch_id = await runner.create(items)
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Failed to store batch: {str(e)}")
+    return await _stream_batch(runner, batch_id, items, {}, replay=False, rate_limit=rate_limit)
+
+@router.post("/batch/{batch_id}/resume")
+async def resume_batch(
+    batch_id: str,
+    concurrency: int = 4,
+    replay: bool = True,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user),
+    rate_limit: RateLimitStatus = Depends(check_user_rate_limit)
+):
+    """继续执行批次中未完成（或失败）的条目
+
+    Args:
+        batch_id: 批次ID
+        concurrency: 每个模型的并发数
+        replay: 是否先返回已完成的结果
+    """
+    runner = BatchRunner(AiService(db), str(current_user.id), concurrency)
+    try:
+        items, completed = await runner.load(batch_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return await _stream_batch(runner, batch_id, items, completed, replay=replay, rate_limit=rate_limit)
+
+@router.get("/batch/{batch_id}")
+async def get_batch_status(
+    batch_id: str,
+    current_user: User = Depends(get_current_user)
+) -> Dict[str, Any]:
+    """获取批次进度"""
+    runner = BatchRunner(None, str(current_user.id), 1)
+    try:
+        return await runner.status(batch_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
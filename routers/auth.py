@@ -1,41 +1,84 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from models.base import get_db
+from jose import jwt
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from models.base import get_async_db
 from models.user import User
-from dependencies.auth import verify_password, get_password_hash, create_access_token
+from dependencies.auth import verify_and_update_password, get_password_hash, create_access_token, get_current_user, oauth2_scheme, verify_admin
+from core.config import settings
+from services.auth_cache import auth_cache, token_digest
+from services.password_hasher import password_hasher
 from schemas.auth import UserCreate, Token, UserResponse
 
 router = APIRouter(tags=["auth"])
 
 @router.post("/register", response_model=UserResponse)
-async def register(user: UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.email == user.email).first()
+async def register(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
+    result = await db.execute(select(User).where(User.email == user.email))
+    db_user = result.scalars().first()
     if db_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
         )
     
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash(user.password)
     db_user = User(email=user.email, hashed_password=hashed_password)
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
 @router.post("/token", response_model=Token)
 async def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    user = db.query(User).filter(User.email == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    result = await db.execute(select(User).where(User.email == form_data.username))
+    user = result.scalars().first()
+    verified, new_hash = (False, None)
+    if user:
+        verified, new_hash = await verify_and_update_password(form_data.password, user.hashed_password)
+    else:
+        await password_hasher.dummy_verify()
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    if new_hash is not None:
+        # bcrypt 成本配置变化，用本次登录的明文重新计算哈希
+        user.hashed_password = new_hash
+        await db.commit()
     
-    access_token = create_access_token(data={"sub": str(user.id)})
-    return {"access_token": access_token, "token_type": "bearer"} 
\ No newline at end of file
+    # 令牌携带签发时的版本号，全部注销后旧版本令牌失效
+    version = await auth_cache.get_token_version(user.id)
+    access_token = create_access_token(data={"sub": str(user.id), "ver": version})
+    return {"access_token": access_token, "token_type": "bearer"}
+
+@router.post("/logout")
+async def logout(
+    all_tokens: bool = Query(False, alias="all"),
+    token: str = Depends(oauth2_scheme),
+    current_user: User = Depends(get_current_user)
+):
+    """注销当前令牌；all=true 时注销该用户的全部令牌"""
+    try:
+        if all_tokens:
+            await auth_cache.revoke_user_tokens(current_user.id)
+        else:
+            payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
+            await auth_cache.revoke_token(token_digest(token), float(payload["exp"]))
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Failed to revoke token: {str(e)}"
+        )
+    return {"status": "success"} 
+
+@router.get("/password-hasher/stats", dependencies=[Depends(verify_admin)])
+async def get_password_hasher_stats():
+    """获取密码哈希线程池的并发和排队统计"""
+    return password_hasher.stats()
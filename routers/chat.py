@@ -1,8 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List, Optional, Dict, Any
-from models.base import get_db
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Literal, Optional, Dict, Any
+from datetime import datetime
+from core.config import settings
+from models.base import get_async_db, AsyncSessionLocal
+from models.user import User
+from dependencies.auth import get_current_user
+from dependencies.rate_limit import check_user_rate_limit
 from services.ai_service import AiService
+from services.export_service import ExportService, decode_export_cursor, encode_stream
+from services.jobs import JOB_MESSAGE, job_queue
+from services.llm_scheduler import AdmissionRejected
+from services.rate_limiter import RateLimitStatus
+from routers.jobs import job_submitted
 from schemas.ai_models import (
     LLMConfigurationResponse,
     ShortcutConfigurationResponse,
@@ -13,54 +24,78 @@ from schemas.chat import (
     MessageCreate,
     MessageResponse
 )
+from schemas.jobs import JobSubmitted
+from utils.sse import format_sse
+from utils.pagination import decode_cursor
+from utils.disconnect import ClientDisconnected, cancel_on_disconnect
+import anyio
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 
 @router.get("/models", response_model=List[LLMConfigurationResponse])
 async def get_available_models(
     status: Optional[int] = None,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取可用的大模型列表
-    
+
     Args:
         status: 可选，模型状态（0-禁用，1-启用）
         db: 数据库会话
     """
     service = AiService(db)
-    return service.get_llm_configurations(status)
+    return await service.get_llm_configurations(status)
 
 @router.get("/shortcuts", response_model=List[ShortcutConfigurationResponse])
 async def get_shortcuts(
     status: Optional[int] = None,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取快捷助手列表
-    
+
     Args:
         status: 可选，助手状态（0-禁用，1-启用）
         db: 数据库会话
     """
     service = AiService(db)
-    return service.get_shortcut_configurations(status)
+    return await service.get_shortcut_configurations(status)
 
 @router.post("/conversations", response_model=ConversationResponse)
 async def create_conversation(
     conversation: ConversationCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user)
 ):
     """创建新的对话"""
-    service = AiService(db)
-    return service.create_conversation(conversation)
+    try:
+        service = AiService(db)
+        return await service.create_conversation(
+            {"llm_id": conversation.model_id, "title": conversation.title},
+            user_id=str(current_user.id),
+            username=current_user.email
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
 
-@router.post("/conversations/{conversation_id}/messages", response_model=MessageResponse)
+@router.post(
+    "/conversations/{conversation_id}/messages",
+    response_model=MessageResponse,
+    responses={202: {"model": JobSubmitted}}
+)
 async def create_message(
-    conversation_id: int,
+    conversation_id: str,
     request: Dict[str, Any],
-    db: Session = Depends(get_db)
+    http_request: Request,
+    job: bool = Query(False, description="以后台任务执行，立即返回任务ID"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user),
+    rate_limit: RateLimitStatus = Depends(check_user_rate_limit)
 ):
     """发送消息并获取回复
-    
+
+    客户端在回复返回前断开时取消生成，已生成的部分回答以截断状态保存。
+    job=true 时放入任务队列由 worker 生成，返回 202 和任务ID，通过 /jobs 接口查询或订阅进度。
+
     Args:
         conversation_id: 对话ID
         request: 请求体，包含：
@@ -70,15 +105,15 @@ async def create_message(
     """
     try:
         service = AiService(db)
-        
+
         # 验证请求体
         if not isinstance(request, dict):
             raise HTTPException(status_code=400, detail="Invalid request format")
-        
+
         content = request.get("content")
         if not content:
             raise HTTPException(status_code=400, detail="Message content is required")
-            
+
         # 创建消息请求
         message = MessageCreate(
             conversation_id=conversation_id,
@@ -86,20 +121,187 @@ async def create_message(
             model_id=request.get("model_id"),
             params=request.get("params", {})
         )
-        
+
+        if job:
+            # 提交前检查对话归属，不属于当前用户时与不存在一样返回 404
+            await service.get_conversation(conversation_id, str(current_user.id))
+            submitted = await job_queue.submit(
+                JOB_MESSAGE,
+                {"message": message.model_dump(), "username": current_user.email},
+                user_id=str(current_user.id)
+            )
+            return JSONResponse(
+                status_code=202, content=job_submitted(submitted).model_dump(), headers=rate_limit.headers()
+            )
+
         # 处理消息
-        return await service.process_message(message)
-        
+        return await cancel_on_disconnect(
+            http_request,
+            service.process_message(message.model_dump(), username=current_user.email, user_id=str(current_user.id)),
+            settings.DISCONNECT_POLL_INTERVAL
+        )
+
+    except (HTTPException, AdmissionRejected):
+        raise
+    except ClientDisconnected:
+        raise HTTPException(status_code=499, detail="Client closed request")
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/conversations/{conversation_id}/messages/stream")
+async def stream_message(
+    conversation_id: str,
+    request: Dict[str, Any],
+    current_user: User = Depends(get_current_user),
+    rate_limit: RateLimitStatus = Depends(check_user_rate_limit)
+):
+    """发送消息并以 Server-Sent Events 流式返回回复
+
+    Args:
+        conversation_id: 对话ID
+        request: 请求体，包含：
+            - content: str 消息内容
+            - checkpoint_interval: float 可选，中间保存部分回答的间隔（秒）
+    """
+    content = request.get("content")
+    if not content:
+        raise HTTPException(status_code=400, detail="Message content is required")
+
+    message = MessageCreate(
+        conversation_id=conversation_id,
+        content=content,
+        model_id=request.get("model_id"),
+        params=request.get("params", {})
+    )
+
+    # 流式响应的生命周期长于依赖注入的会话，这里单独创建会话并在流结束时关闭
+    db = AsyncSessionLocal()
+    events = AiService(db).stream_message(
+        message.model_dump(),
+        username=current_user.email,
+        user_id=str(current_user.id),
+        checkpoint_interval=request.get("checkpoint_interval")
+    )
+
+    # 预先取出第一个事件，使对话/模型不存在等错误仍以普通 HTTP 错误返回
+    try:
+        first_event = await events.__anext__()
+    except AdmissionRejected:
+        await db.close()
+        raise
     except ValueError as e:
+        await db.close()
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
+        await db.close()
         raise HTTPException(status_code=500, detail=str(e))
 
+    async def event_stream():
+        # 客户端断开时 Starlette 会取消整个流，部分回答的保存在 AiService 中完成
+        try:
+            yield format_sse(first_event["event"], first_event["data"])
+            async for event in events:
+                yield format_sse(event["event"], event["data"])
+        finally:
+            # 流被取消后清理过程不能再被打断
+            with anyio.CancelScope(shield=True):
+                await events.aclose()
+                await db.close()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", **rate_limit.headers()}
+    )
+
 @router.get("/conversations/{conversation_id}/messages", response_model=List[MessageResponse])
 async def get_conversation_messages(
-    conversation_id: int,
-    db: Session = Depends(get_db)
+    conversation_id: str,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    fields: Literal["full", "question", "summary"] = "full",
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user)
 ):
-    """获取对话的消息历史"""
-    service = AiService(db)
-    return service.get_conversation_messages(conversation_id) 
\ No newline at end of file
+    """分页获取对话的消息历史
+
+    Args:
+        limit: 可选，每页条数
+        before: 可选，返回该游标之前（更早）的消息
+        after: 可选，返回该游标之后（更新）的消息
+        fields: full 返回完整消息；question 只返回问题；summary 回答只返回开头部分
+
+    翻页游标通过响应头 X-Prev-Cursor（传给 before）和 X-Next-Cursor（传给 after）返回。
+    """
+    if before and after:
+        raise HTTPException(status_code=400, detail="Only one of before/after can be specified")
+    try:
+        for cursor in (before, after):
+            if cursor:
+                decode_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        service = AiService(db)
+        page = await service.get_conversation_messages(
+            conversation_id, user_id=str(current_user.id), limit=limit, before=before, after=after, fields=fields
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    if page.prev_cursor:
+        response.headers["X-Prev-Cursor"] = page.prev_cursor
+    if page.next_cursor:
+        response.headers["X-Next-Cursor"] = page.next_cursor
+    return page.items
+
+@router.get("/export")
+async def export_conversations(
+    format: Literal["ndjson", "jsonl.gz"] = "ndjson",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    after: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """流式导出当前用户的全部对话和消息
+
+    Args:
+        format: ndjson 或 gzip 压缩的 jsonl.gz
+        since: 可选，只导出该时间之后创建的消息
+        until: 可选，只导出该时间之前创建的消息
+        after: 可选，上次导出中最后一条记录的 cursor，从其后继续导出
+
+    每行一条 conversation 或 message 记录，最后一行为 end 记录；没有 end 记录说明导出被中断。
+    """
+    if after:
+        try:
+            decode_export_cursor(after)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    # 流式响应的生命周期长于依赖注入的会话，这里单独创建会话并在流结束时关闭
+    db = AsyncSessionLocal()
+    lines = ExportService(db).iter_lines(user_id=str(current_user.id), since=since, until=until, after=after)
+
+    async def export_stream():
+        try:
+            async for chunk in encode_stream(lines, format):
+                yield chunk
+        finally:
+            await lines.aclose()
+            await db.close()
+
+    if format == "jsonl.gz":
+        media_type, filename = "application/gzip", "conversations.jsonl.gz"
+    else:
+        media_type, filename = "application/x-ndjson", "conversations.ndjson"
+    return StreamingResponse(
+        export_stream(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "X-Accel-Buffering": "no"}
+    )
@@ -0,0 +1,76 @@
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import StreamingResponse
+from typing import Any, Dict, Optional
+from core.config import settings
+from models.user import User
+from dependencies.auth import get_optional_user, verify_admin
+from services.jobs import job_queue
+from schemas.jobs import JobStatus, JobSubmitted
+from utils.sse import format_sse
+
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+def job_submitted(job: Dict[str, Any]) -> JobSubmitted:
+    base = f"{settings.API_V1_STR}/jobs/{job['job_id']}"
+    return JobSubmitted(
+        job_id=job["job_id"],
+        kind=job["kind"],
+        status=job["status"],
+        status_url=base,
+        events_url=f"{base}/events"
+    )
+
+def _user_id(user: Optional[User]) -> Optional[str]:
+    return str(user.id) if user is not None else None
+
+@router.get("/stats", dependencies=[Depends(verify_admin)])
+async def get_job_stats() -> Dict[str, Any]:
+    """任务队列长度"""
+    return await job_queue.stats()
+
+@router.get("/{job_id}", response_model=JobStatus)
+async def get_job(job_id: str, current_user: Optional[User] = Depends(get_optional_user)):
+    """查询任务状态、已生成的部分回答和结果"""
+    try:
+        return await job_queue.get(job_id, _user_id(current_user))
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@router.delete("/{job_id}", response_model=JobStatus)
+async def cancel_job(job_id: str, current_user: Optional[User] = Depends(get_optional_user)):
+    """取消任务；执行中的对话消息任务会保存已生成的部分回答"""
+    try:
+        return await job_queue.cancel(job_id, _user_id(current_user))
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@router.get("/{job_id}/events")
+async def subscribe_job(
+    job_id: str,
+    last_event_id: Optional[str] = Header(None),
+    current_user: Optional[User] = Depends(get_optional_user)
+):
+    """以 Server-Sent Events 订阅任务进度
+
+    依次推送 queued、running、token（合并的新生成内容）和结束事件（succeeded/failed/cancelled）。
+    从头订阅时先重放已有事件；断线重连时浏览器会带上 Last-Event-ID，从该事件之后继续。
+    收到 running 事件表示任务（重新）开始执行，应丢弃之前收到的 token。
+    """
+    try:
+        await job_queue.get(job_id, _user_id(current_user))
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    async def event_stream():
+        async for event_id, event, data in job_queue.events(job_id, last_event_id or "0-0", settings.JOB_SSE_HEARTBEAT):
+            if event_id is None:
+                # 注释行，保持代理和客户端的连接
+                yield ": keep-alive\n\n"
+                continue
+            yield format_sse(event, data, event_id)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
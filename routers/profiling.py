@@ -0,0 +1,30 @@
+from fastapi import APIRouter, Depends, HTTPException
+from typing import Any, Dict, List
+from dependencies.auth import verify_profiling_admin
+from core.profiling import profile_store
+
+router = APIRouter(prefix="/profiles", tags=["profiling"], dependencies=[Depends(verify_profiling_admin)])
+
+@router.get("")
+async def list_profiles(limit: int = 50) -> List[Dict[str, Any]]:
+    """最近的性能分析报告摘要，最新的在前"""
+    reports = profile_store.values()[::-1][:limit]
+    return [
+        {
+            "id": report["id"],
+            "method": report["method"],
+            "path": report["path"],
+            "status": report["status"],
+            "total_ms": report["total_ms"],
+            "sql_count": report["sql"]["count"],
+        }
+        for report in reports
+    ]
+
+@router.get("/{profile_id}")
+async def get_profile(profile_id: str) -> Dict[str, Any]:
+    """获取单个请求的完整分析报告"""
+    report = profile_store.get(profile_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return report
@@ -0,0 +1,46 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Any, Dict, List
+from models.base import get_async_db
+from models.user import User
+from dependencies.auth import get_current_user, verify_admin
+from schemas.chat import SemanticSearchHit
+from services.semantic_search import SemanticSearchService, semantic_indexer
+
+router = APIRouter(prefix="/search", tags=["search"])
+
+@router.get("/messages", response_model=List[SemanticSearchHit])
+async def search_messages(
+    q: str = Query(..., min_length=1),
+    top_k: int = Query(10, ge=1, le=100),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user)
+):
+    """在当前用户的历史对话中按语义检索问答
+
+    Args:
+        q: 检索文本
+        top_k: 返回条数
+    """
+    try:
+        service = SemanticSearchService(db)
+        return await service.search(str(current_user.id), q, top_k)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/reindex")
+async def reindex_messages(
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user)
+) -> Dict[str, Any]:
+    """重新索引当前用户的全部消息，内容未变化的消息不会重新计算向量"""
+    try:
+        service = SemanticSearchService(db)
+        return await service.reindex(str(current_user.id))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/stats", dependencies=[Depends(verify_admin)])
+async def get_search_stats() -> Dict[str, Any]:
+    """向量索引和向量缓存统计"""
+    return {"index": semantic_indexer.store.stats(), "embedding": semantic_indexer.embeddings.stats()}
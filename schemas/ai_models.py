@@ -1,18 +1,24 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, List
 from datetime import datetime
 
 class LLMConfigurationBase(BaseModel):
-    name: str
-    model_id: str
-    description: Optional[str] = None
-    provider: Optional[str] = None
+    llm_zh_name: str
+    llm_en_name: str
+    parent_id: Optional[int] = 0
+    api_url: Optional[str] = None
+    top_p: Optional[float] = None
+    temperature: Optional[float] = None
+    max_tokens: Optional[int] = None
+    do_sample: Optional[bool] = None
+    max_chat_limit: Optional[int] = None
+    is_local_llm: bool = False
     status: int = 1
 
 class LLMConfigurationResponse(LLMConfigurationBase):
-    id: int
-    created_time: datetime
-    updated_time: Optional[datetime] = None
+    llm_id: int
+    create_time: Optional[datetime] = None
+    update_time: Optional[datetime] = None
 
     class Config:
         from_attributes = True
@@ -26,7 +32,7 @@ class ShortcutConfigurationBase(BaseModel):
 
 class ShortcutConfigurationResponse(ShortcutConfigurationBase):
     id: int
-    created_time: datetime
+    created_time: Optional[datetime] = None
     updated_time: Optional[datetime] = None
 
     class Config:
@@ -38,4 +44,15 @@ class ChatRequest(BaseModel):
 
 class ChatResponse(BaseModel):
     content: str
-    model_name: str 
\ No newline at end of file
+    model_name: str 
+
+class BatchChatItem(BaseModel):
+    prompt: str
+    model_id: int
+
+class BatchChatRequest(BaseModel):
+    items: List[BatchChatItem] = Field(default_factory=list)
+    # 使用快捷助手时传入 shortcut_id 和 inputs，模型取助手关联的模型
+    shortcut_id: Optional[int] = None
+    inputs: List[str] = Field(default_factory=list)
+    concurrency: int = 4
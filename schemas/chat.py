@@ -10,10 +10,13 @@ class ConversationBase(BaseModel):
 class ConversationCreate(ConversationBase):
     pass
 
-class ConversationResponse(ConversationBase):
-    id: int
-    created_at: datetime
-    updated_at: Optional[datetime] = None
+class ConversationResponse(BaseModel):
+    conversation_id: str
+    user_id: str
+    llm_id: int
+    title: str
+    create_time: Optional[datetime] = None
+    update_time: Optional[datetime] = None
 
     class Config:
         from_attributes = True
@@ -25,18 +28,25 @@ class MessageBase(BaseModel):
     params: Dict[str, Any] = Field(default_factory=dict)
 
 class MessageCreate(MessageBase):
-    conversation_id: int
-
-class MessageResponse(MessageBase):
-    id: int
-    conversation_id: int
-    created_at: datetime
-    model_name: Optional[str] = None
-    response: Optional[Dict[str, Any]] = None  # 存储模型返回的完整响应
+    conversation_id: str
+
+class MessageResponse(BaseModel):
+    message_id: str
+    conversation_id: str
+    llm_id: int
+    question: str
+    answer: Optional[str] = None
+    status: Optional[int] = None
+    create_time: Optional[datetime] = None
+    update_time: Optional[datetime] = None
 
     class Config:
         from_attributes = True
 
+class SemanticSearchHit(BaseModel):
+    score: float
+    message: MessageResponse
+
 # 用于API响应的通用格式
 class ApiResponse(BaseModel):
     success: bool = True
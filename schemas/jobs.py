@@ -0,0 +1,23 @@
+from pydantic import BaseModel
+from typing import Any, Optional
+
+class JobSubmitted(BaseModel):
+    job_id: str
+    kind: str
+    status: str
+    status_url: str
+    events_url: str
+
+class JobStatus(BaseModel):
+    job_id: str
+    kind: str
+    status: str
+    created: Optional[float] = None
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    attempts: int = 0
+    tokens: int = 0
+    answer: Optional[str] = None
+    result: Optional[Any] = None
+    error: Optional[str] = None
+    cancel_requested: bool = False
@@ -1,50 +1,154 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from models.ai_models import AiLLMConfiguration, AiShortcutConfiguration
-from models.chat import Conversation, Message
-from langchain_ollama import OllamaLLM
-from typing import List, Optional, Dict, Any
+from models.chat import Conversation, Message, MESSAGE_STATUS_COMPLETE, MESSAGE_STATUS_TRUNCATED
+from services.llm_router import llm_router
+from services.config_cache import config_cache
+from services.response_cache import response_cache
+from services.context_builder import BuiltContext, ContextBuilder, estimate_tokens
+from services.kv_context import KVContext, kv_context_store
+from services.llm_scheduler import llm_scheduler, PRIORITY_INTERACTIVE
+from services.message_writer import message_writer
+from services.rate_limiter import rate_limiter
+from typing import List, Optional, Dict, Any, AsyncIterator
+from core.config import settings
+from core.metrics import (
+    LLM_KV_CONTEXT, LLM_REQUESTS, LLM_TIME_TO_FIRST_TOKEN, observe_llm_cancellation, observe_llm_generation
+)
+from core.profiling import record_span
+from utils.pagination import Page, decode_cursor, encode_cursor
+import anyio
+import asyncio
 import logging
+import time
 from datetime import datetime
 import uuid
 
 logger = logging.getLogger(__name__)
 
+_MESSAGE_KEY_COLUMNS = (
+    Message.message_id, Message.conversation_id, Message.llm_id,
+    Message.question, Message.status, Message.create_time, Message.update_time,
+)
+
+# 消息历史可选的字段投影
+MESSAGE_PROJECTIONS = {
+    "full": _MESSAGE_KEY_COLUMNS + (Message.answer,),
+    "question": _MESSAGE_KEY_COLUMNS,
+    "summary": _MESSAGE_KEY_COLUMNS + (
+        func.substr(Message.answer, 1, settings.MESSAGE_SUMMARY_LENGTH).label("answer"),
+    ),
+}
+
+# 顶层模型配置；parent_id 指向其他模型的行是该模型的附加端点
+_TOP_LEVEL_LLM = or_(AiLLMConfiguration.parent_id == 0, AiLLMConfiguration.parent_id.is_(None))
+
 class AiService:
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession):
         self.db = db
 
-    def get_llm_configurations(self, status: Optional[int] = None) -> List[AiLLMConfiguration]:
+    async def get_llm_configurations(self, status: Optional[int] = None) -> List[AiLLMConfiguration]:
         """获取大模型配置列表"""
-        query = self.db.query(AiLLMConfiguration)
-        if status is not None:
-            query = query.filter(AiLLMConfiguration.status == status)
-        return query.all()
+        async def load():
+            # parent_id 非 0 的行是某个模型的附加端点，不作为单独的模型
+            stmt = select(AiLLMConfiguration).where(_TOP_LEVEL_LLM)
+            if status is not None:
+                stmt = stmt.where(AiLLMConfiguration.status == status)
+            result = await self.db.execute(stmt)
+            return self._detach(result.scalars().all())
+
+        return await config_cache.get_or_load("llm", ("list", status), load)
 
-    def get_shortcut_configurations(self, status: Optional[int] = None) -> List[AiShortcutConfiguration]:
+    async def get_shortcut_configurations(self, status: Optional[int] = None) -> List[AiShortcutConfiguration]:
         """获取快捷助手配置列表"""
-        query = self.db.query(AiShortcutConfiguration)
-        if status is not None:
-            query = query.filter(AiShortcutConfiguration.status == status)
-        return query.all()
+        async def load():
+            stmt = select(AiShortcutConfiguration)
+            if status is not None:
+                stmt = stmt.where(AiShortcutConfiguration.status == status)
+            result = await self.db.execute(stmt)
+            return self._detach(result.scalars().all())
+
+        return await config_cache.get_or_load("shortcut", ("list", status), load)
+
+    async def get_llm_configuration(self, llm_id: int) -> Optional[AiLLMConfiguration]:
+        """获取单个可用的大模型配置"""
+        async def load():
+            result = await self.db.execute(
+                select(AiLLMConfiguration).where(
+                    AiLLMConfiguration.llm_id == llm_id,
+                    AiLLMConfiguration.status == 1,
+                    _TOP_LEVEL_LLM
+                )
+            )
+            model = result.scalars().first()
+            if not model:
+                return None
+            # 同一模型的其他端点，由 llm_router 负载均衡
+            children = await self.db.execute(
+                select(AiLLMConfiguration).where(
+                    AiLLMConfiguration.parent_id == llm_id,
+                    AiLLMConfiguration.status == 1
+                )
+            )
+            model, *endpoints = self._detach([model, *children.scalars().all()])
+            llm_router.configure(model, endpoints)
+            return model
+
+        return await config_cache.get_or_load("llm", ("active", llm_id), load)
+
+    async def get_shortcut_configuration(self, shortcut_id: int) -> Optional[AiShortcutConfiguration]:
+        """获取单个启用的快捷助手配置"""
+        async def load():
+            result = await self.db.execute(
+                select(AiShortcutConfiguration).where(
+                    AiShortcutConfiguration.id == shortcut_id,
+                    AiShortcutConfiguration.status == 1
+                )
+            )
+            shortcut = result.scalars().first()
+            return self._detach([shortcut])[0] if shortcut else None
 
-    def create_conversation(self, conversation_data: Dict[str, Any], user_id: str, username: str) -> Conversation:
+        return await config_cache.get_or_load("shortcut", ("active", shortcut_id), load)
+
+    def _detach(self, objects) -> list:
+        """把配置对象移出当前会话，使其可以跨请求缓存"""
+        objects = list(objects)
+        for obj in objects:
+            self.db.expunge(obj)
+        return objects
+
+    async def _get_conversation(self, conversation_id: str, user_id: str) -> Conversation:
+        """获取属于该用户的对话，不存在或属于其他用户时抛出 ValueError"""
+        result = await self.db.execute(
+            select(Conversation).where(
+                Conversation.conversation_id == conversation_id,
+                Conversation.user_id == user_id
+            )
+        )
+        conversation = result.scalars().first()
+        if not conversation:
+            raise ValueError(f"Conversation with ID {conversation_id} not found")
+        return conversation
+
+    async def get_conversation(self, conversation_id: str, user_id: str) -> Conversation:
+        """获取属于该用户的对话，不存在或属于其他用户时抛出 ValueError"""
+        return await self._get_conversation(conversation_id, user_id)
+
+    async def create_conversation(self, conversation_data: Dict[str, Any], user_id: str, username: str) -> Conversation:
         """创建新的对话"""
         # 验证模型是否存在且可用
         model_id = conversation_data.get("llm_id")
         if not model_id:
             raise ValueError("LLM ID is required")
-            
-        model = self.db.query(AiLLMConfiguration).filter(
-            AiLLMConfiguration.llm_id == model_id,
-            AiLLMConfiguration.status == 1
-        ).first()
-        
+
+        model = await self.get_llm_configuration(model_id)
+
         if not model:
             raise ValueError(f"Model with ID {model_id} not found or not active")
 
         # 生成唯一的会话ID
         conversation_id = str(uuid.uuid4())
-        
+
         conversation = Conversation(
             conversation_id=conversation_id,
             user_id=user_id,
@@ -54,62 +158,265 @@ class AiService:
             update_by=username
         )
         self.db.add(conversation)
-        self.db.commit()
-        self.db.refresh(conversation)
+        await self.db.commit()
+        await self.db.refresh(conversation)
         return conversation
 
-    def get_conversation_messages(self, conversation_id: str) -> List[Message]:
-        """获取对话的消息历史"""
-        # 检查对话是否存在
-        conversation = self.db.query(Conversation).filter(
-            Conversation.conversation_id == conversation_id
-        ).first()
-        
-        if not conversation:
-            raise ValueError(f"Conversation with ID {conversation_id} not found")
-            
-        # 获取所有相关消息
-        messages = self.db.query(Message).filter(
-            Message.conversation_id == conversation_id
-        ).order_by(Message.create_time).all()
-        
-        return messages
-
-    async def process_message(self, message_data: Dict[str, Any], username: str) -> Message:
-        """处理新消息并获取AI响应"""
+    async def get_conversation_messages(
+        self,
+        conversation_id: str,
+        user_id: str,
+        limit: Optional[int] = None,
+        before: Optional[str] = None,
+        after: Optional[str] = None,
+        fields: str = "full"
+    ) -> Page:
+        """按 (create_time, message_id) 键集分页获取对话的消息历史
+
+        不传游标时返回最新的一页；before 向前翻页，after 向后翻页。每页内按时间正序排列。
+        fields 为 question 时只返回问题，为 summary 时回答截取前若干字符，避免读取完整的 Text 字段。
+        """
+        if before and after:
+            raise ValueError("Only one of before/after can be specified")
+        if fields not in MESSAGE_PROJECTIONS:
+            raise ValueError(f"Unknown fields projection: {fields}")
+        limit = min(limit or settings.MESSAGE_PAGE_SIZE, settings.MESSAGE_PAGE_MAX_SIZE)
+
+        # 检查对话是否存在且属于当前用户
+        await self._get_conversation(conversation_id, user_id)
+
+        stmt = select(*MESSAGE_PROJECTIONS[fields]).where(Message.conversation_id == conversation_id)
+        forward = after is not None
+        if forward:
+            create_time, message_id = decode_cursor(after)
+            stmt = stmt.where(or_(
+                Message.create_time > create_time,
+                and_(Message.create_time == create_time, Message.message_id > message_id)
+            )).order_by(Message.create_time, Message.message_id)
+        else:
+            if before is not None:
+                create_time, message_id = decode_cursor(before)
+                stmt = stmt.where(or_(
+                    Message.create_time < create_time,
+                    and_(Message.create_time == create_time, Message.message_id < message_id)
+                ))
+            stmt = stmt.order_by(Message.create_time.desc(), Message.message_id.desc())
+
+        # 多取一条用于判断是否还有更多数据
+        result = await self.db.execute(stmt.limit(limit + 1))
+        rows = list(result.all())
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if not forward:
+            rows.reverse()
+
+        if not rows:
+            return Page([], None, None)
+        first, last = rows[0], rows[-1]
+        prev_cursor = encode_cursor(first.create_time, first.message_id) \
+            if (has_more if not forward else True) else None
+        next_cursor = encode_cursor(last.create_time, last.message_id) \
+            if (has_more if forward else before is not None) else None
+        return Page(rows, prev_cursor, next_cursor)
+
+    def _write_behind_enabled(self) -> bool:
+        return settings.WRITE_BEHIND_ENABLED and message_writer.running
+
+    async def _server_now(self) -> datetime:
+        """数据库的当前时间，与 create_time 的服务端默认值（CURRENT_TIMESTAMP）取自同一时钟"""
+        result = await self.db.execute(select(func.current_timestamp()))
+        return result.scalar_one()
+
+    async def _generate(
+        self,
+        model_config: AiLLMConfiguration,
+        prompt: str,
+        user_key: str,
+        priority: int = PRIORITY_INTERACTIVE,
+        kv: Optional[KVContext] = None,
+        partial: Optional[List[str]] = None
+    ) -> str:
+        """调用大模型生成完整回复，不采样的模型优先使用响应缓存
+
+        携带 KV 上下文时不使用响应缓存：命中缓存不会返回新的上下文，下一轮只能完整重放。
+        partial 的用法见 _invoke。
+        """
+        if kv is None and settings.RESPONSE_CACHE_ENABLED and response_cache.is_cacheable(model_config):
+            key = response_cache.make_key(model_config, prompt)
+            return await response_cache.get_or_generate(
+                key, lambda: self._invoke(model_config, prompt, user_key, priority, partial=partial)
+            )
+        return await self._invoke(model_config, prompt, user_key, priority, kv, partial)
+
+    async def generate(
+        self,
+        model_config: AiLLMConfiguration,
+        prompt: str,
+        user_key: str,
+        priority: int = PRIORITY_INTERACTIVE
+    ) -> str:
+        """使用已获取的模型配置生成回复，不访问数据库"""
+        return await self._generate(model_config, prompt, user_key, priority)
+
+    async def _invoke(
+        self,
+        model_config: AiLLMConfiguration,
+        prompt: str,
+        user_key: str,
+        priority: int,
+        kv: Optional[KVContext] = None,
+        partial: Optional[List[str]] = None
+    ) -> str:
+        """经过限额检查和准入控制后调用大模型
+
+        传入 partial 时以流式方式生成，并把已生成的片段依次追加到 partial 中；请求被取消时
+        调用方可以保存部分回答，同时关闭到模型端点的连接，模型随即停止生成。
+        生成的 token 数（包括被取消前已生成的部分）计入用户的每日限额。
+        """
+        async with rate_limiter.quota(user_key, model_config.llm_id) as usage, \
+                llm_scheduler.slot(model_config.llm_id, user_key, priority):
+            started = time.perf_counter()
+            try:
+                if partial is None:
+                    response = await llm_router.invoke(model_config, prompt, kv)
+                else:
+                    async for chunk in llm_router.stream(model_config, prompt, kv):
+                        partial.append(chunk)
+                    response = "".join(partial)
+            except asyncio.CancelledError:
+                observe_llm_cancellation(
+                    model_config.llm_id, "invoke", len(partial) if partial else 0, model_config.max_tokens
+                )
+                raise
+            except Exception:
+                LLM_REQUESTS.labels(str(model_config.llm_id), "invoke", "error").inc()
+                raise
+            finally:
+                record_span("llm", time.perf_counter() - started)
+                if partial:
+                    usage.tokens = len(partial)
+            usage.tokens = estimate_tokens(response)
+            observe_llm_generation(model_config.llm_id, "invoke", time.perf_counter() - started, usage.tokens)
+            return response
+
+    async def _astream(
+        self,
+        model_config: AiLLMConfiguration,
+        prompt: str,
+        kv: Optional[KVContext] = None
+    ) -> AsyncIterator[str]:
+        """调用大模型并逐个返回生成的 token"""
+        llm_id = str(model_config.llm_id)
+        started = time.perf_counter()
+        tokens = 0
+        # 只统计等待模型输出的时间，不含调用方处理每个 token 的时间
+        waiting_since: Optional[float] = started
+        llm_wait = 0.0
+        try:
+            async for chunk in llm_router.stream(model_config, prompt, kv):
+                llm_wait += time.perf_counter() - waiting_since
+                waiting_since = None
+                if chunk:
+                    if not tokens:
+                        LLM_TIME_TO_FIRST_TOKEN.labels(llm_id).observe(time.perf_counter() - started)
+                    tokens += 1
+                yield chunk
+                waiting_since = time.perf_counter()
+        except (GeneratorExit, asyncio.CancelledError):
+            # 客户端断开等原因提前结束
+            observe_llm_cancellation(llm_id, "stream", tokens, model_config.max_tokens)
+            raise
+        except Exception:
+            LLM_REQUESTS.labels(llm_id, "stream", "error").inc()
+            raise
+        finally:
+            if waiting_since is not None:
+                llm_wait += time.perf_counter() - waiting_since
+            record_span("llm", llm_wait)
+        observe_llm_generation(llm_id, "stream", time.perf_counter() - started, tokens)
+
+    async def _load_kv_context(
+        self,
+        conversation_id: str,
+        model_config: AiLLMConfiguration,
+        context: BuiltContext
+    ) -> Optional[KVContext]:
+        if not kv_context_store.applies_to(model_config):
+            return None
+        return await kv_context_store.load(conversation_id, model_config, context)
+
+    async def _save_kv_context(
+        self,
+        conversation_id: str,
+        model_config: AiLLMConfiguration,
+        kv: Optional[KVContext],
+        message_id: str
+    ) -> None:
+        """保存本轮返回的上下文，供下一轮只编码新的问题"""
+        if kv is None:
+            return
+        LLM_KV_CONTEXT.labels(str(model_config.llm_id), "reused" if kv.reused else "replayed").inc()
+        await kv_context_store.save(conversation_id, model_config, kv, message_id)
+
+    async def chat_with_llm(
+        self,
+        model_id: int,
+        prompt: str,
+        user_key: str = "anonymous",
+        priority: int = PRIORITY_INTERACTIVE
+    ) -> str:
+        """不保存历史的单次对话"""
+        model_config = await self.get_llm_configuration(model_id)
+        if not model_config:
+            raise ValueError(f"Model with ID {model_id} not found or not active")
+        # 以流式方式生成，客户端断开时可以立即取消
+        return await self._generate(model_config, prompt, user_key, priority, partial=[])
+
+    async def stream_chat(
+        self,
+        model_id: int,
+        prompt: str,
+        user_key: str = "anonymous",
+        priority: int = PRIORITY_INTERACTIVE
+    ) -> AsyncIterator[str]:
+        """不保存历史的单次对话，逐个返回生成的 token"""
+        model_config = await self.get_llm_configuration(model_id)
+        if not model_config:
+            raise ValueError(f"Model with ID {model_id} not found or not active")
+        async with rate_limiter.quota(user_key, model_config.llm_id) as usage, \
+                llm_scheduler.slot(model_config.llm_id, user_key, priority):
+            async for chunk in self._astream(model_config, prompt):
+                if chunk:
+                    usage.tokens += 1
+                    yield chunk
+
+    async def process_message(self, message_data: Dict[str, Any], username: str, user_id: str) -> Message:
+        """处理新消息并获取AI响应
+
+        username 记录在消息的 create_by 中；user_id 用于校验对话归属，也是准入控制和限额的用户键。
+        """
         conversation_id = message_data["conversation_id"]
-        
-        # 检查对话是否存在
-        conversation = self.db.query(Conversation).filter(
-            Conversation.conversation_id == conversation_id
-        ).first()
-        
-        if not conversation:
-            raise ValueError(f"Conversation with ID {conversation_id} not found")
+
+        # 检查对话是否存在且属于当前用户
+        conversation = await self._get_conversation(conversation_id, user_id)
 
         # 使用对话关联的模型
         model_id = conversation.llm_id
 
         # 获取模型配置并验证
-        model_config = self.db.query(AiLLMConfiguration).filter(
-            AiLLMConfiguration.llm_id == model_id,
-            AiLLMConfiguration.status == 1
-        ).first()
-        
+        model_config = await self.get_llm_configuration(model_id)
+
         if not model_config:
             raise ValueError(f"Model with ID {model_id} not found or not active")
 
         try:
+            # 按 token 预算组装历史上下文（不包含本条消息）
+            context = await ContextBuilder(self.db).build(conversation_id, model_config, message_data["content"])
+            # 历史没有变化时接着上一轮的 Ollama 上下文生成
+            kv = await self._load_kv_context(conversation_id, model_config, context)
+
             # 生成唯一的消息ID
             message_id = str(uuid.uuid4())
-            
-            # 准备模型参数
-            model_params = {
-                "temperature": model_config.temperature,
-                "top_p": model_config.top_p,
-                "max_tokens": model_config.max_tokens,
-                "do_sample": model_config.do_sample
-            }
 
             # 保存用户消息
             message = Message(
@@ -117,37 +424,240 @@ class AiService:
                 conversation_id=conversation_id,
                 llm_id=model_id,
                 question=message_data["content"],
+                question_tokens=estimate_tokens(message_data["content"]),
+                status=MESSAGE_STATUS_COMPLETE,
                 create_by=username,
                 update_by=username
             )
-            self.db.add(message)
-            self.db.flush()
-
-            # 生成AI回复
-            if model_config.is_local_llm:
-                # 本地模型使用Ollama
-                llm = OllamaLLM(
-                    model=model_config.llm_en_name,
-                    **model_params
-                )
-                response = await llm.ainvoke(message_data["content"])
+            write_behind = self._write_behind_enabled()
+            if write_behind:
+                # 写后模式：问题和回答生成后一起入队，结束读事务以便生成期间不占用连接。
+                # create_time 取数据库时间，与直接插入的消息按同一时钟排序（MySQL 为会话时区）
+                message.create_time = (await self._server_now()).replace(microsecond=0)
             else:
-                # 在线模型处理（需要实现）
-                raise NotImplementedError("Online LLM support not implemented yet")
+                # 先提交问题，生成期间不占用连接，SQLite 上也不持有写锁；回答在生成后另起短事务写入
+                self.db.add(message)
+            await self.db.commit()
+
+            # 生成AI回复；客户端断开时保存已生成的部分
+            parts: List[str] = []
+            try:
+                response = await self._generate(model_config, context.prompt, user_key=user_id, kv=kv, partial=parts)
+            except asyncio.CancelledError:
+                await self._save_truncated(conversation, message, parts, username, write_behind, inserted=not write_behind)
+                raise
 
             # 更新消息的回答
             message.answer = response
-            
+            message.answer_tokens = estimate_tokens(response)
+
             # 更新对话和消息的时间
             current_time = datetime.utcnow()
-            conversation.update_time = current_time
             message.update_time = current_time
-            
-            self.db.commit()
-            self.db.refresh(message)
+
+            if write_behind:
+                await message_writer.insert_message(message)
+                await message_writer.touch_conversation(conversation_id, current_time, username)
+                await self._save_kv_context(conversation_id, model_config, kv, message_id)
+                return message
+
+            conversation.update_time = current_time
+            await self.db.commit()
+            await self.db.refresh(message)
+            await self._save_kv_context(conversation_id, model_config, kv, message_id)
             return message
-            
+
         except Exception as e:
             logger.error(f"Error processing message: {str(e)}")
-            self.db.rollback()
-            raise 
\ No newline at end of file
+            await self.db.rollback()
+            raise
+
+    async def _save_truncated(
+        self,
+        conversation: Conversation,
+        message: Message,
+        parts: List[str],
+        username: str,
+        write_behind: bool,
+        inserted: bool
+    ) -> None:
+        """客户端断开后保存已生成的部分回答，状态标记为截断
+
+        所在的请求已被取消，保存放在屏蔽取消的作用域中完成。inserted 表示问题已经写入数据库，
+        否则（写后模式下的非流式对话）连同部分回答一起插入。
+        """
+        current_time = datetime.utcnow()
+        message.answer = "".join(parts) or None
+        message.answer_tokens = estimate_tokens(message.answer) if message.answer else None
+        message.status = MESSAGE_STATUS_TRUNCATED
+        message.update_time = current_time
+        with anyio.CancelScope(shield=True):
+            try:
+                if write_behind and inserted:
+                    await message_writer.update_message(
+                        message.message_id,
+                        answer=message.answer,
+                        answer_tokens=message.answer_tokens,
+                        status=message.status,
+                        update_time=current_time
+                    )
+                elif write_behind:
+                    await message_writer.insert_message(message)
+                if write_behind:
+                    await message_writer.touch_conversation(conversation.conversation_id, current_time, username)
+                else:
+                    conversation.update_time = current_time
+                    await self.db.commit()
+            except Exception as e:
+                logger.error(f"Failed to save truncated answer: {str(e)}")
+        logger.info(f"Client disconnected, saved {len(parts)} tokens of message {message.message_id} as truncated")
+
+    async def stream_message(
+        self,
+        message_data: Dict[str, Any],
+        username: str,
+        user_id: str,
+        checkpoint_interval: Optional[float] = None,
+        message_id: Optional[str] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """处理新消息并以事件流形式返回AI响应
+
+        依次产生 start、token（每个 token 一条）和 done 事件；生成失败时产生 error 事件。
+        问题在开始时提交，回答只在结束时写入一次，checkpoint_interval 大于 0 时
+        按该间隔（秒）额外保存已生成的部分回答。user_id 的含义同 process_message。
+        传入 message_id 时（重新执行的任务）复用该消息并重新生成回答，不再插入新的问题。
+        """
+        if checkpoint_interval is None:
+            checkpoint_interval = settings.STREAM_CHECKPOINT_INTERVAL
+
+        conversation_id = message_data["conversation_id"]
+
+        # 检查对话和模型，失败时在第一个事件之前抛出 ValueError
+        conversation = await self._get_conversation(conversation_id, user_id)
+        model_id = conversation.llm_id
+        model_config = await self.get_llm_configuration(model_id)
+
+        if not model_config:
+            raise ValueError(f"Model with ID {model_id} not found or not active")
+
+        # 整个流式生成期间占用模型槽位；超出限额或排队已满时在第一个事件之前抛出 AdmissionRejected
+        async with rate_limiter.quota(user_id, model_id) as usage, llm_scheduler.slot(model_id, user_id):
+            events = self._stream_answer(conversation, model_config, message_data, username, checkpoint_interval, message_id)
+            try:
+                async for event in events:
+                    if event["event"] == "token":
+                        usage.tokens += 1
+                    yield event
+            finally:
+                # 调用方提前关闭时立即关闭内层生成器，使其在当前请求内保存部分回答
+                await events.aclose()
+
+    async def _stream_answer(
+        self,
+        conversation: Conversation,
+        model_config: AiLLMConfiguration,
+        message_data: Dict[str, Any],
+        username: str,
+        checkpoint_interval: float,
+        message_id: Optional[str] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        conversation_id = conversation.conversation_id
+        model_id = model_config.llm_id
+
+        message = None
+        if message_id:
+            result = await self.db.execute(
+                select(Message).where(Message.message_id == message_id, Message.conversation_id == conversation_id)
+            )
+            message = result.scalars().first()
+        if message is not None:
+            # 清除上次执行保存的部分回答，使其不出现在历史上下文中
+            message.answer = None
+            message.answer_tokens = None
+            message.status = MESSAGE_STATUS_COMPLETE
+            message.update_by = username
+            await self.db.commit()
+
+        # 按 token 预算组装历史上下文（不包含本条消息）
+        context = await ContextBuilder(self.db).build(conversation_id, model_config, message_data["content"])
+        kv = await self._load_kv_context(conversation_id, model_config, context)
+
+        if message is None:
+            # 先提交用户消息，生成期间不占用数据库连接
+            message = Message(
+                message_id=message_id or str(uuid.uuid4()),
+                conversation_id=conversation_id,
+                llm_id=model_id,
+                question=message_data["content"],
+                question_tokens=estimate_tokens(message_data["content"]),
+                status=MESSAGE_STATUS_COMPLETE,
+                create_by=username,
+                update_by=username
+            )
+            self.db.add(message)
+            await self.db.commit()
+
+        yield {"event": "start", "data": {"message_id": message.message_id, "conversation_id": conversation_id}}
+
+        parts: List[str] = []
+        started = time.perf_counter()
+        first_token_at: Optional[float] = None
+        last_checkpoint = started
+
+        try:
+            async for token in self._astream(model_config, context.prompt, kv):
+                if not token:
+                    continue
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                parts.append(token)
+                yield {"event": "token", "data": {"content": token}}
+
+                if checkpoint_interval and time.perf_counter() - last_checkpoint >= checkpoint_interval:
+                    message.answer = "".join(parts)
+                    await self.db.commit()
+                    last_checkpoint = time.perf_counter()
+        except (GeneratorExit, asyncio.CancelledError):
+            # 客户端断开，流被取消
+            await self._save_truncated(
+                conversation, message, parts, username, self._write_behind_enabled(), inserted=True
+            )
+            raise
+        except Exception as e:
+            logger.error(f"Error streaming message: {str(e)}")
+            await self.db.rollback()
+            yield {"event": "error", "data": {"message_id": message.message_id, "detail": str(e)}}
+            return
+
+        # 保存最终回答并更新对话时间
+        current_time = datetime.utcnow()
+        message.answer = "".join(parts)
+        message.answer_tokens = estimate_tokens(message.answer)
+        if self._write_behind_enabled():
+            await message_writer.update_message(
+                message.message_id,
+                answer=message.answer,
+                answer_tokens=message.answer_tokens,
+                update_time=current_time
+            )
+            await message_writer.touch_conversation(conversation_id, current_time, username)
+        else:
+            message.update_time = current_time
+            conversation.update_time = current_time
+            await self.db.commit()
+        await self._save_kv_context(conversation_id, model_config, kv, message.message_id)
+
+        finished = time.perf_counter()
+        yield {
+            "event": "done",
+            "data": {
+                "message_id": message.message_id,
+                "answer": message.answer,
+                "total_tokens": len(parts),
+                "prompt_tokens": context.prompt_tokens,
+                "context_turns": context.turns,
+                "context_reused": bool(kv and kv.reused),
+                "time_to_first_token_ms": round((first_token_at - started) * 1000, 2) if first_token_at else None,
+                "total_time_ms": round((finished - started) * 1000, 2),
+            }
+        }
@@ -0,0 +1,154 @@
+from core.config import settings
+from core.redis import get_redis
+from utils.cache import TTLCache
+from typing import Any, Dict, NamedTuple, Optional
+import asyncio
+import hashlib
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class VerifiedToken(NamedTuple):
+    user_id: int
+    exp: float
+    version: int
+
+
+def token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class AuthCache:
+    """已验证令牌和用户记录的进程内缓存
+
+    令牌按摘要缓存到其 exp 为止，用户记录短时间缓存，认证请求通常无需解码 JWT
+    或查询数据库。吊销状态保存在 Redis：注销时把令牌摘要写入吊销表，修改密码等
+    场景递增用户的令牌版本；变更通过 Redis 发布，各 worker 收到后清除本地缓存。
+    """
+
+    # Redis 不可用时令牌只缓存这么久（秒），恢复后尽快重新检查吊销状态
+    degraded_ttl = 30
+
+    def __init__(self, maxsize: int, user_ttl: float, channel: str):
+        self.channel = channel
+        self._tokens = TTLCache(maxsize=maxsize, ttl=settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+        self._users = TTLCache(maxsize=maxsize, ttl=user_ttl)
+        # 用户ID -> 最低有效令牌版本，由广播更新
+        self._min_versions: Dict[int, int] = {}
+
+    @staticmethod
+    def revoked_key(digest: str) -> str:
+        return f"auth:revoked:{digest}"
+
+    @staticmethod
+    def version_key(user_id: int) -> str:
+        return f"auth:user:{user_id}:ver"
+
+    def get_token(self, digest: str) -> Optional[VerifiedToken]:
+        entry = self._tokens.get(digest)
+        if entry is None:
+            return None
+        if entry.version < self._min_versions.get(entry.user_id, 0):
+            self._tokens.pop(digest)
+            return None
+        return entry
+
+    async def check_and_store_token(self, digest: str, user_id: int, exp: float, version: int) -> bool:
+        """检查令牌是否已被吊销，有效时写入缓存"""
+        try:
+            pipe = get_redis().pipeline(transaction=False)
+            pipe.exists(self.revoked_key(digest))
+            pipe.get(self.version_key(user_id))
+            revoked, current_version = await pipe.execute()
+        except Exception as e:
+            # Redis 不可用时仅依赖 JWT 本身的有效期
+            logger.warning(f"Token revocation check skipped: {str(e)}")
+            self._tokens.set(digest, VerifiedToken(user_id, exp, version), ttl=min(max(exp - time.time(), 0), self.degraded_ttl))
+            return True
+
+        current_version = int(current_version or 0)
+        if revoked or version < current_version:
+            return False
+        self._min_versions[user_id] = max(self._min_versions.get(user_id, 0), current_version)
+        self._tokens.set(digest, VerifiedToken(user_id, exp, version), ttl=max(exp - time.time(), 0))
+        return True
+
+    def get_user(self, user_id: int) -> Any:
+        return self._users.get(user_id)
+
+    def store_user(self, user: Any) -> None:
+        self._users.set(user.id, user)
+
+    async def get_token_version(self, user_id: int) -> int:
+        """签发令牌时使用的当前版本号"""
+        try:
+            return int(await get_redis().get(self.version_key(user_id)) or 0)
+        except Exception as e:
+            logger.warning(f"Failed to read token version: {str(e)}")
+            return 0
+
+    async def revoke_token(self, digest: str, exp: float) -> None:
+        """吊销单个令牌（注销）"""
+        self._tokens.pop(digest)
+        ttl = max(int(exp - time.time()), 1)
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.set(self.revoked_key(digest), 1, ex=ttl)
+        pipe.publish(self.channel, f"token:{digest}")
+        await pipe.execute()
+
+    async def revoke_user_tokens(self, user_id: int) -> int:
+        """使用户此前签发的全部令牌失效（全部注销、修改密码）"""
+        version = await get_redis().incr(self.version_key(user_id))
+        self._apply_user_version(user_id, version)
+        await get_redis().publish(self.channel, f"user:{user_id}:{version}")
+        return version
+
+    def _apply_user_version(self, user_id: int, version: int) -> None:
+        self._min_versions[user_id] = max(self._min_versions.get(user_id, 0), version)
+        self._users.pop(user_id)
+
+    def clear(self) -> None:
+        self._tokens.clear()
+        self._users.clear()
+
+    def _handle_message(self, data: str) -> None:
+        kind, _, rest = data.partition(":")
+        if kind == "token":
+            self._tokens.pop(rest)
+        elif kind == "user":
+            user_id, _, version = rest.partition(":")
+            self._apply_user_version(int(user_id), int(version))
+
+    async def listen(self) -> None:
+        """订阅吊销广播，在应用生命周期内作为后台任务运行"""
+        retry_delay = 1
+        while True:
+            pubsub = get_redis().pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                retry_delay = 1
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self._handle_message(message["data"].decode("utf-8"))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Auth cache listener error, retrying in {retry_delay}s: {str(e)}")
+                # 断线期间可能错过吊销广播，清空本地缓存
+                self.clear()
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, 30)
+            finally:
+                await pubsub.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"tokens": self._tokens.stats(), "users": self._users.stats()}
+
+
+auth_cache = AuthCache(
+    maxsize=settings.AUTH_CACHE_MAXSIZE,
+    user_ttl=settings.AUTH_USER_CACHE_TTL,
+    channel=settings.AUTH_CACHE_CHANNEL
+)
@@ -0,0 +1,225 @@
+from collections import deque
+from models.ai_models import AiLLMConfiguration, AiShortcutConfiguration
+from core.config import settings
+from core.redis import get_redis
+from services.ai_service import AiService
+from services.llm_scheduler import AdmissionRejected, PRIORITY_BATCH
+from services.rate_limiter import RateLimited
+from typing import Any, AsyncIterator, Deque, Dict, List, Tuple
+import asyncio
+import json
+import logging
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# 只有锁仍属于自己时才续期，返回 1 表示续期成功
+_REFRESH_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class BatchInProgress(Exception):
+    """同一批次已有请求在执行"""
+
+
+def apply_shortcut(shortcut: AiShortcutConfiguration, user_input: str) -> str:
+    """把输入填入快捷助手的提示词；提示词中没有 {input} 占位符时追加在末尾"""
+    if "{input}" in shortcut.prompt:
+        return shortcut.prompt.replace("{input}", user_input)
+    return f"{shortcut.prompt}\n\n{user_input}"
+
+
+class BatchRunner:
+    """批量提示词执行
+
+    批次的提示词和已完成的结果保存在 Redis，中断后可按批次ID继续执行未完成的条目。
+    每个模型在批次内最多同时执行 concurrency 个请求，并以批量优先级经过模型准入控制，
+    不会挤占交互式对话。结果按完成顺序返回。
+    """
+
+    def __init__(self, service: AiService, user_id: str, concurrency: int):
+        self.service = service
+        self.user_id = user_id
+        self.concurrency = max(1, min(concurrency, settings.BATCH_MAX_CONCURRENCY))
+        self.owner = uuid.uuid4().hex
+
+    @staticmethod
+    def _meta_key(batch_id: str) -> str:
+        return f"batch:{batch_id}"
+
+    @staticmethod
+    def _results_key(batch_id: str) -> str:
+        return f"batch:{batch_id}:results"
+
+    @staticmethod
+    def _lock_key(batch_id: str) -> str:
+        return f"batch:{batch_id}:lock"
+
+    async def create(self, items: List[Dict[str, Any]]) -> str:
+        """保存批次内容，返回批次ID"""
+        batch_id = uuid.uuid4().hex
+        meta = {"user_id": self.user_id, "created": time.time(), "items": items}
+        await get_redis().set(
+            self._meta_key(batch_id), json.dumps(meta, ensure_ascii=False), ex=settings.BATCH_RESULT_TTL
+        )
+        return batch_id
+
+    async def load(self, batch_id: str) -> Tuple[List[Dict[str, Any]], Dict[int, Dict[str, Any]]]:
+        """读取批次内容和已完成的结果，批次不存在或不属于当前用户时抛出 ValueError"""
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.get(self._meta_key(batch_id))
+        pipe.hgetall(self._results_key(batch_id))
+        raw_meta, raw_results = await pipe.execute()
+        if raw_meta is None:
+            raise ValueError(f"Batch {batch_id} not found")
+        meta = json.loads(raw_meta)
+        if meta["user_id"] != self.user_id:
+            raise ValueError(f"Batch {batch_id} not found")
+        completed = {int(index): json.loads(value) for index, value in raw_results.items()}
+        return meta["items"], completed
+
+    async def resolve_models(self, items: List[Dict[str, Any]]) -> Dict[int, AiLLMConfiguration]:
+        """在开始执行前获取全部模型配置，模型不存在时抛出 ValueError"""
+        configs = {}
+        for model_id in {item["model_id"] for item in items}:
+            config = await self.service.get_llm_configuration(model_id)
+            if not config:
+                raise ValueError(f"Model with ID {model_id} not found or not active")
+            configs[model_id] = config
+        return configs
+
+    async def acquire(self, batch_id: str) -> None:
+        acquired = await get_redis().set(
+            self._lock_key(batch_id), self.owner, nx=True, ex=settings.BATCH_LOCK_TTL
+        )
+        if not acquired:
+            raise BatchInProgress(f"Batch {batch_id} is already running")
+
+    async def _heartbeat(self, batch_id: str) -> None:
+        """执行期间每 BATCH_LOCK_TTL/3 秒续期执行锁，单个条目耗时超过锁的有效期时锁也不会过期"""
+        interval = settings.BATCH_LOCK_TTL / 3
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                redis = get_redis()
+                refreshed = await redis.register_script(_REFRESH_LOCK_SCRIPT)(
+                    keys=[self._lock_key(batch_id)], args=[self.owner, int(settings.BATCH_LOCK_TTL * 1000)]
+                )
+            except Exception as e:
+                logger.warning(f"Failed to refresh batch lock {batch_id}: {str(e)}")
+                continue
+            if not refreshed:
+                logger.warning(f"Batch lock {batch_id} was lost, another request may run the same items")
+                return
+
+    async def release(self, batch_id: str) -> None:
+        try:
+            redis = get_redis()
+            owner = await redis.get(self._lock_key(batch_id))
+            if owner is not None and owner.decode("utf-8") == self.owner:
+                await redis.delete(self._lock_key(batch_id))
+        except Exception as e:
+            logger.warning(f"Failed to release batch lock {batch_id}: {str(e)}")
+
+    async def _generate(self, model_config: AiLLMConfiguration, prompt: str) -> str:
+        """执行单个条目；模型排队已满时按 Retry-After 等待后重试，超出用户限额时直接失败"""
+        for attempt in range(settings.BATCH_MAX_RETRIES + 1):
+            try:
+                return await self.service.generate(model_config, prompt, self.user_id, PRIORITY_BATCH)
+            except RateLimited:
+                raise
+            except AdmissionRejected as e:
+                if attempt == settings.BATCH_MAX_RETRIES:
+                    raise
+                await asyncio.sleep(e.retry_after)
+
+    async def _run_item(self, batch_id: str, index: int, item: Dict[str, Any], model_config: AiLLMConfiguration) -> Dict[str, Any]:
+        started = time.perf_counter()
+        try:
+            content = await self._generate(model_config, item["prompt"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # 失败的条目不保存，继续执行该批次时会重试
+            logger.warning(f"Batch {batch_id} item {index} failed: {str(e)}")
+            return {"type": "result", "index": index, "model_id": item["model_id"], "status": "error", "detail": str(e)}
+
+        result = {
+            "type": "result",
+            "index": index,
+            "model_id": item["model_id"],
+            "status": "ok",
+            "content": content,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+        }
+        try:
+            pipe = get_redis().pipeline(transaction=False)
+            pipe.hset(self._results_key(batch_id), str(index), json.dumps(result, ensure_ascii=False))
+            pipe.expire(self._results_key(batch_id), settings.BATCH_RESULT_TTL)
+            await pipe.execute()
+        except Exception as e:
+            # 保存失败只影响继续执行，结果照常返回
+            logger.warning(f"Failed to persist batch {batch_id} item {index}: {str(e)}")
+        return result
+
+    async def run(
+        self,
+        batch_id: str,
+        items: List[Dict[str, Any]],
+        model_configs: Dict[int, AiLLMConfiguration],
+        completed: Dict[int, Dict[str, Any]],
+        replay: bool = True
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """执行未完成的条目并按完成顺序产生结果，调用前需先 acquire"""
+        pending: Dict[int, Deque[int]] = {}
+        for index, item in enumerate(items):
+            if index not in completed:
+                pending.setdefault(item["model_id"], deque()).append(index)
+        remaining = sum(len(indexes) for indexes in pending.values())
+        results: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+        workers: List[asyncio.Task] = []
+        heartbeat = asyncio.create_task(self._heartbeat(batch_id))
+
+        async def worker(model_id: int, indexes: Deque[int]) -> None:
+            while indexes:
+                index = indexes.popleft()
+                await results.put(await self._run_item(batch_id, index, items[index], model_configs[model_id]))
+
+        succeeded, failed = len(completed), 0
+        try:
+            yield {"type": "batch", "batch_id": batch_id, "total": len(items), "completed": len(completed), "pending": remaining}
+            if replay:
+                for index in sorted(completed):
+                    yield dict(completed[index], replayed=True)
+
+            # 每个模型启动 concurrency 个工作协程，共享该模型的待执行队列
+            workers = [
+                asyncio.create_task(worker(model_id, indexes))
+                for model_id, indexes in pending.items()
+                for _ in range(min(self.concurrency, len(indexes)))
+            ]
+            for _ in range(remaining):
+                result = await results.get()
+                if result["status"] == "ok":
+                    succeeded += 1
+                else:
+                    failed += 1
+                yield result
+        finally:
+            # 客户端断开时停止剩余条目，已完成的结果已经保存
+            for task in workers + [heartbeat]:
+                task.cancel()
+            await asyncio.gather(*workers, heartbeat, return_exceptions=True)
+            await self.release(batch_id)
+
+        yield {"type": "done", "batch_id": batch_id, "total": len(items), "succeeded": succeeded, "failed": failed}
+
+    async def status(self, batch_id: str) -> Dict[str, Any]:
+        items, completed = await self.load(batch_id)
+        running = await get_redis().exists(self._lock_key(batch_id))
+        return {"batch_id": batch_id, "total": len(items), "completed": len(completed), "running": bool(running)}
@@ -1,37 +1,46 @@
-from langchain.chains import ConversationChain
-from langchain.memory import ConversationBufferMemory
-from langchain_ollama import OllamaLLM
-from typing import Dict, List, Optional
-import redis
+from typing import TYPE_CHECKING, Dict, List, Optional
 from core.config import settings
+from services.llm_registry import llm_registry
+from services.chat_memory import ConversationMemoryStore, history_limit
+
+if TYPE_CHECKING:
+    # langchain 导入较慢，运行时在第一次使用时才导入
+    from langchain.chains import ConversationChain
+    from langchain_core.messages import BaseMessage
+    from langchain_ollama import OllamaLLM
+
+def to_langchain_messages(history: List[Dict[str, str]]) -> List["BaseMessage"]:
+    from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+    message_classes = {"human": HumanMessage, "ai": AIMessage, "system": SystemMessage}
+    return [message_classes.get(m["role"], HumanMessage)(content=m["content"]) for m in history]
+
+def from_langchain_messages(messages: List["BaseMessage"]) -> List[Dict[str, str]]:
+    return [{"role": m.type, "content": m.content} for m in messages]
 
 class LLMService:
+    model_names = ("deepseek-r1", "qwen")
+
     def __init__(self):
-        self.models = {
-            "deepseek-r1": OllamaLLM(model="deepseek-r1"),
-            "qwen": OllamaLLM(model="qwen")
-        }
-        self.redis_client = redis.Redis(
-            host=settings.REDIS_HOST,
-            port=settings.REDIS_PORT,
-            db=settings.REDIS_DB
-        )
+        # 历史记录通过共享的异步连接池读写，不阻塞事件循环
+        self.memory_store = ConversationMemoryStore(ttl=settings.CHAT_HISTORY_TTL)
         
-    def get_model(self, model_name: str) -> Optional[OllamaLLM]:
-        return self.models.get(model_name)
+    def get_model(self, model_name: str) -> Optional["OllamaLLM"]:
+        if model_name not in self.model_names:
+            return None
+        return llm_registry.get_named_client(model_name)
     
-    def get_conversation_chain(self, model_name: str, conversation_id: str) -> ConversationChain:
+    async def get_conversation_chain(self, model_name: str, conversation_id: str) -> "ConversationChain":
+        from langchain.chains import ConversationChain
+        from langchain.memory import ConversationBufferMemory
+
         model = self.get_model(model_name)
         if not model:
             raise ValueError(f"Model {model_name} not found")
         
         # Try to get conversation history from Redis
-        memory_key = f"conv:{conversation_id}"
         memory = ConversationBufferMemory()
-        
-        cached_history = self.redis_client.get(memory_key)
-        if cached_history:
-            memory.chat_memory.messages = eval(cached_history)
+        memory.chat_memory.messages = to_langchain_messages(await self.memory_store.load(conversation_id))
         
         return ConversationChain(
             llm=model,
@@ -39,23 +48,32 @@ class LLMService:
             verbose=True
         )
     
-    def save_conversation_history(self, conversation_id: str, history: List[Dict]):
-        memory_key = f"conv:{conversation_id}"
-        self.redis_client.set(memory_key, str(history), ex=3600)  # Expire after 1 hour
+    async def save_conversation_history(
+        self,
+        conversation_id: str,
+        new_messages: List[Dict],
+        max_chat_limit: Optional[int] = None
+    ):
+        """追加本轮新增的消息，只保留最近 max_chat_limit 轮"""
+        await self.memory_store.append(conversation_id, new_messages, history_limit(max_chat_limit))
         
     async def generate_response(
         self,
         model_name: str,
         conversation_id: str,
-        user_message: str
+        user_message: str,
+        max_chat_limit: Optional[int] = None
     ) -> str:
-        chain = self.get_conversation_chain(model_name, conversation_id)
+        # 读取历史和刷新过期时间共一次往返，写入新消息、截断和刷新过期时间共一次往返
+        chain = await self.get_conversation_chain(model_name, conversation_id)
+        history_length = len(chain.memory.chat_memory.messages)
         response = await chain.arun(user_message)
         
         # Save updated conversation history
-        self.save_conversation_history(
+        await self.save_conversation_history(
             conversation_id,
-            chain.memory.chat_memory.messages
+            from_langchain_messages(chain.memory.chat_memory.messages[history_length:]),
+            max_chat_limit
         )
         
-        return response 
\ No newline at end of file
+        return response
\ No newline at end of file
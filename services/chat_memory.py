@@ -0,0 +1,121 @@
+from typing import Any, Dict, List, Optional
+from core.config import settings
+from core.redis import get_redis
+import ast
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 旧格式（str(list)）中可能出现的 LangChain 消息类型
+_LEGACY_MESSAGE_TYPES = {
+    "HumanMessage": "human",
+    "AIMessage": "ai",
+    "SystemMessage": "system",
+}
+
+
+def encode_message(role: str, content: str) -> bytes:
+    """把一条消息编码为紧凑 JSON"""
+    return json.dumps({"r": role, "c": content}, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def decode_message(raw: bytes) -> Dict[str, str]:
+    data = json.loads(raw)
+    return {"role": data["r"], "content": data["c"]}
+
+
+def parse_legacy_history(blob: Any) -> List[Dict[str, str]]:
+    """解析旧版 str(history) 格式的历史记录
+
+    只解析字面量和已知的消息类型构造调用，不执行任意代码。
+    """
+    if isinstance(blob, bytes):
+        blob = blob.decode("utf-8")
+    tree = ast.parse(blob, mode="eval").body
+    if not isinstance(tree, ast.List):
+        raise ValueError("Legacy history is not a list")
+
+    messages = []
+    for node in tree.elts:
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in _LEGACY_MESSAGE_TYPES:
+            kwargs = {kw.arg: ast.literal_eval(kw.value) for kw in node.keywords if kw.arg}
+            content = kwargs.get("content", ast.literal_eval(node.args[0]) if node.args else "")
+            messages.append({"role": _LEGACY_MESSAGE_TYPES[node.func.id], "content": content})
+        else:
+            item = ast.literal_eval(node)
+            role = item.get("role") or item.get("type")
+            messages.append({"role": role, "content": item.get("content", "")})
+    return messages
+
+
+class ConversationMemoryStore:
+    """基于 Redis List 的对话历史存储
+
+    每条消息单独编码后追加到列表末尾（RPUSH），同一次往返内用 LTRIM 截断到
+    最近的若干条并刷新过期时间；读取历史和刷新过期时间同样在一次往返内完成。
+    兼容读取旧版整体写入的字符串格式，首次读取时迁移为列表格式。
+    """
+
+    def __init__(self, ttl: int = 3600):
+        self.ttl = ttl
+
+    @staticmethod
+    def key(conversation_id: str) -> str:
+        return f"conv:{conversation_id}:msgs"
+
+    @staticmethod
+    def legacy_key(conversation_id: str) -> str:
+        return f"conv:{conversation_id}"
+
+    async def load(self, conversation_id: str) -> List[Dict[str, str]]:
+        """读取对话历史并刷新过期时间"""
+        key = self.key(conversation_id)
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.lrange(key, 0, -1)
+        pipe.expire(key, self.ttl)
+        pipe.get(self.legacy_key(conversation_id))
+        raw_messages, _, legacy = await pipe.execute()
+
+        if raw_messages:
+            return [decode_message(raw) for raw in raw_messages]
+        if legacy:
+            return await self._migrate_legacy(conversation_id, legacy)
+        return []
+
+    async def append(self, conversation_id: str, messages: List[Dict[str, str]], max_messages: Optional[int] = None) -> None:
+        """追加消息，截断到最近 max_messages 条并刷新过期时间"""
+        if not messages:
+            return
+        key = self.key(conversation_id)
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.rpush(key, *[encode_message(m["role"], m["content"]) for m in messages])
+        if max_messages:
+            pipe.ltrim(key, -max_messages, -1)
+        pipe.expire(key, self.ttl)
+        await pipe.execute()
+
+    async def clear(self, conversation_id: str) -> None:
+        await get_redis().delete(self.key(conversation_id), self.legacy_key(conversation_id))
+
+    async def _migrate_legacy(self, conversation_id: str, legacy: Any) -> List[Dict[str, str]]:
+        """把旧格式历史转换为列表格式并删除旧键"""
+        try:
+            messages = parse_legacy_history(legacy)
+        except (ValueError, SyntaxError, AttributeError) as e:
+            logger.warning(f"Discarding unreadable legacy history for {conversation_id}: {str(e)}")
+            await get_redis().delete(self.legacy_key(conversation_id))
+            return []
+
+        pipe = get_redis().pipeline(transaction=True)
+        if messages:
+            pipe.rpush(self.key(conversation_id), *[encode_message(m["role"], m["content"]) for m in messages])
+            pipe.expire(self.key(conversation_id), self.ttl)
+        pipe.delete(self.legacy_key(conversation_id))
+        await pipe.execute()
+        return messages
+
+
+def history_limit(max_chat_limit: Optional[int]) -> int:
+    """多轮对话次数换算为保留的消息条数（每轮一问一答）"""
+    return 2 * (max_chat_limit or settings.CHAT_HISTORY_MAX_TURNS)
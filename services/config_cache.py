@@ -0,0 +1,126 @@
+from core.config import settings
+from core.redis import get_redis
+from utils.cache import TTLCache
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class _LoaderCancelled(Exception):
+    """发起加载的请求被取消，等待者需要自行重新加载"""
+
+
+class ConfigCache:
+    """大模型/快捷助手配置的进程内只读缓存
+
+    读取时先查本地缓存，未命中再调用 loader 查询数据库。配置变更后调用
+    invalidate() 清除本地缓存并通过 Redis 发布消息，其他 worker 的 listen()
+    收到后同步清除；Redis 不可用时依靠 TTL 保证最终一致。
+
+    同一个键的并发未命中合并为一次加载（single-flight）。每次失效都会递增代数，
+    加载期间发生过失效时结果不写入缓存，避免变更前读到的旧配置在 TTL 内继续生效。
+    """
+
+    def __init__(self, maxsize: int, ttl: float, channel: str):
+        self.channel = channel
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._inflight: Dict[Tuple[str, Hashable], asyncio.Future] = {}
+        self._generation = 0
+        self.coalesced = 0
+
+    async def get_or_load(self, namespace: str, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """读取缓存，未命中时加载并写入缓存（None 结果同样缓存）"""
+        cache_key = (namespace, key)
+        value = self._cache.get(cache_key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        inflight = self._inflight.get(cache_key)
+        if inflight is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(inflight)
+            except _LoaderCancelled:
+                return await self.get_or_load(namespace, key, loader)
+
+        future = asyncio.get_running_loop().create_future()
+        # 没有等待者时也标记异常已读取，避免 "exception was never retrieved" 警告
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._inflight[cache_key] = future
+        generation = self._generation
+        try:
+            value = await loader()
+            if generation == self._generation:
+                self._cache.set(cache_key, value)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.set_exception(_LoaderCancelled())
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            # 失效后可能已有新的加载占用了该键
+            if self._inflight.get(cache_key) is future:
+                del self._inflight[cache_key]
+
+    def invalidate_local(self, namespace: Optional[str] = None) -> None:
+        """清除本进程的缓存，namespace 为空时清除全部"""
+        self._generation += 1
+        if namespace is None:
+            self._cache.clear()
+            self._inflight.clear()
+        else:
+            self._cache.discard_where(lambda k: k[0] == namespace)
+            for cache_key in [k for k in self._inflight if k[0] == namespace]:
+                del self._inflight[cache_key]
+
+    async def invalidate(self, namespace: Optional[str] = None) -> None:
+        """清除缓存并广播给所有 worker"""
+        self.invalidate_local(namespace)
+        try:
+            await get_redis().publish(self.channel, namespace or "*")
+        except Exception as e:
+            logger.warning(f"Failed to broadcast config cache invalidation: {str(e)}")
+
+    async def listen(self) -> None:
+        """订阅失效广播，在应用生命周期内作为后台任务运行"""
+        retry_delay = 1
+        while True:
+            pubsub = get_redis().pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                retry_delay = 1
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    namespace = message["data"].decode("utf-8")
+                    self.invalidate_local(None if namespace == "*" else namespace)
+                    logger.debug(f"Config cache invalidated: {namespace}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Config cache listener error, retrying in {retry_delay}s: {str(e)}")
+                # 断线期间可能错过广播，清空本地缓存
+                self.invalidate_local()
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, 30)
+            finally:
+                await pubsub.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self._cache.stats()
+        stats.update({"coalesced": self.coalesced, "inflight": len(self._inflight)})
+        return stats
+
+
+config_cache = ConfigCache(
+    maxsize=settings.CONFIG_CACHE_MAXSIZE,
+    ttl=settings.CONFIG_CACHE_TTL,
+    channel=settings.CONFIG_CACHE_CHANNEL
+)
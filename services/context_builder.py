@@ -0,0 +1,188 @@
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from models.ai_models import AiLLMConfiguration
+from models.chat import Message
+from core.config import settings
+from core.redis import get_redis
+from services.llm_router import llm_router
+from services.llm_scheduler import llm_scheduler, PRIORITY_BACKGROUND
+from typing import Any, Dict, List, Optional, Set
+import asyncio
+import json
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+_CJK_PATTERN = re.compile("[\u3000-\u9fff\uac00-\ud7af\uff00-\uffef]")
+
+# 提示词模板本身占用的 token 预留
+_TEMPLATE_OVERHEAD = 16
+
+# 防止后台摘要任务被回收
+_summary_tasks: Set[asyncio.Task] = set()
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """粗略估算文本的 token 数：中日韩字符按 1 个计，其他字符约 4 个计 1 个"""
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def format_turn(question: str, answer: str) -> str:
+    return f"User: {question}\nAssistant: {answer}\n"
+
+
+def format_question(question: str) -> str:
+    return f"User: {question}\nAssistant:"
+
+
+class BuiltContext:
+    """组装好的提示词及其统计信息"""
+
+    def __init__(
+        self,
+        prompt: str,
+        prompt_tokens: int,
+        turns: int,
+        dropped: List[Dict[str, Any]],
+        question_prompt: str = "",
+        last_message_id: Optional[str] = None,
+        history_budget: int = 0
+    ):
+        self.prompt = prompt
+        self.prompt_tokens = prompt_tokens
+        self.turns = turns
+        self.dropped = dropped
+        # 只包含本轮问题的提示词，接着已有的 KV 上下文生成时使用
+        self.question_prompt = question_prompt
+        # 对话中最新一轮已回答消息的ID，用于判断 KV 上下文之后历史是否有变化
+        self.last_message_id = last_message_id
+        self.history_budget = history_budget
+
+
+class ContextBuilder:
+    """按 token 预算组装多轮对话上下文
+
+    从最新的消息开始向前加载历史（最多 max_chat_limit 轮），累计每条消息保存的
+    token 数，超出预算即停止。开启摘要时，被挤出窗口的旧对话会在后台折叠进
+    Redis 中缓存的滚动摘要，并放在提示词开头。
+    """
+
+    def __init__(self, db: AsyncSession, context_window: Optional[int] = None):
+        self.db = db
+        self.context_window = context_window or settings.LLM_CONTEXT_WINDOW
+
+    def token_budget(self, model_config: AiLLMConfiguration, question_tokens: int) -> int:
+        """历史消息可用的 token 数：上下文窗口减去生成长度、当前问题和模板开销"""
+        budget = self.context_window - (model_config.max_tokens or 0) - question_tokens - _TEMPLATE_OVERHEAD
+        if settings.CONTEXT_TOKEN_BUDGET:
+            budget = min(budget, settings.CONTEXT_TOKEN_BUDGET)
+        return max(budget, 0)
+
+    async def build(self, conversation_id: str, model_config: AiLLMConfiguration, content: str) -> BuiltContext:
+        question_tokens = estimate_tokens(content)
+        budget = history_budget = self.token_budget(model_config, question_tokens)
+        max_turns = model_config.max_chat_limit or settings.CHAT_HISTORY_MAX_TURNS
+
+        summary = await self._load_summary(conversation_id) if settings.CONTEXT_SUMMARY_ENABLED else None
+        if summary:
+            budget -= estimate_tokens(summary["text"])
+
+        # 多取一轮，使刚滑出窗口的对话也能被折叠进摘要
+        result = await self.db.execute(
+            select(
+                Message.message_id, Message.question, Message.answer, Message.question_tokens,
+                Message.answer_tokens, Message.create_time
+            ).where(
+                Message.conversation_id == conversation_id,
+                Message.answer.isnot(None)
+            ).order_by(Message.create_time.desc(), Message.message_id.desc()).limit(max_turns + 1)
+        )
+        rows = result.all()
+
+        turns: List[str] = []
+        dropped: List[Dict[str, Any]] = []
+        used = 0
+        for index, row in enumerate(rows):
+            cost = (row.question_tokens if row.question_tokens is not None else estimate_tokens(row.question)) \
+                + (row.answer_tokens if row.answer_tokens is not None else estimate_tokens(row.answer))
+            if dropped or index >= max_turns or used + cost > budget:
+                dropped.append({"question": row.question, "answer": row.answer, "create_time": row.create_time})
+                continue
+            turns.append(format_turn(row.question, row.answer))
+            used += cost
+
+        parts = []
+        if summary:
+            parts.append(f"Summary of the earlier conversation:\n{summary['text']}\n")
+        parts.extend(reversed(turns))
+        question_prompt = format_question(content)
+        parts.append(question_prompt)
+        prompt_tokens = used + question_tokens + _TEMPLATE_OVERHEAD + (estimate_tokens(summary["text"]) if summary else 0)
+
+        context = BuiltContext(
+            "".join(parts), prompt_tokens, len(turns), dropped,
+            question_prompt=question_prompt,
+            last_message_id=rows[0].message_id if rows else None,
+            history_budget=history_budget
+        )
+        if dropped and settings.CONTEXT_SUMMARY_ENABLED:
+            self._schedule_summary(conversation_id, model_config, summary, dropped)
+        return context
+
+    @staticmethod
+    def summary_key(conversation_id: str) -> str:
+        return f"conv:{conversation_id}:summary"
+
+    async def _load_summary(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            raw = await get_redis().get(self.summary_key(conversation_id))
+        except Exception as e:
+            logger.warning(f"Failed to load conversation summary: {str(e)}")
+            return None
+        return json.loads(raw) if raw else None
+
+    def _schedule_summary(
+        self,
+        conversation_id: str,
+        model_config: AiLLMConfiguration,
+        summary: Optional[Dict[str, Any]],
+        dropped: List[Dict[str, Any]]
+    ) -> None:
+        covered_until = summary["covered_until"] if summary else ""
+        pending = [t for t in reversed(dropped) if t["create_time"] and t["create_time"].isoformat() > covered_until]
+        if not pending:
+            return
+        task = asyncio.create_task(self._fold_summary(conversation_id, model_config, summary, pending))
+        _summary_tasks.add(task)
+        task.add_done_callback(_summary_tasks.discard)
+
+    async def _fold_summary(
+        self,
+        conversation_id: str,
+        model_config: AiLLMConfiguration,
+        summary: Optional[Dict[str, Any]],
+        pending: List[Dict[str, Any]]
+    ) -> None:
+        """把滑出窗口的对话折叠进滚动摘要"""
+        transcript = "".join(format_turn(t["question"], t["answer"]) for t in pending)
+        prompt = (
+            "Update the running summary of a conversation with the new turns below. "
+            "Keep facts, names and decisions; answer with the summary only.\n\n"
+            f"Current summary:\n{summary['text'] if summary else '(empty)'}\n\n"
+            f"New turns:\n{transcript}\nUpdated summary:"
+        )
+        try:
+            async with llm_scheduler.slot(model_config.llm_id, "context-summary", PRIORITY_BACKGROUND):
+                text = await llm_router.invoke(model_config, prompt)
+            value = {"text": text.strip(), "covered_until": pending[-1]["create_time"].isoformat()}
+            await get_redis().set(
+                self.summary_key(conversation_id),
+                json.dumps(value, ensure_ascii=False),
+                ex=settings.CHAT_HISTORY_TTL
+            )
+        except Exception as e:
+            logger.warning(f"Failed to update conversation summary: {str(e)}")
@@ -0,0 +1,118 @@
+from core.config import settings
+from core.redis import get_redis
+from utils.cache import TTLCache
+from utils.lazy import lazy_import
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence
+import hashlib
+import logging
+
+if TYPE_CHECKING:
+    from langchain_ollama import OllamaEmbeddings
+
+np = lazy_import("numpy")
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingService:
+    """批量计算文本向量，带进程内和 Redis 两级缓存
+
+    缓存键为模型名和文本摘要，重新索引时内容未变化的消息不会再次调用模型。
+    返回的向量已归一化，内积即余弦相似度。
+    """
+
+    def __init__(self, model: str, batch_size: int = 64, cache_ttl: int = 30 * 86400, local_maxsize: int = 10000):
+        self.model = model
+        self.batch_size = batch_size
+        self.cache_ttl = cache_ttl
+        self.prefix = f"emb:{model}:"
+        self._local = TTLCache(maxsize=local_maxsize, ttl=cache_ttl)
+        self._client: Optional["OllamaEmbeddings"] = None
+        self.computed = 0
+        self.redis_hits = 0
+
+    def _get_client(self) -> "OllamaEmbeddings":
+        if self._client is None:
+            from langchain_ollama import OllamaEmbeddings
+
+            self._client = OllamaEmbeddings(model=self.model)
+        return self._client
+
+    async def _get_remote(self, digests: List[str]) -> Dict[str, "np.ndarray"]:
+        try:
+            pipe = get_redis().pipeline(transaction=False)
+            for digest in digests:
+                pipe.get(self.prefix + digest)
+            values = await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Embedding cache read failed: {str(e)}")
+            return {}
+        found = {}
+        for digest, raw in zip(digests, values):
+            if raw is not None:
+                found[digest] = np.frombuffer(raw, dtype=np.float32)
+        self.redis_hits += len(found)
+        return found
+
+    async def _set_remote(self, vectors: Dict[str, "np.ndarray"]) -> None:
+        try:
+            pipe = get_redis().pipeline(transaction=False)
+            for digest, vector in vectors.items():
+                pipe.set(self.prefix + digest, vector.astype(np.float32).tobytes(), ex=self.cache_ttl)
+            await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Embedding cache write failed: {str(e)}")
+
+    async def embed(self, texts: Sequence[str]) -> "np.ndarray":
+        """返回 (len(texts), dim) 的归一化向量矩阵"""
+        digests = [content_hash(text) for text in texts]
+        vectors: Dict[str, "np.ndarray"] = {}
+        for digest in set(digests):
+            cached = self._local.get(digest)
+            if cached is not None:
+                vectors[digest] = cached
+
+        missing = [digest for digest in dict.fromkeys(digests) if digest not in vectors]
+        if missing:
+            remote = await self._get_remote(missing)
+            for digest, vector in remote.items():
+                self._local.set(digest, vector)
+            vectors.update(remote)
+
+        texts_by_digest = dict(zip(digests, texts))
+        to_compute = [digest for digest in dict.fromkeys(digests) if digest not in vectors]
+        for start in range(0, len(to_compute), self.batch_size):
+            batch = to_compute[start:start + self.batch_size]
+            embeddings = await self._get_client().aembed_documents([texts_by_digest[d] for d in batch])
+            computed = {}
+            for digest, embedding in zip(batch, embeddings):
+                vector = np.asarray(embedding, dtype=np.float32)
+                vector /= np.linalg.norm(vector) or 1.0
+                computed[digest] = vector
+                self._local.set(digest, vector)
+            await self._set_remote(computed)
+            vectors.update(computed)
+            self.computed += len(batch)
+
+        if not digests:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack([vectors[digest] for digest in digests])
+
+    async def embed_query(self, text: str) -> "np.ndarray":
+        return (await self.embed([text]))[0]
+
+    def stats(self) -> Dict[str, int]:
+        stats = self._local.stats()
+        stats.update({"computed": self.computed, "redis_hits": self.redis_hits})
+        return stats
+
+
+embedding_service = EmbeddingService(
+    model=settings.EMBEDDING_MODEL,
+    batch_size=settings.EMBEDDING_BATCH_SIZE,
+    cache_ttl=settings.EMBEDDING_CACHE_TTL
+)
@@ -0,0 +1,147 @@
+from sqlalchemy import and_, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from models.chat import Conversation, Message
+from core.config import settings
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+import base64
+import json
+import zlib
+
+EXPORT_FORMATS = ("ndjson", "jsonl.gz")
+
+CONVERSATION_FIELDS = ("conversation_id", "user_id", "llm_id", "title", "create_time", "update_time")
+MESSAGE_FIELDS = (
+    "message_id", "llm_id", "question", "answer", "question_tokens", "answer_tokens", "status",
+    "create_time", "update_time"
+)
+
+
+def encode_export_cursor(conversation_id: str, message_time: Optional[datetime] = None, message_id: Optional[str] = None) -> str:
+    """把最后导出的记录编码为游标；只有对话ID时表示该对话的消息尚未导出"""
+    raw = json.dumps([conversation_id, message_time.isoformat() if message_time else None, message_id])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_export_cursor(cursor: str) -> Tuple[str, Optional[datetime], Optional[str]]:
+    """解析导出游标，格式错误时抛出 ValueError"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        conversation_id, message_time, message_id = json.loads(base64.urlsafe_b64decode(padded))
+        return conversation_id, datetime.fromisoformat(message_time) if message_time else None, message_id
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+def _serialize(value: Any) -> Any:
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+class ExportService:
+    """流式导出对话和消息
+
+    对话与消息在一条按 (conversation_id, 消息 create_time, message_id) 排序的连接查询中读取，
+    通过服务端游标（yield_per）分批拉取，内存占用与数据量无关。
+    每条记录带 cursor 字段，中断后把最后收到的 cursor 作为 after 传入即可继续导出。
+    """
+
+    def __init__(self, db: AsyncSession, batch_size: Optional[int] = None):
+        self.db = db
+        self.batch_size = batch_size or settings.EXPORT_BATCH_SIZE
+
+    def _build_query(
+        self,
+        user_id: Optional[str],
+        since: Optional[datetime],
+        until: Optional[datetime],
+        after: Optional[Tuple[str, Optional[datetime], Optional[str]]]
+    ):
+        columns = [getattr(Conversation, field).label(f"c_{field}") for field in CONVERSATION_FIELDS]
+        columns += [getattr(Message, field).label(f"m_{field}") for field in MESSAGE_FIELDS]
+        stmt = (
+            select(*columns)
+            .outerjoin(Message, Message.conversation_id == Conversation.conversation_id)
+            .order_by(Conversation.conversation_id, Message.create_time, Message.message_id)
+        )
+        if user_id is not None:
+            stmt = stmt.where(Conversation.user_id == user_id)
+        # 指定时间范围时只导出范围内的消息及其所属对话
+        if since is not None:
+            stmt = stmt.where(Message.create_time >= since)
+        if until is not None:
+            stmt = stmt.where(Message.create_time < until)
+        if after is not None:
+            conversation_id, message_time, message_id = after
+            if message_id is None:
+                same_conversation = Message.message_id.isnot(None)
+            else:
+                same_conversation = or_(
+                    Message.create_time > message_time,
+                    and_(Message.create_time == message_time, Message.message_id > message_id)
+                )
+            stmt = stmt.where(or_(
+                Conversation.conversation_id > conversation_id,
+                and_(Conversation.conversation_id == conversation_id, same_conversation)
+            ))
+        return stmt.execution_options(yield_per=self.batch_size)
+
+    async def iter_records(
+        self,
+        user_id: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        after: Optional[str] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """按顺序产生 conversation 和 message 记录，最后是一条 end 记录（只统计本次输出的数量）"""
+        resume = decode_export_cursor(after) if after else None
+        # 从对话中间继续时不再重复输出对话记录
+        current = resume[0] if resume else None
+        conversations = messages = 0
+
+        result = await self.db.stream(self._build_query(user_id, since, until, resume))
+        try:
+            async for row in result:
+                conversation_id = row.c_conversation_id
+                if conversation_id != current:
+                    current = conversation_id
+                    conversations += 1
+                    record = {"type": "conversation"}
+                    record.update({field: _serialize(row._mapping[f"c_{field}"]) for field in CONVERSATION_FIELDS})
+                    record["cursor"] = encode_export_cursor(conversation_id)
+                    yield record
+                if row.m_message_id is None:
+                    continue
+                messages += 1
+                record = {"type": "message", "conversation_id": conversation_id}
+                record.update({field: _serialize(row._mapping[f"m_{field}"]) for field in MESSAGE_FIELDS})
+                record["cursor"] = encode_export_cursor(conversation_id, row.m_create_time, row.m_message_id)
+                yield record
+        finally:
+            await result.close()
+
+        yield {"type": "end", "conversations": conversations, "messages": messages}
+
+    async def iter_lines(self, **filters: Any) -> AsyncIterator[bytes]:
+        async for record in self.iter_records(**filters):
+            yield (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+async def encode_stream(lines: AsyncIterator[bytes], fmt: str, chunk_size: Optional[int] = None) -> AsyncIterator[bytes]:
+    """把逐行输出合并为较大的块；jsonl.gz 格式每块做一次 gzip 同步刷新，
+    已收到的部分可以直接解压，中断后仍能从中读出最后一个 cursor"""
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if fmt == "jsonl.gz" else None
+    buffer = bytearray()
+
+    def flush(final: bool = False) -> bytes:
+        data = bytes(buffer)
+        buffer.clear()
+        if compressor is None:
+            return data
+        return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+    async for line in lines:
+        buffer += line
+        if len(buffer) >= chunk_size:
+            yield flush()
+    yield flush(final=True)
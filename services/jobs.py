@@ -0,0 +1,378 @@
+from models.base import AsyncSessionLocal
+from core.config import settings
+from core.metrics import JOB_QUEUE_WAIT, JOBS_FINISHED, JOBS_RUNNING
+from core.redis import get_redis
+from services.ai_service import AiService
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+JOB_CHAT = "chat"
+JOB_MESSAGE = "message"
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+TERMINAL_STATUSES = (JOB_SUCCEEDED, JOB_FAILED, JOB_CANCELLED)
+
+# 保存在任务哈希中、轮询接口返回的字段
+_JOB_FIELDS = (
+    "kind", "status", "user_id", "created", "started", "finished",
+    "attempts", "tokens", "answer", "result", "error", "cancel_requested"
+)
+_JSON_FIELDS = ("result",)
+_NUMBER_FIELDS = ("created", "started", "finished", "attempts", "tokens")
+
+
+def _decode_job(job_id: str, raw: Dict[bytes, bytes]) -> Dict[str, Any]:
+    job: Dict[str, Any] = {"job_id": job_id}
+    for field in _JOB_FIELDS:
+        value = raw.get(field.encode())
+        if value is None:
+            job[field] = None
+        elif field in _JSON_FIELDS:
+            job[field] = json.loads(value)
+        elif field in _NUMBER_FIELDS:
+            job[field] = float(value)
+        else:
+            job[field] = value.decode("utf-8")
+    job["cancel_requested"] = job["cancel_requested"] == "1"
+    return job
+
+
+class JobQueue:
+    """基于 Redis 的生成任务队列
+
+    任务状态保存在哈希 job:{id}，进度事件追加到 Stream job:{id}:events（SSE 订阅按事件ID续读），
+    待执行的任务ID放入 Stream 消费组：worker 完成任务后才 XACK，执行中定期续期；
+    worker 崩溃后超过 claim_idle 秒未续期的任务由其他 worker 认领并重新执行。
+    """
+
+    def __init__(self, stream_key: str = "jobs:stream", ttl: int = 86400, claim_idle: float = 60):
+        self.stream_key = stream_key
+        self.group = f"{stream_key}:workers"
+        self.ttl = ttl
+        self.claim_idle_ms = int(claim_idle * 1000)
+
+    @staticmethod
+    def key(job_id: str) -> str:
+        return f"job:{job_id}"
+
+    @staticmethod
+    def events_key(job_id: str) -> str:
+        return f"job:{job_id}:events"
+
+    async def ensure_group(self) -> None:
+        try:
+            await get_redis().xgroup_create(self.stream_key, self.group, id="0", mkstream=True)
+        except Exception as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def submit(self, kind: str, payload: Dict[str, Any], user_id: Optional[str] = None) -> Dict[str, Any]:
+        """保存任务并放入队列，返回任务状态"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        fields = {
+            "kind": kind,
+            "status": JOB_QUEUED,
+            "payload": json.dumps(payload, ensure_ascii=False),
+            "created": now,
+            "attempts": 0,
+            "tokens": 0,
+        }
+        if user_id is not None:
+            fields["user_id"] = user_id
+        pipe = get_redis().pipeline(transaction=True)
+        pipe.hset(self.key(job_id), mapping=fields)
+        pipe.expire(self.key(job_id), self.ttl)
+        self.publish(pipe, job_id, JOB_QUEUED, {"job_id": job_id})
+        pipe.xadd(self.stream_key, {"id": job_id})
+        await pipe.execute()
+        return {"job_id": job_id, "kind": kind, "status": JOB_QUEUED, "created": now}
+
+    async def get(self, job_id: str, user_id: Optional[str] = None) -> Dict[str, Any]:
+        """读取任务状态；任务不存在或属于其他用户时抛出 ValueError
+
+        没有所属用户的任务（匿名的 /ai/chat）凭任务ID即可访问。
+        """
+        raw = await get_redis().hgetall(self.key(job_id))
+        if not raw:
+            raise ValueError(f"Job {job_id} not found")
+        job = _decode_job(job_id, raw)
+        if job["user_id"] is not None and job["user_id"] != user_id:
+            raise ValueError(f"Job {job_id} not found")
+        return job
+
+    async def cancel(self, job_id: str, user_id: Optional[str] = None) -> Dict[str, Any]:
+        """请求取消任务；排队中的任务直接取消，执行中的任务由 worker 在下次报告进度时取消"""
+        job = await self.get(job_id, user_id)
+        if job["status"] in TERMINAL_STATUSES:
+            return job
+        await get_redis().hset(self.key(job_id), "cancel_requested", "1")
+        if job["status"] == JOB_QUEUED:
+            await self.finish(job_id, JOB_CANCELLED)
+        return await self.get(job_id, user_id)
+
+    async def events(self, job_id: str, after: str = "0-0", heartbeat: float = 15) -> AsyncIterator[Tuple[Optional[str], str, Dict[str, Any]]]:
+        """依次返回 after 之后的进度事件 (事件ID, 事件, 数据)，任务结束后停止
+
+        超过 heartbeat 秒没有新事件时返回一个 (None, "heartbeat", {}) 供调用方保持连接。
+        """
+        redis = get_redis()
+        key = self.events_key(job_id)
+        while True:
+            response = await redis.xread({key: after}, block=max(1, int(heartbeat * 1000)), count=100)
+            if not response:
+                # 任务已过期时不再等待
+                if not await redis.exists(self.key(job_id)):
+                    return
+                yield None, "heartbeat", {}
+                continue
+            for _, entries in response:
+                for entry_id, fields in entries:
+                    after = entry_id.decode()
+                    event = fields[b"event"].decode()
+                    yield after, event, json.loads(fields[b"data"])
+                    if event in TERMINAL_STATUSES:
+                        return
+
+    def publish(self, pipe: Any, job_id: str, event: str, data: Dict[str, Any]) -> None:
+        key = self.events_key(job_id)
+        pipe.xadd(key, {"event": event, "data": json.dumps(data, ensure_ascii=False, default=str)})
+        pipe.expire(key, self.ttl)
+
+    async def finish(self, job_id: str, status: str, result: Any = None, error: Optional[str] = None) -> None:
+        fields: Dict[str, Any] = {"status": status, "finished": time.time()}
+        if result is not None:
+            fields["result"] = json.dumps(result, ensure_ascii=False, default=str)
+        if error is not None:
+            fields["error"] = error
+        pipe = get_redis().pipeline(transaction=True)
+        pipe.hset(self.key(job_id), mapping=fields)
+        self.publish(pipe, job_id, status, {"job_id": job_id, "result": result, "error": error})
+        await pipe.execute()
+
+    async def stats(self) -> Dict[str, Any]:
+        """队列长度（排队中和执行中）和执行中的任务数"""
+        redis = get_redis()
+        try:
+            pending = await redis.xpending(self.stream_key, self.group)
+        except Exception:
+            pending = {"pending": 0}
+        return {"queued_or_running": await redis.xlen(self.stream_key), "running": pending["pending"]}
+
+
+class _Progress:
+    """执行中任务的进度缓冲：按间隔合并 token 写入 Redis"""
+
+    def __init__(self):
+        self.parts: List[str] = []
+        self.buffer: List[str] = []
+        self.fields: Dict[str, Any] = {}
+
+    def add(self, token: str) -> None:
+        self.parts.append(token)
+        self.buffer.append(token)
+
+
+class JobWorker:
+    """从 JobQueue 消费任务并执行
+
+    每个 worker 最多同时执行 concurrency 个任务；执行期间每隔 progress_interval 秒把新生成的
+    token 作为一个 token 事件发布，同时续期队列条目并检查取消请求。
+    """
+
+    def __init__(self, queue: JobQueue, concurrency: int = 4, progress_interval: float = 0.25):
+        self.queue = queue
+        self.concurrency = max(1, concurrency)
+        self.progress_interval = progress_interval
+        self.consumer = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._running: Set[asyncio.Task] = set()
+        self._stopping = False
+        self.completed = 0
+
+    async def run(self) -> None:
+        await self.queue.ensure_group()
+        while not self._stopping:
+            try:
+                if len(self._running) >= self.concurrency:
+                    await asyncio.wait(self._running, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                for entry_id, job_id in await self._claim(self.concurrency - len(self._running)):
+                    task = asyncio.create_task(self._execute(entry_id, job_id))
+                    self._running.add(task)
+                    task.add_done_callback(self._running.discard)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job worker error: {str(e)}")
+                await asyncio.sleep(1)
+
+    async def stop(self, timeout: float = 30) -> None:
+        """停止领取新任务，等待执行中的任务完成；超时后取消并把任务标记为失败"""
+        self._stopping = True
+        if not self._running:
+            return
+        _, pending = await asyncio.wait(set(self._running), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+
+    async def _claim(self, count: int) -> List[Tuple[bytes, str]]:
+        redis = get_redis()
+        # 先认领崩溃 worker 遗留的任务
+        claimed = await redis.xautoclaim(
+            self.queue.stream_key, self.queue.group, self.consumer,
+            min_idle_time=self.queue.claim_idle_ms, start_id="0-0", count=count
+        )
+        entries = [(entry_id, fields[b"id"].decode()) for entry_id, fields in claimed[1] if fields]
+        if entries:
+            return entries
+        response = await redis.xreadgroup(
+            self.queue.group, self.consumer, {self.queue.stream_key: ">"}, count=count, block=1000
+        )
+        for _, items in response or []:
+            entries.extend((entry_id, fields[b"id"].decode()) for entry_id, fields in items)
+        return entries
+
+    async def _ack(self, entry_id: bytes) -> None:
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.xack(self.queue.stream_key, self.queue.group, entry_id)
+        pipe.xdel(self.queue.stream_key, entry_id)
+        await pipe.execute()
+
+    async def _execute(self, entry_id: bytes, job_id: str) -> None:
+        redis = get_redis()
+        raw = await redis.hgetall(self.queue.key(job_id))
+        if not raw:
+            await self._ack(entry_id)
+            return
+        job = _decode_job(job_id, raw)
+        if job["status"] in TERMINAL_STATUSES:
+            await self._ack(entry_id)
+            return
+        if job["cancel_requested"]:
+            await self.queue.finish(job_id, JOB_CANCELLED)
+            await self._ack(entry_id)
+            return
+
+        payload = json.loads(raw[b"payload"])
+        started = time.time()
+        if not job["attempts"]:
+            JOB_QUEUE_WAIT.labels(job["kind"]).observe(started - job["created"])
+        pipe = redis.pipeline(transaction=True)
+        pipe.hset(self.queue.key(job_id), mapping={"status": JOB_RUNNING, "started": started, "tokens": 0, "answer": ""})
+        pipe.hincrby(self.queue.key(job_id), "attempts", 1)
+        # 重新执行（上一个 worker 崩溃）时订阅方应丢弃已收到的部分回答
+        self.queue.publish(pipe, job_id, JOB_RUNNING, {"job_id": job_id, "attempt": int(job["attempts"] or 0) + 1})
+        await pipe.execute()
+
+        progress = _Progress()
+        JOBS_RUNNING.labels(job["kind"]).inc()
+        message_id = raw.get(b"message_id")
+        generation = asyncio.create_task(self._generate(
+            job_id, job["kind"], payload, job["user_id"], progress,
+            message_id.decode("utf-8") if message_id else None
+        ))
+        try:
+            cancelled = False
+            while True:
+                done, _ = await asyncio.wait({generation}, timeout=self.progress_interval)
+                if await self._report(entry_id, job_id, progress) and not cancelled:
+                    cancelled = True
+                    generation.cancel()
+                if done:
+                    break
+            try:
+                result = generation.result()
+            except asyncio.CancelledError:
+                await self.queue.finish(job_id, JOB_CANCELLED, progress.fields or None)
+                JOBS_FINISHED.labels(job["kind"], JOB_CANCELLED).inc()
+            except Exception as e:
+                logger.warning(f"Job {job_id} failed: {str(e)}")
+                await self.queue.finish(job_id, JOB_FAILED, progress.fields or None, error=str(e))
+                JOBS_FINISHED.labels(job["kind"], JOB_FAILED).inc()
+            else:
+                await self.queue.finish(job_id, JOB_SUCCEEDED, result)
+                JOBS_FINISHED.labels(job["kind"], JOB_SUCCEEDED).inc()
+            await self._ack(entry_id)
+            self.completed += 1
+        except asyncio.CancelledError:
+            # worker 停止时超时未完成：取消生成（对话消息保存部分回答）并结束任务，不再由其他 worker 重新执行
+            generation.cancel()
+            await asyncio.gather(generation, return_exceptions=True)
+            await self.queue.finish(job_id, JOB_FAILED, progress.fields or None, error="Worker stopped before the job finished")
+            JOBS_FINISHED.labels(job["kind"], JOB_FAILED).inc()
+            await self._ack(entry_id)
+            raise
+        finally:
+            JOBS_RUNNING.labels(job["kind"]).dec()
+
+    async def _report(self, entry_id: bytes, job_id: str, progress: _Progress) -> bool:
+        """发布新生成的 token、续期队列条目，返回是否收到了取消请求"""
+        pipe = get_redis().pipeline(transaction=False)
+        if progress.buffer:
+            text = "".join(progress.buffer)
+            progress.buffer.clear()
+            pipe.hset(self.queue.key(job_id), mapping={"tokens": len(progress.parts), "answer": "".join(progress.parts)})
+            self.queue.publish(pipe, job_id, "token", {"content": text})
+        # 重置空闲时间，执行时间较长的任务不会被其他 worker 认领
+        pipe.xclaim(self.queue.stream_key, self.queue.group, self.consumer, 0, [entry_id], justid=True)
+        pipe.hget(self.queue.key(job_id), "cancel_requested")
+        results = await pipe.execute()
+        return results[-1] == b"1"
+
+    async def _generate(
+        self,
+        job_id: str,
+        kind: str,
+        payload: Dict[str, Any],
+        user_id: Optional[str],
+        progress: _Progress,
+        message_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """执行任务；对话消息任务在 start 事件时把消息ID记入任务哈希，重新执行时复用该消息"""
+        async with AsyncSessionLocal() as db:
+            service = AiService(db)
+            if kind == JOB_CHAT:
+                user_key = payload.get("user_key") or user_id or "anonymous"
+                async for token in service.stream_chat(payload["model_id"], payload["prompt"], user_key=user_key):
+                    progress.add(token)
+                return {"content": "".join(progress.parts), "model_id": payload["model_id"]}
+
+            if kind == JOB_MESSAGE:
+                events = service.stream_message(
+                    payload["message"], username=payload["username"], user_id=user_id, message_id=message_id
+                )
+                try:
+                    async for event in events:
+                        if event["event"] == "start":
+                            # 取消或失败时结果中也带上消息ID，部分回答已保存在该消息中
+                            progress.fields.update(event["data"])
+                            if not message_id:
+                                await get_redis().hset(self.queue.key(job_id), "message_id", event["data"]["message_id"])
+                        elif event["event"] == "token":
+                            progress.add(event["data"]["content"])
+                        elif event["event"] == "error":
+                            raise RuntimeError(event["data"]["detail"])
+                        elif event["event"] == "done":
+                            return event["data"]
+                finally:
+                    await events.aclose()
+                raise RuntimeError("Generation ended without a result")
+
+            raise ValueError(f"Unknown job kind: {kind}")
+
+
+job_queue = JobQueue(ttl=settings.JOB_TTL, claim_idle=settings.JOB_CLAIM_IDLE)
@@ -0,0 +1,117 @@
+from models.ai_models import AiLLMConfiguration
+from core.config import settings
+from core.redis import get_redis
+from services.context_builder import BuiltContext
+from services.llm_registry import build_model_params, params_hash
+from typing import Any, Dict, List, Optional
+from array import array
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class KVContext:
+    """一次生成请求携带的 Ollama KV 上下文
+
+    tokens 和 backend 是上一轮生成返回的上下文及其所在的 Ollama 端点。请求路由到该端点时
+    只发送 prompt（本轮问题），Ollama 直接接着上下文生成，不再重新编码历史；路由到其他端点
+    或 OpenAI 兼容端点时发送完整提示词。生成结束后 tokens/backend 替换为本次返回的上下文，
+    turns 为新上下文包含的对话轮数。
+    """
+
+    def __init__(self, prompt: str, tokens: Optional[List[int]] = None, backend: Optional[str] = None, turns: int = 0):
+        self.prompt = prompt
+        self.tokens = tokens
+        self.backend = backend
+        self.turns = turns
+        self.reused = False
+        self.prompt_eval_count: Optional[int] = None
+
+    def usable_on(self, url: str) -> bool:
+        return bool(self.tokens) and self.backend == url
+
+
+class KVContextStore:
+    """在 Redis 中按对话保存 Ollama 返回的 context
+
+    以哈希保存：meta 为 JSON（模型、配置指纹、端点、最后一轮的消息ID、轮数），tokens 为
+    uint32 数组。以下情况不复用，改为完整重放历史并重新生成上下文：模型或其配置变化、
+    数据库中最新的一轮不是上下文结束时的那一轮（历史被修改、删除或由其他途径写入）、
+    轮数达到 max_chat_limit 或 token 数超出历史预算（此时完整重放会截断或摘要旧对话）。
+    """
+
+    def __init__(self, ttl: int = 3600):
+        self.ttl = ttl
+
+    @staticmethod
+    def key(conversation_id: str) -> str:
+        return f"conv:{conversation_id}:kv"
+
+    @staticmethod
+    def fingerprint(model_config: AiLLMConfiguration) -> str:
+        """模型名、生成参数和配置更新时间的摘要，任何一项变化都使已保存的上下文失效"""
+        return params_hash({
+            "model": model_config.llm_en_name,
+            "params": build_model_params(model_config),
+            "version": model_config.update_time,
+        })
+
+    def applies_to(self, model_config: AiLLMConfiguration) -> bool:
+        return settings.KV_CONTEXT_ENABLED and bool(model_config.is_local_llm)
+
+    async def load(self, conversation_id: str, model_config: AiLLMConfiguration, context: BuiltContext) -> KVContext:
+        """读取对话的上下文并判断能否复用；不能复用时返回不带 tokens 的 KVContext"""
+        kv = KVContext(context.question_prompt, turns=context.turns + 1)
+        try:
+            raw = await get_redis().hgetall(self.key(conversation_id))
+        except Exception as e:
+            logger.warning(f"Failed to load KV context: {str(e)}")
+            return kv
+        if not raw:
+            return kv
+
+        meta: Dict[str, Any] = json.loads(raw[b"meta"])
+        tokens = array("I")
+        tokens.frombytes(raw[b"tokens"])
+        max_turns = model_config.max_chat_limit or settings.CHAT_HISTORY_MAX_TURNS
+        reusable = (
+            meta["llm_id"] == model_config.llm_id
+            and meta["fingerprint"] == self.fingerprint(model_config)
+            and meta["message_id"] == context.last_message_id
+            and meta["turns"] < max_turns
+            and len(tokens) <= context.history_budget
+        )
+        if reusable:
+            kv.tokens = tokens.tolist()
+            kv.backend = meta["backend"]
+            kv.turns = meta["turns"] + 1
+        return kv
+
+    async def save(self, conversation_id: str, model_config: AiLLMConfiguration, kv: KVContext, message_id: str) -> None:
+        """保存本轮生成返回的上下文；没有返回上下文（如 OpenAI 兼容端点）时删除旧的上下文"""
+        key = self.key(conversation_id)
+        try:
+            if not kv.tokens or not kv.backend:
+                await get_redis().delete(key)
+                return
+            meta = {
+                "llm_id": model_config.llm_id,
+                "fingerprint": self.fingerprint(model_config),
+                "backend": kv.backend,
+                "message_id": message_id,
+                "turns": kv.turns,
+            }
+            pipe = get_redis().pipeline(transaction=True)
+            pipe.delete(key)
+            pipe.hset(key, mapping={"meta": json.dumps(meta), "tokens": array("I", kv.tokens).tobytes()})
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Failed to save KV context: {str(e)}")
+
+    async def clear(self, conversation_id: str) -> None:
+        await get_redis().delete(self.key(conversation_id))
+
+
+kv_context_store = KVContextStore(ttl=settings.CHAT_HISTORY_TTL)
@@ -0,0 +1,169 @@
+from models.ai_models import AiLLMConfiguration
+from core.config import settings
+from typing import TYPE_CHECKING, Any, Dict, Hashable, List, Optional, Tuple
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+import time
+
+if TYPE_CHECKING:
+    from langchain_ollama import OllamaLLM
+
+logger = logging.getLogger(__name__)
+
+
+def build_model_params(model_config: AiLLMConfiguration) -> Dict[str, Any]:
+    """把模型配置转换为 Ollama 生成参数"""
+    params: Dict[str, Any] = {
+        "temperature": model_config.temperature,
+        "top_p": model_config.top_p,
+        "num_predict": model_config.max_tokens,
+        "num_ctx": settings.LLM_CONTEXT_WINDOW,
+    }
+    # do_sample 为 false 时不启用采样，使用贪心解码
+    if not model_config.do_sample:
+        params["temperature"] = 0
+    return {k: v for k, v in params.items() if v is not None}
+
+
+def params_hash(params: Dict[str, Any]) -> str:
+    """生成参数的稳定摘要，用作缓存键的一部分"""
+    encoded = json.dumps(params, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha1(encoded).hexdigest()
+
+
+class _ClientEntry:
+    __slots__ = ("client", "version", "last_used")
+
+    def __init__(self, client: "OllamaLLM", version: Any):
+        self.client = client
+        self.version = version
+        self.last_used = time.monotonic()
+
+
+def _http_clients(client: "OllamaLLM") -> List[Any]:
+    """OllamaLLM 内部 ollama 同步/异步客户端持有的 httpx 客户端"""
+    clients = []
+    for attr in ("_client", "_async_client"):
+        http = getattr(getattr(client, attr, None), "_client", None)
+        if http is not None:
+            clients.append(http)
+    return clients
+
+
+async def _close_client(client: "OllamaLLM", delay: float = 0) -> None:
+    if delay:
+        await asyncio.sleep(delay)
+    for http in _http_clients(client):
+        try:
+            if hasattr(http, "aclose"):
+                await http.aclose()
+            else:
+                http.close()
+        except Exception as e:
+            logger.warning(f"Failed to close LLM client: {str(e)}")
+
+
+class LLMClientRegistry:
+    """进程级大模型客户端注册表
+
+    按 (模型标识, 参数摘要) 复用 OllamaLLM 实例及其内部的 HTTP 连接池，
+    模型配置的 update_time 变化时重建客户端，长时间未使用的客户端会被移除。
+    被移除的客户端可能还有进行中的请求（last_used 只在获取客户端时更新，长时间的流式生成
+    期间不会刷新），因此在后台等待 close_delay 秒后再关闭连接池。
+    """
+
+    def __init__(self, idle_ttl: float = 600, close_delay: float = 300):
+        self.idle_ttl = idle_ttl
+        self.close_delay = close_delay
+        self._clients: Dict[Tuple[Hashable, str], _ClientEntry] = {}
+        self._lock = threading.Lock()
+        self._closing: Dict[asyncio.Task, "OllamaLLM"] = {}
+
+    def _retire(self, clients: List["OllamaLLM"], delay: float) -> None:
+        for client in clients:
+            try:
+                task = asyncio.get_running_loop().create_task(_close_client(client, delay))
+            except RuntimeError:
+                # 没有运行中的事件循环（同步调用），异步连接池留给垃圾回收
+                for http in _http_clients(client):
+                    if not hasattr(http, "aclose"):
+                        http.close()
+                continue
+            self._closing[task] = client
+            task.add_done_callback(lambda done: self._closing.pop(done, None))
+
+    def get_client(self, model_config: AiLLMConfiguration, base_url: Optional[str] = None) -> "OllamaLLM":
+        """获取数据库中已配置的本地模型在指定 Ollama 端点上的共享客户端
+
+        在线模型通过 llm_router 的 OpenAI 兼容接口调用，不经过这里。
+        """
+        if not model_config.is_local_llm:
+            raise NotImplementedError("Online LLMs are served through llm_router")
+        params = build_model_params(model_config)
+        if base_url:
+            params["base_url"] = base_url
+        return self._get(
+            model_config.llm_id,
+            model_config.llm_en_name,
+            params,
+            version=model_config.update_time
+        )
+
+    def get_named_client(self, model_name: str, **params: Any) -> "OllamaLLM":
+        """按模型名称获取共享客户端（不依赖数据库配置）"""
+        return self._get(model_name, model_name, params, version=None)
+
+    def _get(self, key: Hashable, model_name: str, params: Dict[str, Any], version: Any) -> "OllamaLLM":
+        cache_key = (key, params_hash(params))
+        with self._lock:
+            self._evict_idle_locked()
+            entry = self._clients.get(cache_key)
+            if entry is None or entry.version != version:
+                if entry is not None:
+                    logger.info(f"LLM configuration {key} changed, rebuilding client")
+                    self._retire([entry.client], self.close_delay)
+                # langchain 导入较慢，延迟到第一次创建客户端时
+                from langchain_ollama import OllamaLLM
+
+                # keep_alive 不影响生成结果，不计入参数摘要
+                client = OllamaLLM(model=model_name, keep_alive=settings.LLM_KEEP_ALIVE or None, **params)
+                entry = _ClientEntry(client, version)
+                self._clients[cache_key] = entry
+            entry.last_used = time.monotonic()
+            return entry.client
+
+    def evict_idle(self) -> int:
+        """移除空闲超时的客户端，返回移除数量"""
+        with self._lock:
+            return self._evict_idle_locked()
+
+    def _evict_idle_locked(self) -> int:
+        deadline = time.monotonic() - self.idle_ttl
+        expired = [k for k, entry in self._clients.items() if entry.last_used < deadline]
+        self._retire([self._clients.pop(k).client for k in expired], self.close_delay)
+        return len(expired)
+
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        """移除指定模型（或全部）的客户端"""
+        with self._lock:
+            keys = list(self._clients) if key is None else [k for k in self._clients if k[0] == key]
+            self._retire([self._clients.pop(k).client for k in keys], self.close_delay)
+
+    async def close(self) -> None:
+        """关闭全部客户端，包括等待关闭的，进程退出时调用"""
+        with self._lock:
+            clients = [entry.client for entry in self._clients.values()] + list(self._closing.values())
+            self._clients.clear()
+        for task in list(self._closing):
+            task.cancel()
+        for client in clients:
+            await _close_client(client)
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+
+llm_registry = LLMClientRegistry(idle_ttl=settings.LLM_CLIENT_IDLE_TTL, close_delay=settings.LLM_HTTP_TIMEOUT)
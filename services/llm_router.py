@@ -0,0 +1,481 @@
+from models.ai_models import AiLLMConfiguration
+from core.config import settings
+from core.metrics import LLM_BACKEND_FAILOVERS, LLM_BACKEND_REQUESTS, LLM_BACKEND_UP
+from services.llm_registry import build_model_params, llm_registry
+from utils.lazy import lazy_import
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, List, Optional, Sequence, Set, Tuple
+import asyncio
+import json
+import logging
+import random
+import time
+
+if TYPE_CHECKING:
+    from services.kv_context import KVContext
+
+httpx = lazy_import("httpx")
+
+logger = logging.getLogger(__name__)
+
+KIND_OLLAMA = "ollama"
+KIND_OPENAI = "openai"
+
+
+class NoBackendAvailable(RuntimeError):
+    """模型没有可用的后端（全部不健康、熔断或已尝试失败）"""
+
+
+def normalize_url(url: str) -> str:
+    url = url.strip().rstrip("/")
+    if "://" not in url:
+        url = f"http://{url}"
+    return url
+
+
+class Backend:
+    """一个模型服务端点（Ollama 或 OpenAI 兼容接口）的负载和健康状态
+
+    连续失败 failure_threshold 次后熔断 cooldown 秒；冷却结束后只放行一个试探请求，
+    成功则恢复，失败则再次熔断。健康检查失败的端点在下次检查成功前不参与路由。
+    """
+
+    def __init__(self, kind: str, url: str, api_key: Optional[str] = None):
+        self.kind = kind
+        self.url = url
+        self.api_key = api_key
+        self.in_flight = 0
+        self.failures = 0
+        self.open_until = 0.0
+        self.healthy = True
+        self.models: Optional[Set[str]] = None
+        self.latency: Optional[float] = None
+        self.requests = 0
+        self.errors = 0
+        self._http: Optional["httpx.AsyncClient"] = None
+
+    @property
+    def name(self) -> str:
+        return f"{self.kind}:{self.url}"
+
+    def available(self, now: float, failure_threshold: int) -> bool:
+        if not self.healthy or now < self.open_until:
+            return False
+        # 半开状态同一时间只放行一个请求
+        return self.failures < failure_threshold or self.in_flight == 0
+
+    def serves(self, model_name: str) -> bool:
+        """健康检查拿到模型列表前视为可以服务任意模型"""
+        if self.models is None:
+            return True
+        return model_name in self.models or f"{model_name}:latest" in self.models
+
+    def record_success(self, elapsed: float) -> None:
+        self.failures = 0
+        self.open_until = 0.0
+        # 首 token（或完整响应）耗时的指数滑动平均，用于观察各端点的速度
+        self.latency = elapsed if self.latency is None else 0.8 * self.latency + 0.2 * elapsed
+        LLM_BACKEND_REQUESTS.labels(self.name, "ok").inc()
+
+    def record_failure(self, failure_threshold: int, cooldown: float) -> None:
+        self.failures += 1
+        self.errors += 1
+        LLM_BACKEND_REQUESTS.labels(self.name, "error").inc()
+        if self.failures >= failure_threshold:
+            self.open_until = time.monotonic() + cooldown
+            logger.warning(f"LLM backend {self.name} ejected for {cooldown}s after {self.failures} failures")
+
+    def http(self, max_connections: int, timeout: float) -> "httpx.AsyncClient":
+        """端点共享的 HTTP 连接池（OpenAI 兼容接口和携带 KV 上下文的 Ollama 请求）"""
+        if self._http is None:
+            headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+            self._http = httpx.AsyncClient(
+                base_url=self.url,
+                headers=headers,
+                timeout=httpx.Timeout(timeout, connect=5.0),
+                limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+            )
+        return self._http
+
+    def stats(self, now: float) -> Dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "url": self.url,
+            "healthy": self.healthy,
+            "circuit_open": now < self.open_until,
+            "in_flight": self.in_flight,
+            "consecutive_failures": self.failures,
+            "latency_ms": round(self.latency * 1000, 2) if self.latency is not None else None,
+            "requests": self.requests,
+            "errors": self.errors,
+            "models": sorted(self.models) if self.models is not None else None,
+        }
+
+
+class LLMRouter:
+    """在模型的多个后端之间路由生成请求
+
+    模型的后端来自配置行的 api_url（可用逗号分隔多个）以及 parent_id 指向该模型的启用子行，
+    本地模型没有配置地址时使用 OLLAMA_HOST。每个请求发往负载最低（进行中请求最少）的健康端点，
+    在产生第一个 token 之前失败会换下一个端点重试。is_local_llm 为 false 的端点按 OpenAI 兼容接口调用。
+    """
+
+    def __init__(
+        self,
+        default_host: str,
+        failure_threshold: int = 3,
+        cooldown: float = 30,
+        probe_timeout: float = 2,
+        max_connections: int = 32,
+        request_timeout: float = 300
+    ):
+        self.default_host = normalize_url(default_host)
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.probe_timeout = probe_timeout
+        self.max_connections = max_connections
+        self.request_timeout = request_timeout
+        self._backends: Dict[Tuple[str, str], Backend] = {}
+        self._endpoints: Dict[int, List[Tuple[str, str, Optional[str]]]] = {}
+        # 每个模型当前使用的端点，地址变更后不再被任何模型使用的端点会被移除
+        self._model_backends: Dict[int, Set[Tuple[str, str]]] = {}
+        self._probe_client: Optional["httpx.AsyncClient"] = None
+        self._closing: Dict[asyncio.Task, "httpx.AsyncClient"] = {}
+
+    def _backend(self, kind: str, url: str, api_key: Optional[str]) -> Backend:
+        key = (kind, url)
+        backend = self._backends.get(key)
+        if backend is None:
+            backend = self._backends[key] = Backend(kind, url, api_key)
+        elif api_key and backend.api_key != api_key:
+            backend.api_key = api_key
+            self._retire(backend)
+        return backend
+
+    def _retire(self, backend: Backend) -> None:
+        """换下端点的 HTTP 客户端，等其上进行中的请求结束后在后台关闭"""
+        client, backend._http = backend._http, None
+        if client is None:
+            return
+        task = asyncio.create_task(self._close_when_idle(backend, client))
+        self._closing[task] = client
+        task.add_done_callback(lambda done: self._closing.pop(done, None))
+
+    async def _close_when_idle(self, backend: Backend, client: "httpx.AsyncClient") -> None:
+        # in_flight 也包含新客户端上的请求，这里只会多等，最多等待 request_timeout 秒
+        deadline = time.monotonic() + self.request_timeout
+        while backend.in_flight and time.monotonic() < deadline:
+            await asyncio.sleep(1)
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.warning(f"Failed to close HTTP client of {backend.name}: {str(e)}")
+
+    def _track(self, llm_id: int, keys: Set[Tuple[str, str]]) -> None:
+        if self._model_backends.get(llm_id) == keys:
+            return
+        self._model_backends[llm_id] = keys
+        in_use = set().union(*self._model_backends.values())
+        for key in [key for key in self._backends if key not in in_use]:
+            self._retire(self._backends.pop(key))
+
+    @staticmethod
+    def _endpoints_of(config: AiLLMConfiguration) -> List[Tuple[str, str, Optional[str]]]:
+        kind = KIND_OLLAMA if config.is_local_llm else KIND_OPENAI
+        urls = [url for url in (config.api_url or "").split(",") if url.strip()]
+        return [(kind, normalize_url(url), config.api_key) for url in urls]
+
+    def configure(self, model_config: AiLLMConfiguration, children: Sequence[AiLLMConfiguration]) -> None:
+        """登记模型的子端点，加载模型配置时调用"""
+        endpoints = []
+        for child in children:
+            endpoints.extend(self._endpoints_of(child))
+        self._endpoints[model_config.llm_id] = endpoints
+
+    def backends_for(self, model_config: AiLLMConfiguration) -> List[Backend]:
+        endpoints = self._endpoints_of(model_config) + self._endpoints.get(model_config.llm_id, [])
+        if not endpoints:
+            if not model_config.is_local_llm:
+                raise NoBackendAvailable(f"Model {model_config.llm_en_name} has no API URL configured")
+            endpoints = [(KIND_OLLAMA, self.default_host, None)]
+        backends = [self._backend(kind, url, api_key) for kind, url, api_key in endpoints]
+        self._track(model_config.llm_id, {(backend.kind, backend.url) for backend in backends})
+        return backends
+
+    def _choose(
+        self,
+        backends: List[Backend],
+        model_name: str,
+        tried: Set[Tuple[str, str]],
+        prefer: Optional[str] = None
+    ) -> Optional[Backend]:
+        now = time.monotonic()
+        candidates = [
+            b for b in backends
+            if (b.kind, b.url) not in tried and b.available(now, self.failure_threshold)
+        ]
+        serving = [b for b in candidates if b.serves(model_name)]
+        candidates = serving or candidates
+        if not candidates:
+            return None
+        # 保存了 KV 上下文的端点可以跳过历史的预填充，比负载均衡更划算
+        for backend in candidates:
+            if backend.kind == KIND_OLLAMA and backend.url == prefer:
+                return backend
+        least = min(b.in_flight for b in candidates)
+        # 负载相同时随机选择，避免请求稀疏时总是落在同一个端点
+        return random.choice([b for b in candidates if b.in_flight == least])
+
+    def _openai_body(self, model_config: AiLLMConfiguration, prompt: str, stream: bool) -> Dict[str, Any]:
+        params = build_model_params(model_config)
+        body: Dict[str, Any] = {
+            "model": model_config.llm_en_name,
+            "messages": [{"role": "user", "content": prompt}],
+            "stream": stream,
+        }
+        for source, target in (("temperature", "temperature"), ("top_p", "top_p"), ("num_predict", "max_tokens")):
+            if source in params:
+                body[target] = params[source]
+        # OpenAI 接口的 top_p 取值范围为 (0, 1]
+        if not body.get("top_p"):
+            body.pop("top_p", None)
+        return body
+
+    async def _ollama_generate(
+        self,
+        backend: Backend,
+        model_config: AiLLMConfiguration,
+        prompt: str,
+        kv: "KVContext"
+    ) -> AsyncIterator[str]:
+        """直接调用 Ollama /api/generate，传入并取回 context
+
+        上下文在该端点上时只发送本轮问题，否则发送完整提示词；结束时把返回的 context 写回 kv。
+        """
+        reuse = kv.usable_on(backend.url)
+        body: Dict[str, Any] = {
+            "model": model_config.llm_en_name,
+            "prompt": kv.prompt if reuse else prompt,
+            "stream": True,
+            "options": build_model_params(model_config),
+        }
+        if reuse:
+            body["context"] = kv.tokens
+        if settings.LLM_KEEP_ALIVE:
+            body["keep_alive"] = settings.LLM_KEEP_ALIVE
+        client = backend.http(self.max_connections, self.request_timeout)
+        async with client.stream("POST", "/api/generate", json=body) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                data = json.loads(line)
+                if data.get("error"):
+                    raise RuntimeError(data["error"])
+                if data.get("response"):
+                    yield data["response"]
+                if data.get("done"):
+                    kv.reused = reuse
+                    kv.tokens = data.get("context")
+                    kv.backend = backend.url
+                    kv.prompt_eval_count = data.get("prompt_eval_count")
+
+    async def _invoke_once(
+        self,
+        backend: Backend,
+        model_config: AiLLMConfiguration,
+        prompt: str,
+        kv: Optional["KVContext"] = None
+    ) -> str:
+        if backend.kind == KIND_OLLAMA and kv is not None:
+            return "".join([chunk async for chunk in self._ollama_generate(backend, model_config, prompt, kv)])
+        if backend.kind == KIND_OLLAMA:
+            return await llm_registry.get_client(model_config, base_url=backend.url).ainvoke(prompt)
+        client = backend.http(self.max_connections, self.request_timeout)
+        response = await client.post("/chat/completions", json=self._openai_body(model_config, prompt, False))
+        response.raise_for_status()
+        if kv is not None:
+            # OpenAI 兼容接口不返回上下文，已保存的上下文不再对应最新的历史
+            kv.tokens = None
+        return response.json()["choices"][0]["message"]["content"] or ""
+
+    async def _stream_once(
+        self,
+        backend: Backend,
+        model_config: AiLLMConfiguration,
+        prompt: str,
+        kv: Optional["KVContext"] = None
+    ) -> AsyncIterator[str]:
+        if backend.kind == KIND_OLLAMA and kv is not None:
+            async for chunk in self._ollama_generate(backend, model_config, prompt, kv):
+                yield chunk
+            return
+        if backend.kind == KIND_OLLAMA:
+            async for chunk in llm_registry.get_client(model_config, base_url=backend.url).astream(prompt):
+                yield chunk
+            return
+        client = backend.http(self.max_connections, self.request_timeout)
+        async with client.stream("POST", "/chat/completions", json=self._openai_body(model_config, prompt, True)) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                choices = json.loads(data).get("choices") or []
+                content = choices[0].get("delta", {}).get("content") if choices else None
+                if content:
+                    yield content
+        if kv is not None:
+            kv.tokens = None
+
+    async def invoke(self, model_config: AiLLMConfiguration, prompt: str, kv: Optional["KVContext"] = None) -> str:
+        """生成完整回复，失败时换其他端点重试
+
+        传入 kv 时优先路由到保存了该上下文的 Ollama 端点，只发送本轮问题；
+        最终没有在该端点上生成时按 prompt 完整重放。
+        """
+        backends = self.backends_for(model_config)
+        tried: Set[Tuple[str, str]] = set()
+        last_error: Optional[Exception] = None
+        while True:
+            backend = self._choose(backends, model_config.llm_en_name, tried, kv.backend if kv else None)
+            if backend is None:
+                raise last_error or NoBackendAvailable(f"No healthy backend for model {model_config.llm_en_name}")
+            if tried:
+                LLM_BACKEND_FAILOVERS.labels(str(model_config.llm_id)).inc()
+            tried.add((backend.kind, backend.url))
+            backend.in_flight += 1
+            backend.requests += 1
+            started = time.perf_counter()
+            try:
+                response = await self._invoke_once(backend, model_config, prompt, kv)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"LLM backend {backend.name} failed for {model_config.llm_en_name}: {str(e)}")
+                backend.record_failure(self.failure_threshold, self.cooldown)
+                last_error = e
+                continue
+            finally:
+                backend.in_flight -= 1
+            backend.record_success(time.perf_counter() - started)
+            return response
+
+    async def stream(
+        self,
+        model_config: AiLLMConfiguration,
+        prompt: str,
+        kv: Optional["KVContext"] = None
+    ) -> AsyncIterator[str]:
+        """逐个返回生成的 token；第一个 token 之前失败时换其他端点重试，之后的失败直接抛出
+
+        kv 的用法与 invoke 相同。
+        """
+        backends = self.backends_for(model_config)
+        tried: Set[Tuple[str, str]] = set()
+        last_error: Optional[Exception] = None
+        while True:
+            backend = self._choose(backends, model_config.llm_en_name, tried, kv.backend if kv else None)
+            if backend is None:
+                raise last_error or NoBackendAvailable(f"No healthy backend for model {model_config.llm_en_name}")
+            if tried:
+                LLM_BACKEND_FAILOVERS.labels(str(model_config.llm_id)).inc()
+            tried.add((backend.kind, backend.url))
+            backend.in_flight += 1
+            backend.requests += 1
+            started = time.perf_counter()
+            chunks = self._stream_once(backend, model_config, prompt, kv)
+            try:
+                try:
+                    first = await chunks.__anext__()
+                except StopAsyncIteration:
+                    backend.record_success(time.perf_counter() - started)
+                    return
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.warning(f"LLM backend {backend.name} failed for {model_config.llm_en_name}: {str(e)}")
+                    backend.record_failure(self.failure_threshold, self.cooldown)
+                    last_error = e
+                    continue
+
+                backend.record_success(time.perf_counter() - started)
+                yield first
+                try:
+                    async for chunk in chunks:
+                        yield chunk
+                except (GeneratorExit, asyncio.CancelledError):
+                    raise
+                except Exception:
+                    # 已经输出了部分回答，不能换端点重试
+                    backend.record_failure(self.failure_threshold, self.cooldown)
+                    raise
+                return
+            finally:
+                backend.in_flight -= 1
+                await chunks.aclose()
+
+    async def _probe(self, backend: Backend) -> None:
+        if self._probe_client is None:
+            self._probe_client = httpx.AsyncClient(timeout=self.probe_timeout)
+        try:
+            if backend.kind == KIND_OLLAMA:
+                response = await self._probe_client.get(f"{backend.url}/api/tags")
+                response.raise_for_status()
+                backend.models = {model["name"] for model in response.json().get("models", [])}
+            else:
+                headers = {"Authorization": f"Bearer {backend.api_key}"} if backend.api_key else {}
+                response = await self._probe_client.get(f"{backend.url}/models", headers=headers)
+                response.raise_for_status()
+                backend.models = {model["id"] for model in response.json().get("data", [])}
+            # 空列表通常是接口不返回模型列表，不据此排除端点
+            if not backend.models:
+                backend.models = None
+            if not backend.healthy:
+                logger.info(f"LLM backend {backend.name} is healthy again")
+            backend.healthy = True
+        except Exception as e:
+            if backend.healthy:
+                logger.warning(f"LLM backend {backend.name} failed health check: {str(e)}")
+            backend.healthy = False
+        LLM_BACKEND_UP.labels(backend.name).set(1 if backend.healthy else 0)
+
+    async def check_health(self) -> None:
+        await asyncio.gather(*(self._probe(backend) for backend in list(self._backends.values())))
+
+    async def run_health_checks(self, interval: float) -> None:
+        """定期探测所有已知端点，在应用生命周期内运行"""
+        while True:
+            try:
+                await self.check_health()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"LLM health check failed: {str(e)}")
+            await asyncio.sleep(interval)
+
+    async def close(self) -> None:
+        # 关闭时不再等待换下的客户端上的请求，直接关闭
+        retired = list(self._closing.values())
+        for task in list(self._closing):
+            task.cancel()
+        clients = [backend._http for backend in self._backends.values()] + [self._probe_client] + retired
+        for client in clients:
+            if client is not None:
+                await client.aclose()
+        await llm_registry.close()
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {backend.name: backend.stats(now) for backend in self._backends.values()}
+
+
+llm_router = LLMRouter(
+    default_host=settings.OLLAMA_HOST,
+    failure_threshold=settings.LLM_CIRCUIT_FAILURES,
+    cooldown=settings.LLM_CIRCUIT_COOLDOWN,
+    probe_timeout=settings.LLM_HEALTH_CHECK_TIMEOUT,
+    max_connections=settings.LLM_HTTP_MAX_CONNECTIONS,
+    request_timeout=settings.LLM_HTTP_TIMEOUT
+)
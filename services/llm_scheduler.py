@@ -0,0 +1,193 @@
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from core.config import settings
+from typing import Any, AsyncIterator, Deque, Dict, Optional
+import asyncio
+import logging
+import math
+import time
+
+logger = logging.getLogger(__name__)
+
+# 优先级：数值越小越先调度
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+PRIORITY_BACKGROUND = 2
+
+
+class AdmissionRejected(Exception):
+    """排队已满或等待超时，调用方应返回 429/503 并附带 Retry-After"""
+
+    def __init__(self, detail: str, status_code: int, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class _ModelQueue:
+    """单个模型的并发槽位和等待队列"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self.waiting = 0
+        # 优先级 -> 用户 -> 该用户的等待者；同一优先级内按用户轮转，保证公平
+        self.queues: Dict[int, "OrderedDict[str, Deque[asyncio.Future]]"] = {}
+        self.admitted = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.service_time_avg = 0.0
+
+    def user_waiting(self, user_key: str) -> int:
+        return sum(len(users.get(user_key, ())) for users in self.queues.values())
+
+    def enqueue(self, priority: int, user_key: str, future: asyncio.Future) -> None:
+        self.queues.setdefault(priority, OrderedDict()).setdefault(user_key, deque()).append(future)
+        self.waiting += 1
+
+    def remove(self, priority: int, user_key: str, future: asyncio.Future) -> None:
+        users = self.queues.get(priority)
+        waiters = users.get(user_key) if users else None
+        if waiters and future in waiters:
+            waiters.remove(future)
+            self.waiting -= 1
+            if not waiters:
+                del users[user_key]
+            if not users:
+                del self.queues[priority]
+
+    def pop_next(self) -> Optional[asyncio.Future]:
+        for priority in sorted(self.queues):
+            users = self.queues[priority]
+            user_key, waiters = users.popitem(last=False)
+            future = waiters.popleft()
+            self.waiting -= 1
+            if waiters:
+                # 该用户还有等待者，排到本优先级队尾
+                users[user_key] = waiters
+            if not users:
+                del self.queues[priority]
+            return future
+        return None
+
+
+class LLMScheduler:
+    """大模型调用的准入控制
+
+    每个 llm_id 有独立的并发上限和有界等待队列。槽位释放时优先交给高优先级的
+    等待者，同一优先级内在用户之间轮转。队列已满时立即拒绝，而不是让请求无限排队。
+    """
+
+    def __init__(
+        self,
+        default_limit: int,
+        limits: Optional[Dict[int, int]] = None,
+        max_queue: int = 64,
+        max_queue_per_user: int = 8,
+        queue_timeout: float = 60
+    ):
+        self.default_limit = default_limit
+        self.limits = limits or {}
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self.queue_timeout = queue_timeout
+        self._queues: Dict[Any, _ModelQueue] = {}
+
+    def _queue(self, llm_id: Any) -> _ModelQueue:
+        queue = self._queues.get(llm_id)
+        if queue is None:
+            queue = _ModelQueue(self.limits.get(llm_id, self.default_limit))
+            self._queues[llm_id] = queue
+        return queue
+
+    def _retry_after(self, queue: _ModelQueue) -> int:
+        """按平均占用时间估算排队清空所需的秒数"""
+        estimate = (queue.service_time_avg or 1.0) * (queue.waiting + 1) / max(queue.limit, 1)
+        return max(1, math.ceil(estimate))
+
+    @asynccontextmanager
+    async def slot(self, llm_id: Any, user_key: str, priority: int = PRIORITY_INTERACTIVE) -> AsyncIterator[None]:
+        """占用模型的一个并发槽位，退出时释放"""
+        queue = self._queue(llm_id)
+        await self._acquire(queue, llm_id, user_key, priority)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            queue.service_time_avg = elapsed if not queue.service_time_avg \
+                else 0.9 * queue.service_time_avg + 0.1 * elapsed
+            self._release(queue)
+
+    async def _acquire(self, queue: _ModelQueue, llm_id: Any, user_key: str, priority: int) -> None:
+        if queue.active < queue.limit and queue.waiting == 0:
+            queue.active += 1
+            queue.admitted += 1
+            return
+
+        if queue.waiting >= self.max_queue:
+            queue.rejected += 1
+            raise AdmissionRejected(f"Model {llm_id} is busy, please retry later", 503, self._retry_after(queue))
+        if queue.user_waiting(user_key) >= self.max_queue_per_user:
+            queue.rejected += 1
+            raise AdmissionRejected("Too many pending requests", 429, self._retry_after(queue))
+
+        future = asyncio.get_running_loop().create_future()
+        queue.enqueue(priority, user_key, future)
+        enqueued = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # 超时/取消的同时已拿到槽位，直接交还
+                self._release(queue)
+            else:
+                future.cancel()
+                queue.remove(priority, user_key, future)
+            if isinstance(e, asyncio.TimeoutError):
+                queue.timeouts += 1
+                raise AdmissionRejected(f"Timed out waiting for model {llm_id}", 503, self._retry_after(queue))
+            raise
+
+        waited = time.monotonic() - enqueued
+        queue.admitted += 1
+        queue.wait_time_total += waited
+        queue.wait_time_max = max(queue.wait_time_max, waited)
+
+    def _release(self, queue: _ModelQueue) -> None:
+        # 槽位直接移交给下一个等待者，active 不变
+        while True:
+            future = queue.pop_next()
+            if future is None:
+                queue.active -= 1
+                return
+            if not future.done():
+                future.set_result(True)
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            str(llm_id): {
+                "limit": queue.limit,
+                "active": queue.active,
+                "queue_depth": queue.waiting,
+                "admitted": queue.admitted,
+                "rejected": queue.rejected,
+                "timeouts": queue.timeouts,
+                "wait_time_avg_ms": round(queue.wait_time_total / queue.admitted * 1000, 2) if queue.admitted else 0.0,
+                "wait_time_max_ms": round(queue.wait_time_max * 1000, 2),
+                "service_time_avg_ms": round(queue.service_time_avg * 1000, 2),
+            }
+            for llm_id, queue in self._queues.items()
+        }
+
+
+llm_scheduler = LLMScheduler(
+    default_limit=settings.LLM_MAX_CONCURRENCY,
+    limits=settings.LLM_CONCURRENCY_OVERRIDES,
+    max_queue=settings.LLM_MAX_QUEUE,
+    max_queue_per_user=settings.LLM_MAX_QUEUE_PER_USER,
+    queue_timeout=settings.LLM_QUEUE_TIMEOUT
+)
@@ -0,0 +1,328 @@
+from sqlalchemy import insert, update
+from models.base import AsyncSessionLocal
+from models.chat import Conversation, Message
+from core.config import settings
+from core.metrics import WRITE_BEHIND_DEAD_LETTERS
+from core.redis import get_redis
+from typing import Any, Dict, List, Optional, Tuple
+from datetime import datetime
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+
+logger = logging.getLogger(__name__)
+
+OP_INSERT_MESSAGE = "insert_message"
+OP_UPDATE_MESSAGE = "update_message"
+OP_TOUCH_CONVERSATION = "touch_conversation"
+
+_DATETIME_FIELDS = ("create_time", "update_time")
+
+# 停止过程中连续出错达到该次数后放弃写完剩余条目
+_STOP_MAX_ERRORS = 3
+
+# 批次中的一条写操作：(Stream 条目ID，进程内模式为 None；编码后的操作；已失败的次数)
+_Entry = Tuple[Optional[bytes], Any, int]
+
+
+def _encode(op: str, values: Dict[str, Any]) -> str:
+    values = {k: v.isoformat() if isinstance(v, datetime) else v for k, v in values.items()}
+    return json.dumps({"op": op, "values": values}, ensure_ascii=False)
+
+
+def _decode(raw: Any) -> Tuple[str, Dict[str, Any]]:
+    entry = json.loads(raw)
+    values = entry["values"]
+    for field in _DATETIME_FIELDS:
+        if isinstance(values.get(field), str):
+            values[field] = datetime.fromisoformat(values[field])
+    return entry["op"], values
+
+
+class MessageWriter:
+    """消息写后（write-behind）批量持久化
+
+    请求链路只把消息插入/更新和对话 update_time 变更放入队列，后台任务按条数或
+    时间间隔合并成批量语句写入数据库。durability 为 redis 时队列使用 Redis Stream
+    消费组：写入 Stream 即视为已确认，提交数据库后才 XACK，worker 崩溃后未确认的
+    条目会被其他 worker 认领并重放；为 memory 时只保存在进程内。
+
+    整批写入失败时逐条重试，仍失败的条目记一次失败后重新入队，失败 max_attempts 次后
+    放弃：redis 模式转入死信 Stream，memory 模式记录到错误日志，两者都计入
+    write_behind_dead_letters_total。
+    """
+
+    def __init__(
+        self,
+        batch_size: int = 100,
+        flush_interval: float = 0.5,
+        durability: str = "memory",
+        stream_key: str = "message-writer:stream",
+        claim_idle: float = 30,
+        max_attempts: int = 5,
+        dead_letter_stream: str = "message-writer:dead",
+        stop_timeout: float = 10
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.durability = durability
+        self.stream_key = stream_key
+        self.group = f"{stream_key}:writers"
+        self.consumer = f"{socket.gethostname()}-{os.getpid()}"
+        self.claim_idle_ms = int(claim_idle * 1000)
+        self.max_attempts = max(1, max_attempts)
+        self.dead_letter_stream = dead_letter_stream
+        self.stop_timeout = stop_timeout
+        self._queue: Optional["asyncio.Queue[Tuple[str, int]]"] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.flushed_batches = 0
+        self.flushed_entries = 0
+        self.failed_batches = 0
+        self.dead_letters = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self) -> None:
+        if self.running:
+            return
+        self._stopping = False
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.batch_size * 100)
+        if self.durability == "redis":
+            try:
+                await get_redis().xgroup_create(self.stream_key, self.group, id="0", mkstream=True)
+            except Exception as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """停止后台任务，进程内队列中剩余的条目会先写入数据库
+
+        最多等待 stop_timeout 秒，超时后取消后台任务。redis 模式下未确认的条目留在 Stream 中，
+        之后由其他 worker 认领；memory 模式下未写入的条目会丢失。
+        """
+        if not self.running:
+            return
+        self._stopping = True
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), self.stop_timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Message writer did not drain within {self.stop_timeout}s, {self._queue.qsize()} queued writes left")
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    async def submit(self, op: str, values: Dict[str, Any]) -> None:
+        """提交一个写操作，返回时即视为已确认"""
+        raw = _encode(op, values)
+        if self.durability == "redis":
+            await get_redis().xadd(self.stream_key, {"e": raw})
+        else:
+            await self._queue.put((raw, 0))
+
+    async def insert_message(self, message: Message) -> None:
+        await self.submit(OP_INSERT_MESSAGE, {
+            column.key: getattr(message, column.key)
+            for column in Message.__table__.columns
+            if getattr(message, column.key) is not None
+        })
+
+    async def update_message(self, message_id: str, **values: Any) -> None:
+        await self.submit(OP_UPDATE_MESSAGE, dict(values, message_id=message_id))
+
+    async def touch_conversation(self, conversation_id: str, update_time: datetime, update_by: Optional[str] = None) -> None:
+        values = {"conversation_id": conversation_id, "update_time": update_time}
+        if update_by:
+            values["update_by"] = update_by
+        await self.submit(OP_TOUCH_CONVERSATION, values)
+
+    async def _run(self) -> None:
+        errors = 0
+        while True:
+            try:
+                if self.durability == "redis":
+                    batch = await self._collect_from_stream()
+                else:
+                    batch = await self._collect_from_queue()
+                if batch:
+                    await self._flush_with_ack(batch)
+                elif self._stopping:
+                    return
+                errors = 0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                errors += 1
+                logger.error(f"Message writer error: {str(e)}")
+                # 停止时 Redis 或数据库持续不可用则直接退出，Stream 中未确认的条目之后会被认领
+                if self._stopping and errors >= _STOP_MAX_ERRORS:
+                    logger.error(f"Message writer stopping after {errors} consecutive errors")
+                    return
+                await asyncio.sleep(self.flush_interval)
+
+    async def _collect_from_queue(self) -> List[_Entry]:
+        batch: List[_Entry] = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                raw, attempts = await asyncio.wait_for(self._queue.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            batch.append((None, raw, attempts))
+        return batch
+
+    async def _collect_from_stream(self) -> List[_Entry]:
+        redis = get_redis()
+        batch: List[_Entry] = []
+
+        # 先认领崩溃 worker 遗留的未确认条目
+        claimed = await redis.xautoclaim(
+            self.stream_key, self.group, self.consumer,
+            min_idle_time=self.claim_idle_ms, start_id="0-0", count=self.batch_size
+        )
+        batch.extend(self._stream_entry(entry_id, fields) for entry_id, fields in claimed[1] if fields)
+
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size and not self._stopping:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            response = await redis.xreadgroup(
+                self.group, self.consumer, {self.stream_key: ">"},
+                count=self.batch_size - len(batch), block=max(1, int(remaining * 1000))
+            )
+            for _, entries in response or []:
+                batch.extend(self._stream_entry(entry_id, fields) for entry_id, fields in entries)
+        return batch
+
+    @staticmethod
+    def _stream_entry(entry_id: bytes, fields: Dict[bytes, Any]) -> _Entry:
+        return entry_id, fields[b"e"], int(fields.get(b"a", 0))
+
+    async def _flush_with_ack(self, batch: List[_Entry]) -> None:
+        try:
+            await self.flush([raw for _, raw, _ in batch])
+        except Exception as e:
+            self.failed_batches += 1
+            logger.error(f"Failed to flush {len(batch)} queued writes, retrying one by one: {str(e)}")
+            await self._flush_one_by_one(batch)
+            return
+
+        if self.durability == "redis":
+            ids = [entry_id for entry_id, _, _ in batch]
+            pipe = get_redis().pipeline(transaction=False)
+            pipe.xack(self.stream_key, self.group, *ids)
+            pipe.xdel(self.stream_key, *ids)
+            await pipe.execute()
+
+    async def _flush_one_by_one(self, batch: List[_Entry]) -> None:
+        """逐条写入失败批次中的条目，使一条无法写入的数据不会拖住同批的其他条目"""
+        retry: List[_Entry] = []
+        dead: List[Tuple[Any, str]] = []
+        for entry_id, raw, attempts in batch:
+            try:
+                await self.flush([raw])
+            except Exception as e:
+                if attempts + 1 >= self.max_attempts:
+                    dead.append((raw, str(e)))
+                else:
+                    retry.append((entry_id, raw, attempts + 1))
+
+        if self.durability == "redis":
+            # 成功、重试和放弃的条目都确认原条目；重试的条目带着失败次数重新写入 Stream，
+            # 放弃的写入死信 Stream。事务执行失败时原条目保持未确认，稍后整批重放
+            ids = [entry_id for entry_id, _, _ in batch]
+            pipe = get_redis().pipeline(transaction=True)
+            for raw, error in dead:
+                pipe.xadd(self.dead_letter_stream, {"e": raw, "error": error})
+            for _, raw, attempts in retry:
+                pipe.xadd(self.stream_key, {"e": raw, "a": attempts})
+            pipe.xack(self.stream_key, self.group, *ids)
+            pipe.xdel(self.stream_key, *ids)
+            await pipe.execute()
+        else:
+            # 进程内模式无法依靠 Stream 重放，放回队列稍后重试
+            for _, raw, attempts in retry:
+                try:
+                    self._queue.put_nowait((raw, attempts))
+                except asyncio.QueueFull:
+                    dead.append((raw, "message writer queue full"))
+
+        for raw, error in dead:
+            logger.error(f"Giving up on queued write after {self.max_attempts} attempts ({error}): {raw}")
+        if dead:
+            self.dead_letters += len(dead)
+            WRITE_BEHIND_DEAD_LETTERS.labels(self.durability).inc(len(dead))
+        if retry:
+            await asyncio.sleep(self.flush_interval)
+
+    async def flush(self, raw_entries: List[Any]) -> None:
+        """把一批写操作合并为批量语句并在一个事务中提交"""
+        inserts: List[Dict[str, Any]] = []
+        updates: Dict[str, Dict[str, Any]] = {}
+        touches: Dict[str, Dict[str, Any]] = {}
+        for raw in raw_entries:
+            op, values = _decode(raw)
+            if op == OP_INSERT_MESSAGE:
+                inserts.append(values)
+            elif op == OP_UPDATE_MESSAGE:
+                updates.setdefault(values["message_id"], {}).update(values)
+            elif op == OP_TOUCH_CONVERSATION:
+                current = touches.get(values["conversation_id"])
+                if current is None or values["update_time"] >= current["update_time"]:
+                    touches[values["conversation_id"]] = values
+
+        async with AsyncSessionLocal() as db:
+            if inserts:
+                # 重放时可能重复插入，忽略主键冲突
+                stmt = insert(Message).prefix_with("IGNORE", dialect="mysql").prefix_with("OR IGNORE", dialect="sqlite")
+                # executemany 要求每行的列相同，按列集合分组
+                groups: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+                for row in inserts:
+                    groups.setdefault(tuple(sorted(row)), []).append(row)
+                for rows in groups.values():
+                    await db.execute(stmt, rows)
+            if updates:
+                await db.execute(update(Message), list(updates.values()))
+            if touches:
+                await db.execute(update(Conversation), list(touches.values()))
+            await db.commit()
+
+        self.flushed_batches += 1
+        self.flushed_entries += len(raw_entries)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": settings.WRITE_BEHIND_ENABLED,
+            "durability": self.durability,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "flushed_batches": self.flushed_batches,
+            "flushed_entries": self.flushed_entries,
+            "failed_batches": self.failed_batches,
+            "dead_letters": self.dead_letters,
+        }
+
+
+message_writer = MessageWriter(
+    batch_size=settings.WRITE_BEHIND_BATCH_SIZE,
+    flush_interval=settings.WRITE_BEHIND_FLUSH_INTERVAL,
+    durability=settings.WRITE_BEHIND_DURABILITY,
+    stream_key=settings.WRITE_BEHIND_STREAM,
+    claim_idle=settings.WRITE_BEHIND_CLAIM_IDLE,
+    max_attempts=settings.WRITE_BEHIND_MAX_ATTEMPTS,
+    dead_letter_stream=settings.WRITE_BEHIND_DEAD_LETTER_STREAM,
+    stop_timeout=settings.WRITE_BEHIND_STOP_TIMEOUT
+)
@@ -0,0 +1,131 @@
+from concurrent.futures import ThreadPoolExecutor
+from passlib.context import CryptContext
+from core.config import settings
+from services.llm_scheduler import AdmissionRejected
+from typing import Any, Callable, Dict, Optional, Tuple
+import asyncio
+import logging
+import math
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def build_crypt_context(rounds: int) -> CryptContext:
+    """成本不等于 rounds 的已有哈希会被标记为需要重新计算"""
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__default_rounds=rounds,
+        bcrypt__min_rounds=rounds,
+        bcrypt__max_rounds=rounds
+    )
+
+
+class PasswordHasher:
+    """在独立线程池中执行 bcrypt 哈希和校验
+
+    bcrypt 每次调用要消耗数百毫秒 CPU，直接在 async 处理函数中调用会阻塞事件循环，
+    导致同一 worker 上的流式对话全部卡住。这里把计算交给有界线程池，超出线程数的
+    请求在有界队列中等待，队列已满时立即拒绝。
+    """
+
+    def __init__(self, rounds: int, max_workers: int = 2, max_queue: int = 32):
+        self.context = build_crypt_context(rounds)
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.active = 0
+        self.waiting = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.service_time_avg = 0.0
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_workers)
+        return self._semaphore
+
+    def _retry_after(self) -> int:
+        estimate = (self.service_time_avg or 0.25) * (self.waiting + 1) / self.max_workers
+        return max(1, math.ceil(estimate))
+
+    async def _run(self, func: Callable[..., Any], *args: Any) -> Any:
+        semaphore = self._get_semaphore()
+        if semaphore.locked() and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise AdmissionRejected("Too many concurrent authentication requests", 503, self._retry_after())
+
+        enqueued = time.monotonic()
+        self.waiting += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        waited = time.monotonic() - enqueued
+        self.wait_time_total += waited
+        self.wait_time_max = max(self.wait_time_max, waited)
+
+        self.active += 1
+        started = time.monotonic()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), func, *args)
+        finally:
+            elapsed = time.monotonic() - started
+            self.service_time_avg = elapsed if not self.service_time_avg \
+                else 0.9 * self.service_time_avg + 0.1 * elapsed
+            self.active -= 1
+            self.completed += 1
+            semaphore.release()
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run(self.context.verify, password, hashed_password)
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """校验密码；哈希成本与当前配置不同时一并返回新的哈希"""
+        verified, new_hash = await self._run(self.context.verify_and_update, password, hashed_password)
+        if new_hash is not None:
+            self.rehashed += 1
+        return verified, new_hash
+
+    async def dummy_verify(self) -> None:
+        """用户不存在时也消耗同样的时间，避免通过响应时间探测邮箱"""
+        await self._run(self.context.dummy_verify)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rounds": self.context.handler("bcrypt").default_rounds,
+            "max_workers": self.max_workers,
+            "active": self.active,
+            "queue_depth": self.waiting,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+            "wait_time_avg_ms": round(self.wait_time_total / self.completed * 1000, 2) if self.completed else 0.0,
+            "wait_time_max_ms": round(self.wait_time_max * 1000, 2),
+            "service_time_avg_ms": round(self.service_time_avg * 1000, 2),
+        }
+
+
+password_hasher = PasswordHasher(
+    rounds=settings.BCRYPT_ROUNDS,
+    max_workers=settings.PASSWORD_HASH_WORKERS,
+    max_queue=settings.PASSWORD_HASH_MAX_QUEUE
+)
@@ -0,0 +1,256 @@
+from contextlib import asynccontextmanager
+from core.config import settings
+from core.metrics import RATE_LIMIT_REJECTIONS
+from core.redis import get_redis
+from services.llm_scheduler import AdmissionRejected
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+import anyio
+import asyncio
+import logging
+import math
+import time
+
+logger = logging.getLogger(__name__)
+
+KIND_REQUESTS = "requests"
+KIND_TOKENS = "tokens"
+
+_MINUTE = 60
+_DAY = 86400
+
+# 原子地检查并扣减多个令牌桶：任何一个桶余量不足时都不扣减
+# KEYS：桶的键；ARGV：每个桶依次为容量、补满所需毫秒数、本次扣减量、至少需要的余量（0 表示不检查）
+# 返回：{需要等待的毫秒数（0 表示通过）, 各桶扣减后的余量...}
+_TOKEN_BUCKET_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local levels = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local base = (i - 1) * 4
+    local capacity = tonumber(ARGV[base + 1])
+    local period = tonumber(ARGV[base + 2])
+    local need = tonumber(ARGV[base + 4])
+    local state = redis.call('HMGET', key, 'level', 'ts')
+    local level = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    level = math.min(capacity, level + math.max(now - ts, 0) * capacity / period)
+    if need > 0 and level < need then
+        wait = math.max(wait, math.ceil((need - level) * period / capacity))
+    end
+    levels[i] = level
+end
+local result = {wait}
+for i, key in ipairs(KEYS) do
+    local base = (i - 1) * 4
+    local level = levels[i]
+    if wait == 0 then
+        local capacity = tonumber(ARGV[base + 1])
+        local period = tonumber(ARGV[base + 2])
+        level = level - tonumber(ARGV[base + 3])
+        redis.call('HSET', key, 'level', tostring(level), 'ts', now)
+        redis.call('PEXPIRE', key, math.max(math.ceil((capacity - level) * period / capacity), 1000))
+    end
+    result[i + 1] = math.floor(level)
+end
+return result
+"""
+
+
+class Bucket:
+    """一个令牌桶：capacity 个令牌在 period 秒内匀速补满"""
+
+    def __init__(self, key: str, kind: str, capacity: int, period: float):
+        self.key = key
+        self.kind = kind
+        self.capacity = capacity
+        self.period = period
+
+    def reset_after(self, remaining: int) -> float:
+        """余量补满所需的秒数"""
+        return max(self.capacity - remaining, 0) * self.period / self.capacity
+
+
+class RateLimitStatus:
+    """一次检查后各类限额中最紧的一个桶的余量，用于生成响应头"""
+
+    def __init__(self, buckets: Sequence[Bucket] = (), remaining: Sequence[int] = (), retry_after: float = 0):
+        self.retry_after = retry_after
+        self.tightest: Dict[str, Tuple[Bucket, int]] = {}
+        for bucket, left in zip(buckets, remaining):
+            current = self.tightest.get(bucket.kind)
+            if current is None or left / bucket.capacity < current[1] / current[0].capacity:
+                self.tightest[bucket.kind] = (bucket, left)
+
+    def headers(self) -> Dict[str, str]:
+        """X-RateLimit-{Limit,Remaining,Reset}-{Requests,Tokens}，拒绝时加上 Retry-After"""
+        headers = {}
+        for kind, (bucket, left) in self.tightest.items():
+            suffix = kind.capitalize()
+            headers[f"X-RateLimit-Limit-{suffix}"] = str(bucket.capacity)
+            headers[f"X-RateLimit-Remaining-{suffix}"] = str(max(left, 0))
+            headers[f"X-RateLimit-Reset-{suffix}"] = str(math.ceil(bucket.reset_after(left)))
+        if self.retry_after:
+            headers["Retry-After"] = str(max(1, math.ceil(self.retry_after)))
+        return headers
+
+    def apply(self, headers: Any) -> None:
+        headers.update(self.headers())
+
+
+class RateLimited(AdmissionRejected):
+    """超出请求频率或每日 token 限额"""
+
+    def __init__(self, status: RateLimitStatus):
+        kinds = " and ".join(sorted(status.tightest))
+        super().__init__(f"Rate limit exceeded ({kinds})", 429, max(1, math.ceil(status.retry_after)))
+        self.status = status
+
+
+class RedisBucketStore:
+    """令牌桶保存在 Redis 中，所有 worker 和节点共享限额"""
+
+    def __init__(self):
+        self._script = None
+
+    async def consume(self, buckets: Sequence[Bucket], costs: Sequence[int], needs: Sequence[int]) -> Tuple[float, List[int]]:
+        redis = get_redis()
+        if self._script is None or self._script.registered_client is not redis:
+            # 首次调用或 Redis 客户端重建后注册脚本，之后以 EVALSHA 执行
+            self._script = redis.register_script(_TOKEN_BUCKET_SCRIPT)
+        args: List[Any] = []
+        for bucket, cost, need in zip(buckets, costs, needs):
+            args.extend((bucket.capacity, int(bucket.period * 1000), cost, need))
+        result = await self._script(keys=[bucket.key for bucket in buckets], args=args)
+        return result[0] / 1000, [int(level) for level in result[1:]]
+
+
+class MemoryBucketStore:
+    """进程内令牌桶，用于测试和单进程部署，算法与 Lua 脚本相同"""
+
+    def __init__(self):
+        self._levels: Dict[str, Tuple[float, float]] = {}
+        self._lock = asyncio.Lock()
+
+    async def consume(self, buckets: Sequence[Bucket], costs: Sequence[int], needs: Sequence[int]) -> Tuple[float, List[int]]:
+        async with self._lock:
+            now = time.monotonic()
+            levels = []
+            wait = 0.0
+            for bucket, need in zip(buckets, needs):
+                level, ts = self._levels.get(bucket.key, (bucket.capacity, now))
+                level = min(bucket.capacity, level + (now - ts) * bucket.capacity / bucket.period)
+                if need > 0 and level < need:
+                    wait = max(wait, (need - level) * bucket.period / bucket.capacity)
+                levels.append(level)
+            if not wait:
+                for index, (bucket, cost) in enumerate(zip(buckets, costs)):
+                    levels[index] -= cost
+                    self._levels[bucket.key] = (levels[index], now)
+            return wait, [math.floor(level) for level in levels]
+
+
+class _Usage:
+    tokens = 0
+
+
+class RateLimiter:
+    """按用户限制请求频率和每日生成的 token 数
+
+    每个用户有两个令牌桶：每分钟请求数和每天生成的 token 数；还可以为用户在单个模型上的
+    用量单独设置限额（llm_id 维度）。请求在开始时扣减 1 个请求令牌，并要求 token 桶还有余量；
+    生成的 token 数在生成结束（包括被取消）后才知道，届时再从 token 桶扣减，余量可以为负，
+    此后的请求要等到补回为正才能通过。限额为 0 表示不限制。
+    """
+
+    def __init__(self, store: Any):
+        self.store = store
+
+    @staticmethod
+    def _model_limits(llm_id: int) -> Tuple[int, int]:
+        override = settings.RATE_LIMIT_MODEL_OVERRIDES.get(llm_id, {})
+        return (
+            override.get("requests_per_minute", settings.RATE_LIMIT_MODEL_REQUESTS_PER_MINUTE),
+            override.get("tokens_per_day", settings.RATE_LIMIT_MODEL_TOKENS_PER_DAY),
+        )
+
+    def buckets(self, user_key: str, llm_id: Optional[int] = None) -> List[Bucket]:
+        """llm_id 为空时返回用户的总限额，否则返回该用户在该模型上的限额"""
+        if llm_id is None:
+            prefix = f"ratelimit:{user_key}"
+            requests, tokens = settings.RATE_LIMIT_REQUESTS_PER_MINUTE, settings.RATE_LIMIT_TOKENS_PER_DAY
+        else:
+            prefix = f"ratelimit:{user_key}:llm:{llm_id}"
+            requests, tokens = self._model_limits(llm_id)
+        buckets = []
+        if requests > 0:
+            buckets.append(Bucket(f"{prefix}:requests", KIND_REQUESTS, requests, _MINUTE))
+        if tokens > 0:
+            buckets.append(Bucket(f"{prefix}:tokens", KIND_TOKENS, tokens, _DAY))
+        return buckets
+
+    async def acquire(self, user_key: str, llm_id: Optional[int] = None) -> RateLimitStatus:
+        """检查并扣减一次请求，超出限额时抛出 RateLimited
+
+        给出 llm_id 时还会检查（不扣减）用户的总 token 限额，使批量和后台任务中的
+        每次生成同样受每日限额约束。Redis 不可用时放行，限流故障不影响对话。
+        """
+        buckets = []
+        if settings.RATE_LIMIT_ENABLED:
+            buckets = self.buckets(user_key, llm_id)
+            if llm_id is not None:
+                buckets = [bucket for bucket in self.buckets(user_key) if bucket.kind == KIND_TOKENS] + buckets
+        if not buckets:
+            return RateLimitStatus()
+        costs = [1 if bucket.kind == KIND_REQUESTS else 0 for bucket in buckets]
+        try:
+            wait, remaining = await self.store.consume(buckets, costs, [1] * len(buckets))
+        except Exception as e:
+            logger.warning(f"Rate limiter unavailable, allowing request: {str(e)}")
+            return RateLimitStatus()
+        status = RateLimitStatus(buckets, remaining, wait)
+        if wait:
+            RATE_LIMIT_REJECTIONS.labels("user" if llm_id is None else "model").inc()
+            # 只报告导致拒绝的桶
+            status.tightest = {
+                kind: (bucket, left) for kind, (bucket, left) in status.tightest.items() if left < 1
+            } or status.tightest
+            raise RateLimited(status)
+        return status
+
+    async def charge(self, user_key: str, llm_id: int, tokens: int) -> None:
+        """从用户的总 token 限额和该模型的 token 限额中扣减实际生成的 token 数"""
+        if not settings.RATE_LIMIT_ENABLED or tokens <= 0:
+            return
+        buckets = [
+            bucket for bucket in self.buckets(user_key) + self.buckets(user_key, llm_id)
+            if bucket.kind == KIND_TOKENS
+        ]
+        if not buckets:
+            return
+        try:
+            await self.store.consume(buckets, [tokens] * len(buckets), [0] * len(buckets))
+        except Exception as e:
+            logger.warning(f"Failed to charge {tokens} tokens to {user_key}: {str(e)}")
+
+    @asynccontextmanager
+    async def quota(self, user_key: str, llm_id: int) -> AsyncIterator[_Usage]:
+        """检查用户在该模型上的限额，退出时扣减调用方记录在 usage.tokens 中的生成量"""
+        await self.acquire(user_key, llm_id)
+        usage = _Usage()
+        try:
+            yield usage
+        finally:
+            if usage.tokens:
+                # 请求被取消时已生成的部分同样计入
+                with anyio.CancelScope(shield=True):
+                    await self.charge(user_key, llm_id, usage.tokens)
+
+
+def create_bucket_store() -> Any:
+    if settings.RATE_LIMIT_BACKEND == "memory":
+        return MemoryBucketStore()
+    return RedisBucketStore()
+
+
+rate_limiter = RateLimiter(create_bucket_store())
@@ -0,0 +1,125 @@
+from models.ai_models import AiLLMConfiguration
+from core.config import settings
+from core.redis import get_redis
+from services.llm_registry import build_model_params
+from utils.cache import TTLCache
+from typing import Any, Awaitable, Callable, Dict
+import asyncio
+import hashlib
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class _LeaderCancelled(Exception):
+    """发起生成的请求被取消，等待同一结果的请求需要自行重试"""
+
+
+class ResponseCache:
+    """确定性生成结果的两级缓存
+
+    仅缓存不采样（temperature 为 0）的模型输出：先查进程内 LRU，再查 Redis，
+    都未命中时才调用模型。相同键的并发请求合并为一次模型调用（single-flight）。
+    """
+
+    # Redis 出错后暂停使用远端缓存的时间（秒），避免每个请求都等待连接超时
+    remote_backoff = 30
+
+    def __init__(self, maxsize: int, ttl: int, prefix: str = "llm-resp:"):
+        self.ttl = ttl
+        self.prefix = prefix
+        self._remote_disabled_until = 0.0
+        self._local = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.redis_hits = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def is_cacheable(model_config: AiLLMConfiguration) -> bool:
+        return build_model_params(model_config).get("temperature") == 0
+
+    @staticmethod
+    def make_key(model_config: AiLLMConfiguration, prompt: str) -> str:
+        """模型、生成参数和完整提示词的摘要"""
+        payload = json.dumps(
+            {"model": model_config.llm_en_name, "params": build_model_params(model_config), "prompt": prompt},
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    async def get_or_generate(self, key: str, generate: Callable[[], Awaitable[str]]) -> str:
+        value = self._local.get(key)
+        if value is not None:
+            return value
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(inflight)
+            except _LeaderCancelled:
+                return await self.get_or_generate(key, generate)
+
+        future = asyncio.get_running_loop().create_future()
+        # 没有等待者时也标记异常已读取，避免 "exception was never retrieved" 警告
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._inflight[key] = future
+        try:
+            value = await self._get_remote(key)
+            if value is None:
+                value = await generate()
+                await self._set_remote(key, value)
+            self._local.set(key, value)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.set_exception(_LeaderCancelled())
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    def _remote_available(self) -> bool:
+        return time.monotonic() >= self._remote_disabled_until
+
+    def _remote_failed(self, e: Exception) -> None:
+        logger.warning(f"Response cache Redis error, using local cache only for {self.remote_backoff}s: {str(e)}")
+        self._remote_disabled_until = time.monotonic() + self.remote_backoff
+
+    async def _get_remote(self, key: str) -> Any:
+        if not self._remote_available():
+            return None
+        try:
+            raw = await get_redis().get(self.prefix + key)
+        except Exception as e:
+            self._remote_failed(e)
+            return None
+        if raw is None:
+            return None
+        self.redis_hits += 1
+        return raw.decode("utf-8")
+
+    async def _set_remote(self, key: str, value: str) -> None:
+        if not self._remote_available():
+            return
+        try:
+            await get_redis().set(self.prefix + key, value.encode("utf-8"), ex=self.ttl)
+        except Exception as e:
+            self._remote_failed(e)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self._local.stats()
+        stats.update({"redis_hits": self.redis_hits, "coalesced": self.coalesced, "inflight": len(self._inflight)})
+        return stats
+
+
+response_cache = ResponseCache(
+    maxsize=settings.RESPONSE_CACHE_MAXSIZE,
+    ttl=settings.RESPONSE_CACHE_TTL
+)
@@ -0,0 +1,147 @@
+from sqlalchemy import and_, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from models.base import AsyncSessionLocal
+from models.chat import Conversation, Message
+from core.config import settings
+from services.embedding_service import EmbeddingService, content_hash, embedding_service
+from services.vector_store import VectorRecord, VectorStore, create_vector_store
+from typing import Any, Dict, List, Optional
+from datetime import datetime, timedelta
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def message_text(question: str, answer: Optional[str]) -> str:
+    """用于计算向量的问答文本"""
+    return f"Q: {question}\nA: {answer or ''}"
+
+
+class SemanticIndexer:
+    """把消息问答对批量写入向量索引
+
+    按 (update_time, message_id) 键集分页读取消息，内容摘要与索引中一致的消息直接跳过，
+    其余消息批量计算向量后写入。后台任务按 update_time 水位增量索引新消息。
+    """
+
+    def __init__(self, store: Optional[VectorStore], embeddings: EmbeddingService, batch_size: int = 64):
+        self._store = store
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.watermark: Optional[datetime] = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def store(self) -> VectorStore:
+        # 第一次使用时才创建，避免启动时加载 numpy/pymilvus
+        if self._store is None:
+            self._store = create_vector_store()
+        return self._store
+
+    async def index(self, db: AsyncSession, user_id: Optional[str] = None, since: Optional[datetime] = None) -> Dict[str, Any]:
+        """索引（某个用户或全部用户）since 之后更新的消息，返回统计"""
+        stats = {"scanned": 0, "indexed": 0, "skipped": 0}
+        cursor = None
+        latest = since
+        async with self._lock:
+            while True:
+                stmt = (
+                    select(
+                        Message.message_id, Message.conversation_id, Message.question,
+                        Message.answer, Message.update_time, Conversation.user_id
+                    )
+                    .join(Conversation, Conversation.conversation_id == Message.conversation_id)
+                    .where(Message.answer.isnot(None))
+                    .order_by(Message.update_time, Message.message_id)
+                    .limit(self.batch_size)
+                )
+                if user_id is not None:
+                    stmt = stmt.where(Conversation.user_id == user_id)
+                if since is not None:
+                    stmt = stmt.where(Message.update_time >= since)
+                if cursor is not None:
+                    stmt = stmt.where(or_(
+                        Message.update_time > cursor[0],
+                        and_(Message.update_time == cursor[0], Message.message_id > cursor[1])
+                    ))
+                rows = (await db.execute(stmt)).all()
+                if not rows:
+                    break
+                cursor = (rows[-1].update_time, rows[-1].message_id)
+                latest = rows[-1].update_time if latest is None else max(latest, rows[-1].update_time)
+                await self._index_rows(rows, stats)
+            await self.store.save()
+        if user_id is None and latest is not None:
+            self.watermark = latest
+        return stats
+
+    async def _index_rows(self, rows: List[Any], stats: Dict[str, int]) -> None:
+        texts = [message_text(row.question, row.answer) for row in rows]
+        hashes = [content_hash(text) for text in texts]
+        indexed = await self.store.get_hashes([row.message_id for row in rows])
+        changed = [i for i, row in enumerate(rows) if indexed.get(row.message_id) != hashes[i]]
+        stats["scanned"] += len(rows)
+        stats["skipped"] += len(rows) - len(changed)
+        if not changed:
+            return
+        vectors = await self.embeddings.embed([texts[i] for i in changed])
+        records = [
+            VectorRecord(rows[i].message_id, rows[i].user_id, rows[i].conversation_id, hashes[i])
+            for i in changed
+        ]
+        await self.store.upsert(records, vectors)
+        stats["indexed"] += len(changed)
+
+    async def run_forever(self, interval: float) -> None:
+        """后台增量索引，在应用生命周期内运行"""
+        while True:
+            try:
+                # 回退一段时间，覆盖写后批量提交等延迟落库的消息
+                since = self.watermark - timedelta(seconds=interval) if self.watermark else None
+                async with AsyncSessionLocal() as db:
+                    stats = await self.index(db, since=since)
+                if stats["indexed"]:
+                    logger.info(f"Semantic index updated: {stats}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Semantic indexing failed: {str(e)}")
+            await asyncio.sleep(interval)
+
+
+class SemanticSearchService:
+    """在用户自己的历史对话中做语义检索"""
+
+    def __init__(self, db: AsyncSession, indexer: Optional[SemanticIndexer] = None):
+        self.db = db
+        self.indexer = indexer or semantic_indexer
+
+    async def search(self, user_id: str, query: str, top_k: int = 10) -> List[Dict[str, Any]]:
+        vector = await self.indexer.embeddings.embed_query(query)
+        hits = await self.indexer.store.search(vector, top_k, user_id=user_id)
+        if not hits:
+            return []
+
+        scores = dict(hits)
+        result = await self.db.execute(
+            select(Message)
+            .join(Conversation, Conversation.conversation_id == Message.conversation_id)
+            .where(Message.message_id.in_(list(scores)), Conversation.user_id == user_id)
+        )
+        messages = {message.message_id: message for message in result.scalars().all()}
+        # 已删除的消息不返回
+        return [
+            {"score": round(score, 4), "message": messages[message_id]}
+            for message_id, score in hits if message_id in messages
+        ]
+
+    async def reindex(self, user_id: str) -> Dict[str, Any]:
+        return await self.indexer.index(self.db, user_id=user_id)
+
+
+semantic_indexer = SemanticIndexer(
+    store=None,
+    embeddings=embedding_service,
+    batch_size=settings.EMBEDDING_BATCH_SIZE
+)
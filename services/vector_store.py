@@ -0,0 +1,320 @@
+from core.config import settings
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import asyncio
+import logging
+import math
+import os
+from utils.lazy import lazy_import
+
+np = lazy_import("numpy")
+
+logger = logging.getLogger(__name__)
+
+
+class VectorRecord:
+    __slots__ = ("id", "user_id", "conversation_id", "content_hash")
+
+    def __init__(self, id: str, user_id: str, conversation_id: str, content_hash: str):
+        self.id = id
+        self.user_id = user_id
+        self.conversation_id = conversation_id
+        self.content_hash = content_hash
+
+
+class VectorStore:
+    """消息向量存储接口，向量已归一化，得分为余弦相似度"""
+
+    async def upsert(self, records: Sequence[VectorRecord], vectors: "np.ndarray") -> None:
+        raise NotImplementedError
+
+    async def delete(self, ids: Sequence[str]) -> None:
+        raise NotImplementedError
+
+    async def get_hashes(self, ids: Sequence[str]) -> Dict[str, str]:
+        """已索引消息的内容摘要，用于跳过未变化的消息"""
+        raise NotImplementedError
+
+    async def search(self, vector: "np.ndarray", top_k: int, user_id: Optional[str] = None) -> List[Tuple[str, float]]:
+        raise NotImplementedError
+
+    async def save(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+
+class NumpyVectorStore(VectorStore):
+    """进程内 NumPy 向量存储
+
+    数据量小于 ivf_min_size 时对（按用户过滤后的）全部向量做矩阵乘法暴力检索；
+    超过后用 k-means 训练 IVF 倒排索引，只计算最近 nprobe 个聚类中的向量。
+    path 非空时索引保存到 .npz 文件，重启后加载。
+    """
+
+    def __init__(self, path: str = "", ivf_min_size: int = 20000, nprobe: int = 8):
+        self.path = path
+        self.ivf_min_size = ivf_min_size
+        self.nprobe = nprobe
+        self.dim: Optional[int] = None
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._size = 0
+        self._ids: List[str] = []
+        self._users: List[str] = []
+        self._conversations: List[str] = []
+        self._hashes: List[str] = []
+        self._positions: Dict[str, int] = {}
+        self._user_array: Optional["np.ndarray"] = None
+        # IVF 索引
+        self._centroids: Optional["np.ndarray"] = None
+        self._assignments = np.zeros(0, dtype=np.int32)
+        self._trained_size = 0
+        if path and os.path.exists(path):
+            self._load(path)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _ensure_capacity(self, extra: int) -> None:
+        needed = self._size + extra
+        if needed <= self._vectors.shape[0]:
+            return
+        capacity = max(needed, self._vectors.shape[0] * 2, 1024)
+        vectors = np.zeros((capacity, self.dim), dtype=np.float32)
+        vectors[:self._size] = self._vectors[:self._size]
+        self._vectors = vectors
+        assignments = np.zeros(capacity, dtype=np.int32)
+        assignments[:self._size] = self._assignments[:self._size]
+        self._assignments = assignments
+
+    async def upsert(self, records: Sequence[VectorRecord], vectors: "np.ndarray") -> None:
+        if not len(records):
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            self._vectors = np.zeros((0, self.dim), dtype=np.float32)
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match index dimension {self.dim}")
+
+        self._ensure_capacity(len(records))
+        for record, vector in zip(records, vectors):
+            position = self._positions.get(record.id)
+            if position is None:
+                position = self._size
+                self._size += 1
+                self._positions[record.id] = position
+                self._ids.append(record.id)
+                self._users.append(record.user_id)
+                self._conversations.append(record.conversation_id)
+                self._hashes.append(record.content_hash)
+            else:
+                self._users[position] = record.user_id
+                self._conversations[position] = record.conversation_id
+                self._hashes[position] = record.content_hash
+            self._vectors[position] = vector
+            if self._centroids is not None:
+                self._assignments[position] = int(np.argmax(self._centroids @ vector))
+        self._user_array = None
+
+        # 数据量翻倍后重新训练聚类中心
+        if self._size >= self.ivf_min_size and self._size >= 2 * self._trained_size:
+            await asyncio.to_thread(self._train)
+
+    async def delete(self, ids: Sequence[str]) -> None:
+        for id in ids:
+            position = self._positions.pop(id, None)
+            if position is None:
+                continue
+            last = self._size - 1
+            if position != last:
+                # 用最后一行填补空位
+                self._vectors[position] = self._vectors[last]
+                self._assignments[position] = self._assignments[last]
+                for column in (self._ids, self._users, self._conversations, self._hashes):
+                    column[position] = column[last]
+                self._positions[self._ids[position]] = position
+            for column in (self._ids, self._users, self._conversations, self._hashes):
+                column.pop()
+            self._size -= 1
+        self._user_array = None
+
+    async def get_hashes(self, ids: Sequence[str]) -> Dict[str, str]:
+        return {id: self._hashes[self._positions[id]] for id in ids if id in self._positions}
+
+    def _train(self, iterations: int = 10) -> None:
+        """在全部向量上训练球面 k-means 聚类中心"""
+        vectors = self._vectors[:self._size]
+        nlist = max(1, int(math.sqrt(self._size)))
+        rng = np.random.default_rng(0)
+        centroids = vectors[rng.choice(self._size, nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = np.argmax(vectors @ centroids.T, axis=1)
+            for k in range(nlist):
+                members = vectors[assignments == k]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[k] = centroid / (np.linalg.norm(centroid) or 1.0)
+        self._centroids = centroids
+        self._assignments[:self._size] = np.argmax(vectors @ centroids.T, axis=1)
+        self._trained_size = self._size
+        logger.info(f"Trained IVF index with {nlist} lists over {self._size} vectors")
+
+    def _candidates(self, vector: "np.ndarray", user_id: Optional[str]) -> "np.ndarray":
+        mask = np.ones(self._size, dtype=bool)
+        if user_id is not None:
+            if self._user_array is None:
+                self._user_array = np.array(self._users, dtype=object)
+            mask &= self._user_array == user_id
+        if self._centroids is not None:
+            probe = np.argsort(self._centroids @ vector)[::-1][:self.nprobe]
+            ivf_mask = mask & np.isin(self._assignments[:self._size], probe)
+            # 用户的数据集中在少数聚类之外时退回暴力检索
+            if ivf_mask.any():
+                mask = ivf_mask
+        return np.nonzero(mask)[0]
+
+    async def search(self, vector: "np.ndarray", top_k: int, user_id: Optional[str] = None) -> List[Tuple[str, float]]:
+        if not self._size:
+            return []
+        vector = np.asarray(vector, dtype=np.float32)
+        rows = self._candidates(vector, user_id)
+        if not len(rows):
+            return []
+        scores = self._vectors[rows] @ vector
+        k = min(top_k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self._ids[rows[i]], float(scores[i])) for i in top]
+
+    async def save(self) -> None:
+        if self.path and self._size:
+            await asyncio.to_thread(self._save, self.path)
+
+    def _save(self, path: str) -> None:
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(
+            tmp_path,
+            vectors=self._vectors[:self._size],
+            ids=np.array(self._ids, dtype=object),
+            users=np.array(self._users, dtype=object),
+            conversations=np.array(self._conversations, dtype=object),
+            hashes=np.array(self._hashes, dtype=object),
+        )
+        os.replace(tmp_path, path)
+
+    def _load(self, path: str) -> None:
+        data = np.load(path, allow_pickle=True)
+        self._vectors = data["vectors"].astype(np.float32)
+        self._size, self.dim = self._vectors.shape
+        self._assignments = np.zeros(self._size, dtype=np.int32)
+        self._ids = list(data["ids"])
+        self._users = list(data["users"])
+        self._conversations = list(data["conversations"])
+        self._hashes = list(data["hashes"])
+        self._positions = {id: i for i, id in enumerate(self._ids)}
+        if self._size >= self.ivf_min_size:
+            self._train()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "numpy",
+            "size": self._size,
+            "dim": self.dim,
+            "ivf_lists": 0 if self._centroids is None else len(self._centroids),
+        }
+
+
+class MilvusVectorStore(VectorStore):
+    """Milvus 向量存储，集合在第一次写入时按向量维度创建"""
+
+    def __init__(self, host: str, port: int, collection: str, nprobe: int = 8):
+        from pymilvus import MilvusClient
+
+        self.collection = collection
+        self.nprobe = nprobe
+        self.client = MilvusClient(uri=f"http://{host}:{port}")
+        self._ready = self.client.has_collection(collection)
+        if self._ready:
+            self.client.load_collection(collection)
+
+    def _create_collection(self, dim: int) -> None:
+        from pymilvus import DataType, MilvusClient
+
+        schema = MilvusClient.create_schema(auto_id=False)
+        schema.add_field("id", DataType.VARCHAR, is_primary=True, max_length=64)
+        schema.add_field("user_id", DataType.VARCHAR, max_length=64)
+        schema.add_field("conversation_id", DataType.VARCHAR, max_length=64)
+        schema.add_field("content_hash", DataType.VARCHAR, max_length=64)
+        schema.add_field("embedding", DataType.FLOAT_VECTOR, dim=dim)
+        index_params = self.client.prepare_index_params()
+        index_params.add_index("embedding", index_type="IVF_FLAT", metric_type="IP", params={"nlist": 1024})
+        index_params.add_index("user_id", index_type="INVERTED")
+        self.client.create_collection(self.collection, schema=schema, index_params=index_params)
+        self.client.load_collection(self.collection)
+        self._ready = True
+
+    @staticmethod
+    def _quote(value: str) -> str:
+        return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+    async def upsert(self, records: Sequence[VectorRecord], vectors: "np.ndarray") -> None:
+        if not len(records):
+            return
+        if not self._ready:
+            await asyncio.to_thread(self._create_collection, int(np.asarray(vectors).shape[1]))
+        data = [
+            {
+                "id": record.id,
+                "user_id": record.user_id,
+                "conversation_id": record.conversation_id,
+                "content_hash": record.content_hash,
+                "embedding": vector.tolist(),
+            }
+            for record, vector in zip(records, np.asarray(vectors, dtype=np.float32))
+        ]
+        await asyncio.to_thread(self.client.upsert, self.collection, data)
+
+    async def delete(self, ids: Sequence[str]) -> None:
+        if self._ready and ids:
+            await asyncio.to_thread(self.client.delete, self.collection, ids=list(ids))
+
+    async def get_hashes(self, ids: Sequence[str]) -> Dict[str, str]:
+        if not self._ready or not ids:
+            return {}
+        expr = f"id in [{', '.join(self._quote(id) for id in ids)}]"
+        rows = await asyncio.to_thread(
+            self.client.query, self.collection, filter=expr, output_fields=["id", "content_hash"]
+        )
+        return {row["id"]: row["content_hash"] for row in rows}
+
+    async def search(self, vector: "np.ndarray", top_k: int, user_id: Optional[str] = None) -> List[Tuple[str, float]]:
+        if not self._ready:
+            return []
+        results = await asyncio.to_thread(
+            self.client.search,
+            self.collection,
+            data=[np.asarray(vector, dtype=np.float32).tolist()],
+            filter=f"user_id == {self._quote(user_id)}" if user_id is not None else "",
+            limit=top_k,
+            search_params={"metric_type": "IP", "params": {"nprobe": self.nprobe}},
+        )
+        return [(hit["id"], float(hit["distance"])) for hit in results[0]]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "milvus", "collection": self.collection, "ready": self._ready}
+
+
+def create_vector_store() -> VectorStore:
+    if settings.VECTOR_STORE_BACKEND == "milvus":
+        return MilvusVectorStore(
+            settings.MILVUS_HOST,
+            settings.MILVUS_PORT,
+            settings.MILVUS_COLLECTION,
+            nprobe=settings.VECTOR_IVF_NPROBE
+        )
+    return NumpyVectorStore(
+        path=settings.VECTOR_STORE_PATH,
+        ivf_min_size=settings.VECTOR_IVF_MIN_SIZE,
+        nprobe=settings.VECTOR_IVF_NPROBE
+    )
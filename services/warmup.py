@@ -0,0 +1,118 @@
+from sqlalchemy import text
+from models.ai_models import AiLLMConfiguration
+from models.base import AsyncSessionLocal, async_engine
+from core.config import settings
+from services.ai_service import AiService
+from services.llm_router import KIND_OLLAMA, llm_router
+from typing import Any, Dict, List
+import asyncio
+import importlib
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+async def warm_db_pool(connections: int) -> int:
+    """同时建立 connections 个数据库连接后放回连接池，返回成功建立的数量"""
+    async def open_connection():
+        conn = await async_engine.connect()
+        try:
+            await conn.execute(text("SELECT 1"))
+        except Exception:
+            await conn.close()
+            raise
+        return conn
+
+    results = await asyncio.gather(*(open_connection() for _ in range(connections)), return_exceptions=True)
+    opened = 0
+    for result in results:
+        if isinstance(result, BaseException):
+            logger.warning(f"Warm-up connection failed: {str(result)}")
+            continue
+        opened += 1
+        await result.close()
+    return opened
+
+
+async def warm_config_cache() -> List[AiLLMConfiguration]:
+    """加载启用的模型和快捷助手配置到配置缓存，返回启用的模型"""
+    async with AsyncSessionLocal() as db:
+        service = AiService(db)
+        models = await service.get_llm_configurations(1)
+        await service.get_shortcut_configurations(1)
+        for model in models:
+            await service.get_llm_configuration(model.llm_id)
+    return models
+
+
+async def warm_models(models: List[AiLLMConfiguration]) -> int:
+    """让每个 Ollama 端点预先加载本地模型并按 LLM_KEEP_ALIVE 保持驻留，返回加载成功的次数
+
+    num_ctx 与正式请求一致，否则第一次请求时 Ollama 会按新的上下文长度重新加载模型。
+    同一端点上逐个加载，避免显存不足时模型互相挤出；不同端点并行加载。
+    """
+    from ollama import AsyncClient
+
+    plan: Dict[str, List[str]] = {}
+    for model in models:
+        if not model.is_local_llm:
+            continue
+        for backend in llm_router.backends_for(model):
+            if backend.kind == KIND_OLLAMA and backend.serves(model.llm_en_name):
+                plan.setdefault(backend.url, []).append(model.llm_en_name)
+
+    async def load(url: str, names: List[str]) -> int:
+        client = AsyncClient(host=url)
+        loaded = 0
+        try:
+            for name in names:
+                try:
+                    await client.generate(
+                        model=name,
+                        prompt="",
+                        keep_alive=settings.LLM_KEEP_ALIVE or None,
+                        options={"num_ctx": settings.LLM_CONTEXT_WINDOW}
+                    )
+                    loaded += 1
+                except Exception as e:
+                    logger.warning(f"Failed to load model {name} on {url}: {str(e)}")
+        finally:
+            # 预热超时被取消时同样关闭连接池
+            await client.close()
+        return loaded
+
+    return sum(await asyncio.gather(*(load(url, names) for url, names in plan.items())))
+
+
+async def _warmup(stats: Dict[str, Any]) -> None:
+    connections = settings.WARMUP_DB_CONNECTIONS or settings.DB_POOL_SIZE
+    stats["db_connections"] = await warm_db_pool(connections)
+
+    models = await warm_config_cache()
+    stats["models"] = len(models)
+    # 加载配置后登记了全部端点，先检查一次健康状态再开始接收模型请求
+    await llm_router.check_health()
+
+    # 在线程中导入，避免第一次调用模型的请求承担导入耗时
+    await asyncio.to_thread(importlib.import_module, "langchain_ollama")
+    if settings.WARMUP_MODELS:
+        stats["models_loaded"] = await warm_models(models)
+
+
+async def run_warmup(timeout: float) -> Dict[str, Any]:
+    """启动预热：数据库连接池、配置缓存、模型端点健康检查、langchain 导入和 Ollama 模型驻留
+
+    各步骤失败或超时只记录日志，不影响服务启动。
+    """
+    started = time.perf_counter()
+    stats: Dict[str, Any] = {}
+    try:
+        await asyncio.wait_for(_warmup(stats), timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"Warm-up timed out after {timeout}s")
+    except Exception as e:
+        logger.warning(f"Warm-up failed: {str(e)}")
+    stats["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    logger.info(f"Warm-up finished: {stats}")
+    return stats
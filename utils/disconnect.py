@@ -0,0 +1,36 @@
+from fastapi import Request
+from typing import Awaitable, TypeVar
+import asyncio
+
+T = TypeVar("T")
+
+
+class ClientDisconnected(Exception):
+    """客户端在响应返回前断开了连接"""
+
+
+async def cancel_on_disconnect(request: Request, awaitable: Awaitable[T], poll_interval: float) -> T:
+    """运行 awaitable，客户端断开时取消它并抛出 ClientDisconnected
+
+    非流式接口在返回前不会收到断开通知，这里每隔 poll_interval 秒检查一次连接；
+    被取消的一方可以捕获 CancelledError 做清理（如保存部分回答），清理完成后才抛出。
+    poll_interval 为 0 时不检查，直接等待结果。
+    """
+    if not poll_interval:
+        return await awaitable
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                try:
+                    # 取消生效前已经完成时照常返回
+                    return await task
+                except asyncio.CancelledError:
+                    raise ClientDisconnected()
+    finally:
+        if not task.done():
+            task.cancel()
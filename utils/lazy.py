@@ -0,0 +1,22 @@
+from types import ModuleType
+import importlib.util
+import sys
+
+
+def lazy_import(name: str) -> ModuleType:
+    """返回延迟加载的模块，第一次访问其属性时才真正执行导入
+
+    用于 numpy 等只在部分请求中使用、导入耗时较长的依赖，缩短 worker 启动时间。
+    模块未安装时在调用处立即抛出 ModuleNotFoundError。
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
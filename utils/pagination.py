@@ -0,0 +1,26 @@
+from datetime import datetime
+from typing import Any, List, NamedTuple, Optional, Tuple
+import base64
+
+
+class Page(NamedTuple):
+    """一页键集分页结果"""
+    items: List[Any]
+    prev_cursor: Optional[str]  # 加载更早数据时作为 before 传入
+    next_cursor: Optional[str]  # 加载更新数据时作为 after 传入
+
+
+def encode_cursor(create_time: datetime, key: str) -> str:
+    """把 (create_time, 主键) 编码为不透明的游标"""
+    raw = f"{create_time.isoformat()}|{key}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """解析游标，格式错误时抛出 ValueError"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        create_time, key = base64.urlsafe_b64decode(padded).decode("utf-8").split("|", 1)
+        return datetime.fromisoformat(create_time), key
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
@@ -0,0 +1,9 @@
+import json
+from typing import Any, Dict, Optional
+
+
+def format_sse(event: str, data: Dict[str, Any], event_id: Optional[str] = None) -> str:
+    """按 Server-Sent Events 格式编码一条事件；带 event_id 时客户端重连可通过 Last-Event-ID 续读"""
+    payload = json.dumps(data, ensure_ascii=False, default=str)
+    prefix = f"id: {event_id}\n" if event_id else ""
+    return f"{prefix}event: {event}\ndata: {payload}\n\n"